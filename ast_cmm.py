@@ -1,117 +1,294 @@
 
 
-from collections import OrderedDict
-from isa import Cell, Opcode
+from cfg import splice
+from isa import INPUT_PORT, OUTPUT_PORT, Cell, Opcode, fits_immediate, mod_word, wrap_word
+import ir
+import peephole
+from regalloc import allocate_registers
 import logging
 
 
 REG_COUNT = 4
 
+class SymbolTable:
+    """Переменные и пул констант: номер ячейки назначается при первом объявлении"""
+
+    def __init__(self):
+        self.index: dict[str, int] = {}
+        self.cells: list[int] = []
+
+    def declare(self, name: str, value: int) -> int:
+        slot = self.index.get(name)
+        if slot is None:
+            slot = self.index[name] = len(self.cells)
+            self.cells.append(value)
+        else:
+            self.cells[slot] = value
+        return slot
+
+    def slot(self, name: str) -> int:
+        assert name in self.index, "variable %s does not exist" % name
+        return self.index[name]
+
+    def values(self) -> list[int]:
+        return self.cells
+
+    def __contains__(self, name) -> bool:
+        return name in self.index
+
+    def __iter__(self):
+        return iter(self.index)
+
+    def __len__(self) -> int:
+        return len(self.cells)
+
+    def __repr__(self) -> str:
+        return repr(dict(zip(self.index, self.cells)))
+
+
+_BRANCHES = (Opcode.BE, Opcode.BNE, Opcode.JMP)
+
+
 class TranslateState:
     def __init__(self):
         self.text: list[Cell] = []
-        self.vars: OrderedDict[str, int] = {}
+        self.vars: SymbolTable = SymbolTable()
         self.labels: list[int] = []
+        self.symbols: dict[str, int] = {}
         self.pc = 0
+        self.temp_depth = 0
         
     def reset_program(self):
         self.text = list(Cell)
         
     def add_var(self, name, value):
-        self.vars[name] = value
+        self.vars.declare(name, value)
         
+    def rewrite(self, chunks, head=(), tail=()):
+        """Заменяет каждую инструкцию своим списком, head ставит в начало, tail -- перед HLT; метки сохраняются"""
+        self.text, self.labels = splice(self.text, self.labels, chunks, head, tail)
+        self.pc = len(self.text)
+
+    def push_temp(self) -> str:
+        """Ячейка для промежуточного значения выражения; '$' не встречается в именах переменных"""
+        name = "$tmp%d" % self.temp_depth
+        if name not in self.vars:
+            self.add_var(name, 0)
+        self.temp_depth += 1
+        return name
+
+    def pop_temp(self):
+        self.temp_depth -= 1
+
     def get_var_addr(self, name):
-        assert name in self.vars, "variable %s does not exist" % name
-        return  list(self.vars.keys()).index(name) + len(self.text)
+        return self.vars.slot(name) + len(self.text)
     
     def link(self):
+        """Один проход: метки заменяются адресами, имена -- адресами ячеек за кодом"""
         self.text.append({"opcode": Opcode.HLT})
-        text_len = len(self.text)
+        data_start = len(self.text)
+        labels = self.labels
+        slot = self.vars.slot
         for instr in self.text:
-            if instr["opcode"] == Opcode.BE or instr["opcode"] == Opcode.BNE or instr["opcode"] == Opcode.JMP:
-                instr["args"][0] = self.labels[int(instr["args"][0])]
-            elif instr["opcode"] == Opcode.HLT:
-                pass
-            else:
-                for i, name in enumerate(instr["args"]):
+            opcode = instr["opcode"]
+            if opcode in _BRANCHES:
+                instr["args"][0] = labels[int(instr["args"][0])]
+            elif opcode != Opcode.HLT:
+                args = instr["args"]
+                for i, name in enumerate(args):
                     if isinstance(name, str):
-                        instr["args"][i] = self.get_var_addr(name)
+                        args[i] = data_start + slot(name)
         
-        for var in self.vars.values():
-            self.text.append(var)
+        self.symbols = {name: data_start + index for name, index in self.vars.index.items()}
+        self.text.extend(self.vars.values())
             
 
-def translate(ast):
+# оптимизации кода до компоновки в порядке применения
+OPTIMIZATIONS = {
+    "peephole": peephole.optimize,
+    "regalloc": allocate_registers,
+}
+
+
+def uses_ir(optimizations) -> bool:
+    """Код генерируется через ir, если выбран он сам или любой из его проходов"""
+    return any(name == "ir" or name in ir.PASSES for name in optimizations)
+
+
+def translate_with_symbols(ast, optimizations=()) -> tuple[list[Cell], dict[str, int]]:
+    for name in optimizations:
+        assert name in OPTIMIZATION_NAMES, "Unknown optimization %s" % name
+    for name, optimize in AST_OPTIMIZATIONS.items():
+        if name in optimizations:
+            ast = optimize(ast)
     state: TranslateState = TranslateState()
-    ast.eval(state)
-    print(state.vars)
-    print(state.labels)
+    if uses_ir(optimizations):
+        ir.translate(ast, state, [name for name in optimizations if name in ir.PASSES])
+    else:
+        walk(ast, lambda statement: statement.eval(state))
+    logging.debug("%s", state.vars)
+    logging.debug("%s", state.labels)
+    for name, optimize in OPTIMIZATIONS.items():
+        if name in optimizations:
+            optimize(state)
     state.link()
-    return state.text
+    return state.text, state.symbols
+
+
+def translate(ast, optimizations=()):
+    return translate_with_symbols(ast, optimizations)[0]
 
 
 class Equality:
+    """Узел дерева: поля перечислены в __slots__; сравнение и repr обходят дерево с явным стеком"""
+    __slots__ = ()
+
     def __eq__(self, other):
-        return isinstance(other, self.__class__) and self.__dict__ == other.__dict__
+        work = [(self, other)]
+        while work:
+            left, right = work.pop()
+            if isinstance(left, Equality):
+                if not isinstance(right, left.__class__):
+                    return False
+                work.extend((getattr(left, field), getattr(right, field)) for field in left.__slots__)
+            elif isinstance(left, list):
+                if not isinstance(right, list) or len(left) != len(right):
+                    return False
+                work.extend(zip(left, right))
+            elif left != right:
+                return False
+        return True
     
     def __ne__(self, other):
         return not self.__eq__(other)
+
+    def __repr__(self):
+        parts = []
+        work = [self]
+        while work:
+            item = work.pop()
+            if isinstance(item, Equality):
+                fields = [getattr(item, field) for field in item.__slots__]
+                work.append(')')
+                for i in reversed(range(len(fields))):
+                    work.append(fields[i])
+                    if i:
+                        work.append(', ')
+                work.append(item.__class__.__name__ + '(')
+            elif isinstance(item, list):
+                work.append(']')
+                for i in reversed(range(len(item))):
+                    work.append(item[i])
+                    if i:
+                        work.append(', ')
+                work.append('[')
+            else:
+                parts.append(str(item))
+        return ''.join(parts)
     
     
 class Aexp(Equality):
-    pass
+    __slots__ = ()
 
 
 class IntAexp(Aexp):
+    __slots__ = ('i',)
+
     def __init__(self, i):
         self.i = i
         
-    def __repr__(self):
-        return 'IntAexp(%d)' % self.i
-    
     def eval(self, state):
         return self.i
 
+    def fold(self, env):
+        return self
+
+    def check_declared(self, declared):
+        pass
+
+    def lower(self, builder):
+        return builder.const(self.i)
+
     
     
 class VarAexp(Aexp):
+    __slots__ = ('name',)
+
     def __init__(self, name):
         self.name = name
         
-    def __repr__(self):
-        return 'VarAexp(%s)' % self.name
-    
     def eval(self, state: TranslateState, reg: int):
         assert self.name in state.vars, "Error, var %s is not declared" % self.name
         state.text.append({"opcode": Opcode.LD, "args": [self.name, reg]})
         state.pc += 1
+
+    def fold(self, env):
+        return IntAexp(env[self.name]) if self.name in env else self
+
+    def check_declared(self, declared):
+        assert self.name in declared, "Error, var %s is not declared" % self.name
+
+    def lower(self, builder):
+        return builder.emit(ir.IrOp.LOAD, name=self.name)
         
     
 
+IMMEDIATE_BINOPS = {'+': Opcode.ADDI, '-': Opcode.SUBI, '%': Opcode.MODI}
+
+
+def is_immediate(aexp) -> bool:
+    return isinstance(aexp, IntAexp) and fits_immediate(aexp.i)
+
+
+def load_operand(state: TranslateState, aexp, reg: int):
+    if is_immediate(aexp):
+        state.text.append({"opcode": Opcode.LDI, "args": [aexp.i, reg]})
+        state.pc += 1
+    elif isinstance(aexp, IntAexp):
+        # константа не помещается в поле инструкции -- ячейка пула констант
+        if str(aexp.eval(state)) not in state.vars:
+            state.add_var(str(aexp.eval(state)), aexp.eval(state))
+        state.text.append({"opcode": Opcode.LD, "args": [str(aexp.eval(state)), reg]})
+        state.pc += 1
+    else:
+        aexp.eval(state, reg)
+
+
+def load_operands(state: TranslateState, left, right):
+    """Левый операнд в R1, правый в R2.
+
+    Вычисление составного выражения портит R1 и R2, поэтому составной правый
+    операнд вычисляется первым и на время вычисления левого сохраняется в памяти.
+    """
+    if isinstance(right, BinopAexp):
+        load_operand(state, right, 2)
+        temp = state.push_temp()
+        state.text.append({"opcode": Opcode.ST, "args": [2, temp]})
+        state.pc += 1
+        load_operand(state, left, 1)
+        state.pop_temp()
+        state.text.append({"opcode": Opcode.LD, "args": [temp, 2]})
+        state.pc += 1
+    else:
+        load_operand(state, left, 1)
+        load_operand(state, right, 2)
+
+
 class BinopAexp(Aexp):
+    __slots__ = ('op', 'left', 'right')
+
     def __init__(self, op, left, right):
         self.op = op
         self.left = left
         self.right = right
         
-    def __repr__(self):
-        return 'BinopAexp(%s, %s, %s)' % (self.op, self.left, self.right)
-    
     def eval(self, state: TranslateState, reg: int):
-        if isinstance(self.left, IntAexp):
-            if str(self.left.eval(state)) not in state.vars:
-                state.add_var(str(self.left.eval(state)), self.left.eval(state))
-            state.text.append({"opcode": Opcode.LD, "args": [str(self.left.eval(state)), 1]})
+        if is_immediate(self.right):
+            load_operand(state, self.left, 1)
+            state.text.append({"opcode": IMMEDIATE_BINOPS[self.op], "args": [1, self.right.i, reg]})
             state.pc += 1
-        else:
-            self.left.eval(state, 1)
-        if isinstance(self.right, IntAexp):
-            if str(self.right.eval(state)) not in state.vars:
-                state.add_var(str(self.right.eval(state)), self.right.eval(state))
-            state.text.append({"opcode": Opcode.LD, "args": [str(self.right.eval(state)), 2]})
-            state.pc += 1    
-        else:
-            self.right.eval(state, 2)
+            return
+        load_operands(state, self.left, self.right)
         if (self.op == '+'):
             state.text.append({"opcode": Opcode.ADD, "args": [1, 2, reg]})
         elif (self.op == '-'):
@@ -119,63 +296,90 @@ class BinopAexp(Aexp):
         elif (self.op == '%'):
             state.text.append({"opcode": Opcode.MOD, "args": [1, 2, reg]})
         state.pc += 1
+
+    def fold(self, env):
+        left = self.left.fold(env)
+        right = self.right.fold(env)
+        if isinstance(left, IntAexp) and isinstance(right, IntAexp):
+            return IntAexp(FOLD_BINOPS[self.op](left.i, right.i))
+        return BinopAexp(self.op, left, right)
+
+    def check_declared(self, declared):
+        self.left.check_declared(declared)
+        self.right.check_declared(declared)
+
+    def lower(self, builder):
+        left = self.left.lower(builder)
+        if is_immediate(self.right):
+            return builder.emit(ir.IrOp(self.op), [left], imm=self.right.i)
+        return builder.emit(ir.IrOp(self.op), [left, self.right.lower(builder)])
     
     
 class Bexp(Equality):
-    pass
+    __slots__ = ()
 
 
 class RelopBexp(Bexp):
+    __slots__ = ('op', 'left', 'right')
+
     def __init__(self, op, left, right):
         self.op = op
         self.left = left
         self.right = right
         
-    def __repr__(self):
-        return 'RelopBexp(%s, %s, %s)' % (self.op, self.left, self.right)
-    
     def eval(self, state: TranslateState):
-        if isinstance(self.left, IntAexp):
-            if str(self.left.eval(state)) not in state.vars:
-                state.add_var(str(self.left.eval(state)), self.left.eval(state))
-            state.text.append({"opcode": Opcode.LD, "args": [str(self.left.eval(state)), 1]})
-            state.pc += 1
-        else:
-            self.left.eval(state, 1)   
-        if isinstance(self.right, IntAexp):
-            if str(self.right.eval(state)) not in state.vars:
-                state.add_var(str(self.right.eval(state)), self.right.eval(state))
-            state.text.append({"opcode": Opcode.LD, "args": [str(self.right.eval(state)), 2]})
-            state.pc += 1    
+        if is_immediate(self.right):
+            load_operand(state, self.left, 1)
+            state.text.append({"opcode": Opcode.SUBI, "args": [1, self.right.i, 0]})
         else:
-            self.right.eval(state, 2)
-        state.text.append({"opcode": Opcode.SUB, "args": [1, 2, 0]})
+            load_operands(state, self.left, self.right)
+            state.text.append({"opcode": Opcode.SUB, "args": [1, 2, 0]})
         state.pc += 1
         return self.op == "=="
+
+    def fold(self, env):
+        return RelopBexp(self.op, self.left.fold(env), self.right.fold(env))
+
+    def static_value(self):
+        """Значение условия, если обе части -- константы, иначе None"""
+        if isinstance(self.left, IntAexp) and isinstance(self.right, IntAexp):
+            return (self.left.i == self.right.i) == (self.op == "==")
+        return None
+
+    def check_declared(self, declared):
+        self.left.check_declared(declared)
+        self.right.check_declared(declared)
+
+    def lower(self, builder, if_true, if_false):
+        """Завершает текущий блок переходом по условию"""
+        left = self.left.lower(builder)
+        if is_immediate(self.right):
+            builder.terminate(ir.Branch(self.op, left, None, self.right.i, if_true, if_false))
+        else:
+            builder.terminate(ir.Branch(self.op, left, self.right.lower(builder), None, if_true, if_false))
     
     
     
     
 class Statement(Equality):
-    pass
+    """eval и lower генерируют код самого оператора и возвращают то, что обрабатывается
+    следом по порядку: вложенные операторы и функции, завершающие оператор (см. walk)"""
+    __slots__ = ()
 
 
 class AssignStatement(Statement):
+    __slots__ = ('name', 'aexp')
+
     def __init__(self, name, aexp):
         self.name = name
         self.aexp = aexp
         
-    def __repr__(self) -> str:
-        return 'AssignStatement(%s, %s)' % (self.name, self.aexp)
-    
     def eval(self, state: TranslateState):
         if self.name in state.vars:
             if isinstance(self.aexp, IntAexp):
-                if str(self.aexp.eval(state)) not in state.vars:
-                    state.add_var(str(self.aexp.eval(state)), self.aexp.eval(state))
-                state.text.append({"opcode": Opcode.LD, "args": [str(self.aexp.eval(state)), 0]})
+                load_operand(state, self.aexp, 0)
                 state.text.append({"opcode": Opcode.ST, "args": [0, self.name]})
-                state.pc += 2
+                state.pc += 1
             else:
                 self.aexp.eval(state, 0)
                 state.text.append({"opcode": Opcode.ST, "args": [0, self.name]})
@@ -188,29 +392,125 @@ class AssignStatement(Statement):
                 self.aexp.eval(state, 0)
                 state.text.append({"opcode": Opcode.ST, "args": [0, self.name]})
                 state.pc += 1
+        return ()
+
+    def declare(self, declared):
+        if self.name in declared:
+            self.aexp.check_declared(declared)
+            return self
+        # первое присваивание константы -- начальное значение в памяти, кода для него нет
+        if isinstance(self.aexp, IntAexp):
+            declared[self.name] = self.aexp.i
+            return None
+        declared[self.name] = 0
+        self.aexp.check_declared(declared)
+        return self
+
+    def fold(self, env):
+        aexp = self.aexp.fold(env)
+        if isinstance(aexp, IntAexp):
+            env[self.name] = aexp.i
+        else:
+            env.pop(self.name, None)
+        return AssignStatement(self.name, aexp)
+
+    def assigned(self):
+        return {self.name}
+
+    def lower(self, builder):
+        builder.emit(ir.IrOp.STORE, [self.aexp.lower(builder)], name=self.name)
+        return ()
+
+
+class ScanStatement(Statement):
+    """scan x: следующий токен входного потока записывается в переменную"""
+    __slots__ = ('name',)
+
+    def __init__(self, name):
+        self.name = name
+
+    def eval(self, state: TranslateState):
+        if self.name not in state.vars:
+            state.add_var(self.name, 0)
+        state.text.append({"opcode": Opcode.IN, "args": [INPUT_PORT, 0]})
+        state.text.append({"opcode": Opcode.ST, "args": [0, self.name]})
+        state.pc += 2
+        return ()
+
+    def declare(self, declared):
+        declared.setdefault(self.name, 0)
+        return self
+
+    def fold(self, env):
+        env.pop(self.name, None)
+        return self
+
+    def assigned(self):
+        return {self.name}
+
+    def lower(self, builder):
+        builder.emit(ir.IrOp.STORE, [builder.emit(ir.IrOp.IN, imm=INPUT_PORT)], name=self.name)
+        return ()
+
+
+class PrintStatement(Statement):
+    """print e: значение выражения выводится токеном в выходной поток"""
+    __slots__ = ('aexp',)
+
+    def __init__(self, aexp):
+        self.aexp = aexp
+
+    def eval(self, state: TranslateState):
+        load_operand(state, self.aexp, 0)
+        state.text.append({"opcode": Opcode.OUT, "args": [0, OUTPUT_PORT]})
+        state.pc += 1
+        return ()
+
+    def declare(self, declared):
+        self.aexp.check_declared(declared)
+        return self
+
+    def fold(self, env):
+        return PrintStatement(self.aexp.fold(env))
+
+    def assigned(self):
+        return set()
+
+    def lower(self, builder):
+        builder.emit(ir.IrOp.OUT, [self.aexp.lower(builder)], imm=OUTPUT_PORT)
+        return ()
             
     
-class CompoundStatement(Statement):
-    def __init__(self, first, second) -> None:
-        self.first = first
-        self.second = second
-        
-    def __repr__(self) -> str:
-        return 'CompoundStatement(%s, %s)' % (self.first, self.second)
-    
+class Block(Statement):
+    """Последовательность операторов плоским списком; вложенных Block в statements нет"""
+    __slots__ = ('statements',)
+
+    def __init__(self, statements):
+        self.statements = statements
+
     def eval(self, state: TranslateState):
-        self.first.eval(state)
-        self.second.eval(state)
+        return self.statements
+
+    def declare(self, declared):
+        return block(statement.declare(declared) for statement in self.statements)
+
+    def fold(self, env):
+        return block(statement.fold(env) for statement in self.statements)
+
+    def assigned(self):
+        return set().union(*(statement.assigned() for statement in self.statements))
+
+    def lower(self, builder):
+        return self.statements
     
     
 class IfStatement(Statement):
+    __slots__ = ('condition', 'body')
+
     def __init__(self, condition, body):
         self.condition = condition
         self.body = body
         
-    def __repr__(self) -> str:
-        return 'IfStatement(%s, %s)' % (self.condition, self.body)
-    
     def eval(self, state: TranslateState):
         condition = self.condition.eval(state)
         if_num = len(state.labels)
@@ -221,18 +521,45 @@ class IfStatement(Statement):
             opcode = Opcode.BE
         state.text.append({"opcode": opcode, "args": [str(if_num)]})
         state.pc += 1
-        self.body.eval(state)
-        state.labels[if_num] = state.pc
+
+        def finish():
+            state.labels[if_num] = state.pc
+        return self.body, finish
+
+    def declare(self, declared):
+        self.condition.check_declared(declared)
+        body = self.body.declare(declared)
+        return IfStatement(self.condition, body) if body is not None else None
+
+    def fold(self, env):
+        condition = self.condition.fold(env)
+        value = condition.static_value()
+        if value is not None:
+            return self.body.fold(env) if value else None
+        body_env = dict(env)
+        body = self.body.fold(body_env)
+        for name, known in list(env.items()):
+            if body_env.get(name) != known:
+                del env[name]
+        return IfStatement(condition, body) if body is not None else None
+
+    def assigned(self):
+        return self.body.assigned()
+
+    def lower(self, builder):
+        body, join = builder.new_block(), builder.new_block()
+        self.condition.lower(builder, body, join)
+        builder.start_block(body)
+        return self.body, lambda: builder.start_block(join)
     
     
 class WhileStatement(Statement):
+    __slots__ = ('condition', 'body')
+
     def __init__(self, condition, body):
         self.condition = condition
         self.body = body
         
-    def __repr__(self) -> str:
-        return 'WhileStatement(%s, %s)' % (self.condition, self.body)
-    
     def eval(self, state: TranslateState):
         cond_pc = state.pc
         cond = self.condition.eval(state)
@@ -245,7 +572,106 @@ class WhileStatement(Statement):
             opcode = Opcode.BE
         state.text.append({"opcode": opcode, "args": [str(while_num)]})
         state.pc += 1
-        self.body.eval(state)
-        state.text.append({"opcode": Opcode.JMP, "args": [str(while_num + 1)]})
-        state.pc += 1
-        state.labels[while_num] = state.pc
\ No newline at end of file
+
+        def finish():
+            state.text.append({"opcode": Opcode.JMP, "args": [str(while_num + 1)]})
+            state.pc += 1
+            state.labels[while_num] = state.pc
+        return self.body, finish
+
+    def declare(self, declared):
+        self.condition.check_declared(declared)
+        body = self.body.declare(declared)
+        # пустой цикл не выразить; оставшиеся в теле присваивания не наблюдаемы: цикл либо не исполняется, либо бесконечен
+        return WhileStatement(self.condition, body if body is not None else self.body)
+
+    def fold(self, env):
+        if self.condition.fold(env).static_value() is False:
+            return None
+        for name in self.body.assigned():
+            env.pop(name, None)
+        condition = self.condition.fold(env)
+        body = self.body.fold(dict(env))
+        return WhileStatement(condition, body if body is not None else self.body)
+
+    def assigned(self):
+        return self.body.assigned()
+
+    def lower(self, builder):
+        preheader = builder.block
+        header, body, exit = builder.new_block(), builder.new_block(), builder.new_block()
+        builder.start_block(header)
+        self.condition.lower(builder, body, exit)
+        builder.start_block(body)
+
+        def finish():
+            builder.terminate(ir.Jump(header))
+            builder.loop(preheader, header)
+            builder.start_block(exit)
+        return self.body, finish
+
+
+FOLD_BINOPS = {
+    '+': lambda left, right: wrap_word(left + right),
+    '-': lambda left, right: wrap_word(left - right),
+    '%': mod_word,
+}
+
+
+def block(statements):
+    """Один оператор из последовательности: вложенные Block раскрываются, удалённые (None) пропускаются"""
+    flat = []
+    for statement in statements:
+        if isinstance(statement, Block):
+            flat.extend(statement.statements)
+        elif statement is not None:
+            flat.append(statement)
+    if not flat:
+        return None
+    return flat[0] if len(flat) == 1 else Block(flat)
+
+
+def append_statement(first, second):
+    """Продолжение последовательности при разборе слева направо.
+
+    Block, который вернул этот же вызов на предыдущем шаге, дополняется на месте,
+    поэтому разбор n операторов линеен; первый аргумент -- всегда такой Block или не Block.
+    """
+    if isinstance(first, Block):
+        first.statements.append(second)
+        return first
+    return Block([first, second])
+
+
+def walk(root, visit):
+    """Обход операторов с явным стеком: visit(statement) генерирует код оператора и возвращает
+    вложенные операторы и завершающие функции, которые обрабатываются следом по порядку"""
+    work = [root]
+    while work:
+        item = work.pop()
+        if isinstance(item, Statement):
+            work.extend(reversed(visit(item)))
+        else:
+            item()
+
+
+def fold_constants(ast):
+    """Свёртка и распространение констант до генерации кода.
+
+    Начальные значения переменных выносятся в начало программы, поэтому перенос
+    констант не меняет того, какие присваивания происходят при загрузке.
+    """
+    declared: dict[str, int] = {}
+    body = ast.declare(declared)
+    body = body.fold(dict(declared)) if body is not None else None
+    return block([*(AssignStatement(name, IntAexp(value)) for name, value in declared.items()), body])
+
+
+# оптимизации дерева до генерации кода
+AST_OPTIMIZATIONS = {
+    "fold": fold_constants,
+}
+
+
+# все имена, которые принимает translate_with_symbols: "ir" и проходы ir заменяют генерацию кода
+OPTIMIZATION_NAMES = (*AST_OPTIMIZATIONS, "ir", *ir.PASSES, *OPTIMIZATIONS)
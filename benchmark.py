@@ -0,0 +1,641 @@
+"""Замеры производительности транслятора и модели процессора"""
+import concurrent.futures
+import glob
+import itertools
+import os
+import random
+import struct
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from ast_cmm import TranslateState, walk
+from compile_cache import CompileCache
+from isa import INPUT_PORT, OUTPUT_PORT, load_code, write_code_binary
+from lanes import run_lanes
+from lexer import lex
+from machine import INSTR_LIMIT, ControlUnit, DataPath, ExecMode, Job, LoadedProgram, Machine, SchedulePolicy, \
+    Scheduler, TokenIO, load_memory, memory_digest, run, run_batch
+from parser_cmm import parse_cmm
+from parser_rd import ParseError
+from ports import ListSink, PortIO, TextTokenSink, TokenFileSource
+from translator import compile_source, translate_batch
+
+
+def generate_program(statements: int, depth: int = 4, seed: int = 0) -> str:
+    """Синтетическая программа: вложенные if/while глубиной до depth, всего statements операторов"""
+    rng = random.Random(seed)
+    names = ["v{}".format(i) for i in range(16)]
+    lines = ["{} = {}".format(name, i) for i, name in enumerate(names)]
+    count = len(lines)
+
+    def block(level: int) -> list[str]:
+        nonlocal count
+        body = []
+        while count < statements and len(body) < 4:
+            count += 1
+            kind = rng.randrange(4) if level < depth else 0
+            left, right = rng.choice(names), rng.choice(names)
+            if kind == 0:
+                body.append("{} = {} {} {}".format(left, right, rng.choice("+-%"), rng.randrange(1, 100)))
+            else:
+                keyword = "if" if kind < 3 else "while"
+                inner = block(level + 1) or ["{} = {}".format(left, right)]
+                body.append("{} {} {} {} {{ {} }}".format(keyword, left, rng.choice(["==", "!="]), right,
+                                                          "; ".join(inner)))
+        return body
+
+    while count < statements:
+        lines.extend(block(0))
+    return ";\n".join(lines)
+
+
+def timed(function, *args, **kwargs):
+    start = time.perf_counter()
+    result = function(*args, **kwargs)
+    return result, time.perf_counter() - start
+
+
+def bench_packrat(sizes=(1000, 5000, 10000, 20000)):
+    """Время разбора без мемоизации и в режиме packrat в зависимости от размера программы"""
+    print("{:>10} {:>10} {:>12} {:>12} {:>14}".format("stmts", "tokens", "plain, s", "packrat, s", "packrat us/tok"))
+    for size in sizes:
+        tokens = lex(generate_program(size))
+        plain, plain_time = timed(parse_cmm, tokens)
+        memo, memo_time = timed(parse_cmm, tokens, packrat=True)
+        assert plain is not None and memo is not None and plain.value == memo.value
+        print("{:>10} {:>10} {:>12.3f} {:>12.3f} {:>14.2f}".format(
+            size, len(tokens), plain_time, memo_time, memo_time / len(tokens) * 1e6))
+
+
+def parse_or_none(tokens, engine):
+    try:
+        result = parse_cmm(tokens, engine=engine)
+    except ParseError:
+        return None
+    return result.value if result else None
+
+
+def check_parsers_agree(programs: int = 300, seed: int = 0):
+    """Дифференциальная проверка: оба движка принимают и отвергают одни и те же программы с одинаковым AST"""
+    rng = random.Random(seed)
+    for i in range(programs):
+        tokens = lex(generate_program(rng.randrange(1, 60), depth=rng.randrange(0, 4), seed=i))
+        if i % 2:
+            # порча программы: удаление, дублирование или перестановка лексемы
+            j = rng.randrange(len(tokens))
+            kind = rng.randrange(3)
+            if kind == 0:
+                del tokens[j]
+            elif kind == 1:
+                tokens.insert(j, tokens[j])
+            else:
+                k = rng.randrange(len(tokens))
+                tokens[j], tokens[k] = tokens[k], tokens[j]
+        combinators = parse_or_none(tokens, 'combinators')
+        rd = parse_or_none(tokens, 'rd')
+        assert combinators == rd, "parsers disagree on program {}".format(i)
+
+
+def bench_parsers(sizes=(1000, 5000, 10000, 20000)):
+    """Комбинаторный парсер против рекурсивного спуска на одних и тех же программах"""
+    check_parsers_agree()
+    print("{:>10} {:>10} {:>14} {:>10} {:>10}".format("stmts", "tokens", "combinators, s", "rd, s", "speedup"))
+    for size in sizes:
+        tokens = lex(generate_program(size))
+        combinators, combinators_time = timed(parse_cmm, tokens)
+        rd, rd_time = timed(parse_cmm, tokens, engine='rd')
+        assert combinators.value == rd.value
+        print("{:>10} {:>10} {:>14.3f} {:>10.3f} {:>10.1f}".format(
+            size, len(tokens), combinators_time, rd_time, combinators_time / rd_time))
+
+
+def generate_linker_program(variables: int, statements: int, seed: int = 0) -> str:
+    """Синтетическая программа с большим числом переменных и констант"""
+    rng = random.Random(seed)
+    lines = ["x{} = {}".format(i, i) for i in range(variables)]
+    for _ in range(statements):
+        left, right = rng.randrange(variables), rng.randrange(variables)
+        lines.append("x{} = x{} + {}".format(left, right, rng.randrange(variables)))
+    return ";\n".join(lines)
+
+
+def bench_linker(sizes=(1000, 2000, 4000, 8000)):
+    """Время генерации кода и компоновки в зависимости от числа переменных"""
+    print("{:>10} {:>10} {:>10} {:>10} {:>14}".format("vars", "cells", "eval, s", "link, s", "link us/cell"))
+    for size in sizes:
+        ast = parse_cmm(lex(generate_linker_program(size, 2 * size)), engine='rd').value
+        state = TranslateState()
+        _, eval_time = timed(walk, ast, lambda statement: statement.eval(state))
+        _, link_time = timed(state.link)
+        assert all(state.text[address] == state.vars.values()[index]
+                   for address, index in zip(state.symbols.values(), range(len(state.vars))))
+        print("{:>10} {:>10} {:>10.3f} {:>10.3f} {:>14.2f}".format(
+            len(state.vars), len(state.text), eval_time, link_time, link_time / len(state.text) * 1e6))
+
+
+def compile_program(source: str, optimizations=()):
+    image = compile_source(source, optimizations)
+    return image.words, image.symbols
+
+
+def run_program(code, symbols: dict[str, int], memory_size: int = 4096, limit: int = 100000):
+    """Исполняет код в быстром режиме; значения символов, число инструкций и тактов или None при превышении limit"""
+    data_path = DataPath(load_memory(code, memory_size), memory_size)
+    control_unit = ControlUnit(data_path)
+    handlers = control_unit.decode_program(len(code))
+    registers = data_path.registers
+    instr_counter = 0
+    try:
+        while instr_counter < limit:
+            handlers[registers[4]]()
+            instr_counter += 1
+        return None
+    except StopIteration:
+        pass
+    values = {name: data_path.memory[address] for name, address in symbols.items()}
+    return values, instr_counter, control_unit.current_tick()
+
+
+def check_optimizations_agree(optimizations, programs: int = 300, seed: int = 0):
+    """Дифференциальная проверка: оптимизированный код оставляет в переменных те же значения"""
+    rng = random.Random(seed)
+    checked = 0
+    for i in range(programs):
+        source = generate_program(rng.randrange(1, 80), depth=rng.randrange(0, 4), seed=i)
+        expected = run_program(*compile_program(source))
+        if expected is None:
+            continue
+        actual = run_program(*compile_program(source, optimizations))
+        assert actual is not None and variables(actual[0]) == variables(expected[0]), \
+            "{} changes the result of program {}".format(",".join(optimizations), i)
+        checked += 1
+    return checked
+
+
+def variables(values: dict[str, int]) -> dict[str, int]:
+    """Значения переменных программы без пула констант и временных ячеек"""
+    return {name: value for name, value in values.items() if name.isidentifier()}
+
+
+def generate_constant_program(statements: int, seed: int = 0) -> str:
+    """Синтетическая программа с константными подвыражениями, условиями и конечными циклами"""
+    rng = random.Random(seed)
+    names = ["v{}".format(i) for i in range(6)]
+    lines = ["{} = {}".format(name, rng.randrange(0, 20)) for name in names]
+
+    def aexp(depth: int) -> str:
+        if depth == 0 or rng.random() < 0.3:
+            return str(rng.randrange(0, 20)) if rng.random() < 0.6 else rng.choice(names)
+        return "({} {} {})".format(aexp(depth - 1), rng.choice("+-%"), aexp(depth - 1))
+
+    for i in range(statements):
+        kind = rng.randrange(4)
+        assign = "{} = {}".format(rng.choice(names), aexp(3))
+        if kind == 0:
+            lines.append(assign)
+        elif kind == 1:
+            lines.append("if {} {} {} {{ {} }}".format(aexp(2), rng.choice(["==", "!="]), aexp(1), assign))
+        elif kind == 2:
+            # счётчик не меняется в теле, поэтому цикл конечен
+            counter = "c{}".format(i)
+            lines.append("{0} = 0; while {0} != {1} {{ {2}; {0} = {0} + 1 }}".format(counter, rng.randrange(0, 4), assign))
+        else:
+            lines.append("while {} == {} {{ {} }}".format(rng.randrange(3), rng.randrange(3, 6), assign))
+    return ";\n".join(lines)
+
+
+def bench_fold(programs: int = 300):
+    """Свёртка констант: совпадение результатов и выигрыш в длине кода и тактах"""
+    checked = check_optimizations_agree(["fold"])
+    rng = random.Random(1)
+    totals = [0, 0, 0, 0]
+    for i in range(programs):
+        source = generate_constant_program(rng.randrange(1, 30), seed=i)
+        code, symbols = compile_program(source)
+        folded_code, folded_symbols = compile_program(source, ["fold"])
+        expected, _, ticks = run_program(code, symbols)
+        actual, _, folded_ticks = run_program(folded_code, folded_symbols)
+        assert variables(actual) == variables(expected), "fold changes the result of program {}".format(i)
+        for j, value in enumerate((len(code), len(folded_code), ticks, folded_ticks)):
+            totals[j] += value
+    print("{} + {} random programs agree".format(checked, programs))
+    print("code size: {} -> {}, ticks: {} -> {}".format(*totals))
+
+
+# по программе на каждое правило оконного оптимизатора; неизменяемые переменные -- известные константы
+PEEPHOLE_RULES = {
+    "store-load": "x = 5; y = 0; y = x + 2; x = y + 3",
+    "constant-reload": "x = 1; y = 0; x = 3 - y; y = 3 - x",
+    "immediate": "k = 7; x = 0; i = 0; while i != 5 { x = x + k; i = i + 1 }",
+    "zero-compare": "zero = 0; x = 8; y = 0; while x != zero { x = x - 2; y = y + x }",
+    "inc": "one = 1; i = 0; while i != 10 { i = i + one }",
+    "dec": "one = 1; i = 10; s = 0; while i != 0 { s = s + i; i = i - one }",
+}
+
+
+def bench_peephole():
+    """Число тактов до и после оконной оптимизации для каждого правила"""
+    print("{:>16} {:>10} {:>10} {:>10} {:>10}".format("rule", "instrs", "ticks", "opt instrs", "opt ticks"))
+    for rule, source in PEEPHOLE_RULES.items():
+        expected, instrs, ticks = run_program(*compile_program(source))
+        actual, opt_instrs, opt_ticks = run_program(*compile_program(source, ["peephole"]))
+        assert actual == expected and opt_ticks < ticks, "rule {} does not pay off".format(rule)
+        print("{:>16} {:>10} {:>10} {:>10} {:>10}".format(rule, instrs, ticks, opt_instrs, opt_ticks))
+    for optimizations in (["peephole"], ["peephole", "regalloc"]):
+        checked = check_optimizations_agree(optimizations)
+        print("{}: {} random programs agree".format(",".join(optimizations), checked))
+
+
+def bench_ir(example: str = "examples/prob1.cmm"):
+    """Прямая генерация кода против генерации через IR: совпадение результатов, инструкции и такты"""
+    for passes in (["ir"], ["dse", "licm"], ["fold", "dse", "licm", "peephole"]):
+        checked = check_optimizations_agree(passes)
+        print("{}: {} random programs agree".format(",".join(passes), checked))
+    with open(example, encoding="utf-8") as file:
+        source = file.read()
+    print("{:>28} {:>10} {:>10} {:>10}".format("optimizations", "code", "instrs", "ticks"))
+    expected = None
+    for optimizations in ([], ["fold", "peephole", "regalloc"], ["dse", "licm"], ["fold", "dse", "licm", "peephole"]):
+        code, symbols = compile_program(source, optimizations)
+        values, instrs, ticks = run_program(code, symbols, limit=10 ** 7)
+        expected = expected or variables(values)
+        assert variables(values) == expected, "{} changes the result".format(",".join(optimizations))
+        print("{:>28} {:>10} {:>10} {:>10}".format(",".join(optimizations) or "-", len(code), instrs, ticks))
+
+
+# циклы с индуктивной переменной и проверками остатка
+INDUCTION_PROGRAMS = {
+    "fizzbuzz": "s = 0; i = 1; while i != 3000 { if i % 3 == 0 { s = s + i }; if i % 5 == 0 { s = s - 1 }; i = i + 1 }",
+    "even-step": "s = 0; i = 0; while i != 4000 { if i % 2 == 0 { s = s + 1 }; if i % 7 == 3 { s = s + i }; i = i + 2 }",
+    "countdown": "s = 0; i = 2000; while i != 0 { if i % 4 != 0 { s = s + i % 4 }; i = i - 1 }",
+    "nested": "s = 0; i = 0; while i != 40 { j = 0; while j != 30 { if j % 3 == 0 { s = s + i }; j = j + 3 }; i = i + 1 }",
+}
+
+
+def bench_induction(optimizations=("dse", "licm")):
+    """Оптимизация циклов с индуктивными переменными: результаты всех примеров и тактов без неё и с ней"""
+    checked = check_optimizations_agree(["induction", *optimizations])
+    print("induction: {} random programs agree".format(checked))
+    programs = dict(INDUCTION_PROGRAMS)
+    for example in sorted(glob.glob("examples/*.cmm")):
+        with open(example, encoding="utf-8") as file:
+            programs[example] = file.read()
+    print("{:>20} {:>10} {:>10} {:>10} {:>10}".format("program", "ticks", "opt ticks", "ind ticks", "speedup"))
+    for name, source in programs.items():
+        expected, _, ticks = run_program(*compile_program(source), limit=10 ** 7)
+        optimized, _, opt_ticks = run_program(*compile_program(source, list(optimizations)), limit=10 ** 7)
+        actual, _, ind_ticks = run_program(*compile_program(source, ["induction", *optimizations]), limit=10 ** 7)
+        assert variables(actual) == variables(optimized) == variables(expected), \
+            "induction changes the result of {}".format(name)
+        print("{:>20} {:>10} {:>10} {:>10} {:>10.2f}".format(name, ticks, opt_ticks, ind_ticks, opt_ticks / ind_ticks))
+
+
+# ввод-вывод токенами: бегущие суммы n введённых чисел
+IO_PROGRAM = "n = 0; s = 0; scan n; while n != 0 { scan x; s = s + x; print s; n = n - 1 }"
+# программа без ввода для сравнения с запуском translator.py и machine.py
+API_PROGRAM = "s = 0; i = 0; while i != 10 { s = s + i; print s; i = i + 1 }"
+
+
+def bench_api(calls: int = 2000, processes: int = 10):
+    """Трансляция и исполнение в процессе (compile_source + run) против запуска транслятора и модели процессами"""
+    tokens = [5, 1, 2, 3, 4, 5]
+    for optimizations in ([], ["fold", "peephole", "regalloc"], ["induction", "dse", "licm"]):
+        image = compile_source(IO_PROGRAM, optimizations)
+        for mode in ExecMode:
+            result = run(image, io=TokenIO(tokens), mode=mode)
+            assert result.output == [1, 3, 6, 10, 15], "{} {}: wrong output {}".format(optimizations, mode.value, result.output)
+    print("io: all modes agree")
+
+    expected = [sum(range(i + 1)) for i in range(10)]
+    start = time.perf_counter()
+    for _ in range(calls):
+        assert run(compile_source(API_PROGRAM)).output == expected, "wrong output"
+    api_time = (time.perf_counter() - start) / calls
+
+    with tempfile.TemporaryDirectory() as directory:
+        source, code = os.path.join(directory, "api.cmm"), os.path.join(directory, "api.json")
+        with open(source, "w", encoding="utf-8") as file:
+            file.write(API_PROGRAM)
+        start = time.perf_counter()
+        for _ in range(processes):
+            subprocess.run([sys.executable, "translator.py", source, code], check=True, stdout=subprocess.DEVNULL)
+            subprocess.run([sys.executable, "machine.py", code, "fast"], check=True, stdout=subprocess.DEVNULL)
+        cli_time = (time.perf_counter() - start) / processes
+    print("{:>12} {:>12} {:>10}".format("mode", "ms/program", "per s"))
+    print("{:>12} {:>12.3f} {:>10.0f}".format("in-process", api_time * 1000, 1 / api_time))
+    print("{:>12} {:>12.3f} {:>10.0f}".format("processes", cli_time * 1000, 1 / cli_time))
+
+
+def compile_cached(directory: str, source: str, optimizations=()) -> list[int]:
+    image = compile_source(source, optimizations, CompileCache(directory))
+    return list(image.words)
+
+
+def bench_cache(sizes=(1000, 2000, 5000), optimizations=("fold", "peephole", "regalloc")):
+    """Трансляция с пустым кэшем и попадание; вытеснение по размеру и запись из нескольких процессов"""
+    with tempfile.TemporaryDirectory() as directory:
+        cache = CompileCache(directory)
+        print("{:>10} {:>10} {:>10} {:>10}".format("stmts", "miss, ms", "hit, ms", "speedup"))
+        for size in sizes:
+            source = generate_program(size)
+            image, miss_time = timed(compile_source, source, optimizations, cache)
+            cached, hit_time = timed(compile_source, source, optimizations, cache)
+            assert list(cached.words) == list(image.words) and cached.symbols == image.symbols, "cache hit differs"
+            print("{:>10} {:>10.2f} {:>10.3f} {:>10.0f}".format(size, miss_time * 1000, hit_time * 1000,
+                                                               miss_time / hit_time))
+
+    with tempfile.TemporaryDirectory() as directory:
+        sources = [generate_program(200, seed=seed) for seed in range(6)]
+        cache = CompileCache(directory)
+        keys = [cache.key(source) for source in sources]
+        compile_source(sources[0], (), cache)
+        entry_size = os.path.getsize(cache.path(keys[0]))
+        cache.max_bytes = 3 * entry_size + entry_size // 2
+        for source in sources[1:]:
+            time.sleep(0.01)
+            compile_source(source, (), cache)
+            compile_source(sources[0], (), cache)
+        kept = {key for key in keys if os.path.exists(cache.path(key))}
+        assert kept == {keys[0], keys[4], keys[5]}, "LRU keeps recently used entries"
+        assert sum(size for _, size, _ in cache.entries()) <= cache.max_bytes
+        print("lru: {} of {} entries kept".format(len(kept), len(keys)))
+
+    with tempfile.TemporaryDirectory() as directory:
+        sources = [generate_program(500, seed=seed) for seed in range(8)] * 4
+        expected = [list(compile_source(source).words) for source in sources]
+        with concurrent.futures.ProcessPoolExecutor(4) as pool:
+            results = list(pool.map(compile_cached, [directory] * len(sources), sources))
+            results += list(pool.map(compile_cached, [directory] * len(sources), sources))
+        assert results == expected * 2, "concurrent cache writes"
+        assert not [name for name in os.listdir(directory) if not name.endswith(".bin")], "temporary files left"
+        print("concurrent: {} compilations in 4 processes agree".format(len(results)))
+
+
+def bench_batch(files: int = 48, statements: int = 300, workers=(1, 2, 4), processes: int = 8):
+    """Пакетная трансляция пулом процессов при разном их числе против отдельного процесса на файл; без кэша"""
+    cache_dir = os.environ.get("CMM_CACHE_DIR")
+    os.environ["CMM_CACHE_DIR"] = ""
+    try:
+        with tempfile.TemporaryDirectory() as directory:
+            for i in range(files):
+                with open(os.path.join(directory, "p{}.cmm".format(i)), "w", encoding="utf-8") as file:
+                    file.write(generate_program(statements, seed=i))
+            expected = {"p{}".format(i): list(compile_source(generate_program(statements, seed=i)).words)
+                        for i in range(files)}
+            print("{:>12} {:>10} {:>10}".format("workers", "wall, s", "files/s"))
+            for count in workers:
+                output = os.path.join(directory, "out{}".format(count), "*.bin")
+                results, wall = timed(translate_batch, directory, output, (), count)
+                assert all(result.error is None for result in results), "batch translation failed"
+                for name, words in expected.items():
+                    image = load_code(output.replace("*", name))
+                    assert list(image.words) == words, "batch output differs for {}".format(name)
+                print("{:>12} {:>10.2f} {:>10.1f}".format(count, wall, files / wall))
+
+            start = time.perf_counter()
+            for i in range(processes):
+                source = os.path.join(directory, "p{}.cmm".format(i))
+                subprocess.run([sys.executable, "translator.py", source, source[:-3] + "bin"], check=True,
+                               stdout=subprocess.DEVNULL)
+            per_file = (time.perf_counter() - start) / processes
+            print("{:>12} {:>10.2f} {:>10.1f}".format("per file", per_file * files, 1 / per_file))
+    finally:
+        if cache_dir is None:
+            del os.environ["CMM_CACHE_DIR"]
+        else:
+            os.environ["CMM_CACHE_DIR"] = cache_dir
+
+
+# программы пакета заданий: вход -- число n и, для sums, n токенов
+JOB_PROGRAMS = {
+    "sums": IO_PROGRAM,
+    "digits": "n = 0; s = 0; scan n; while n != 0 { s = s + n % 7; n = n - 1 }; print s",
+}
+
+
+def bench_jobs(jobs: int = 600, workers=(1, 2, 4), seed: int = 0):
+    """Пакет заданий (программа, вход, предел) в пуле процессов с декодированием программы один раз на процесс
+    против исполнения каждого задания с загрузкой и декодированием"""
+    rng = random.Random(seed)
+    with tempfile.TemporaryDirectory() as directory:
+        paths = {}
+        for name, source in JOB_PROGRAMS.items():
+            paths[name] = os.path.join(directory, name + ".bin")
+            image = compile_source(source, ["dse", "licm"])
+            write_code_binary(paths[name], image.words, image.text_size, image.symbols)
+        manifest = []
+        for _ in range(jobs):
+            n = rng.randrange(1, 40)
+            if rng.random() < 0.5:
+                manifest.append(Job(paths["sums"], [n, *(rng.randrange(-99, 100) for _ in range(n))]))
+            else:
+                manifest.append(Job(paths["digits"], [n * 5]))
+
+        start = time.perf_counter()
+        expected = []
+        for job in manifest:
+            result = run(load_code(job.program), limit=job.limit, io=TokenIO(job.tokens))
+            expected.append((result.instr_counter, result.ticks, result.output, memory_digest(result.memory)))
+        serial_time = time.perf_counter() - start
+
+        print("{:>12} {:>10} {:>10}".format("workers", "wall, s", "jobs/s"))
+        print("{:>12} {:>10.2f} {:>10.0f}".format("per job", serial_time, jobs / serial_time))
+        for count in workers:
+            results, wall = timed(run_batch, manifest, count)
+            assert all(result.error is None for result in results), "batch job failed"
+            actual = [(result.instr_counter, result.ticks, result.output, result.memory_digest) for result in results]
+            assert actual == expected, "batch results differ from run"
+            print("{:>12} {:>10.2f} {:>10.0f}".format(count, wall, jobs / wall))
+
+
+def run_or_error(image, tokens: list[int], limit: int) -> tuple:
+    try:
+        result = run(image, limit=limit, io=TokenIO(tokens))
+    except Exception as exception:
+        return "{}: {}".format(type(exception).__name__, exception)
+    return result.instr_counter, result.ticks, result.output, memory_digest(result.memory)
+
+
+def machine_outcome(machine: Machine) -> tuple:
+    if machine.error is not None:
+        return machine.error
+    result = machine.result()
+    return result.instr_counter, result.ticks, result.output, memory_digest(result.memory)
+
+
+def bench_scheduler(machines: int = 400, long_every: int = 10, seed: int = 0):
+    """Много машин в одном процессе: исполнение по очереди до конца против квантов по кругу и с приоритетом
+    коротких программ; задержка -- время от начала до HLT каждой короткой программы"""
+    rng = random.Random(seed)
+    images = {name: compile_source(source, ["dse", "licm"]) for name, source in JOB_PROGRAMS.items()}
+    limit = 10 ** 6
+    jobs = []
+    for i in range(machines):
+        if i % long_every == 0:
+            jobs.append(("digits", [rng.randrange(3000, 6000)], True))
+        else:
+            n = rng.randrange(1, 20)
+            # каждой тридцатой программе не хватает ввода
+            tokens = [n, *(rng.randrange(-99, 100) for _ in range(n - (i % 30 == 1)))]
+            jobs.append(("sums", tokens, False))
+    expected = [run_or_error(images[name], tokens, limit) for name, tokens, _ in jobs]
+
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    probe = [Machine(images[name], TokenIO(tokens), limit=limit) for name, tokens, _ in jobs]
+    per_machine = (tracemalloc.get_traced_memory()[0] - before) / len(probe)
+    tracemalloc.stop()
+    del probe
+    print("memory per machine: {:.1f} KB".format(per_machine / 1024))
+
+    print("{:>20} {:>10} {:>8} {:>14} {:>14}".format("schedule", "wall, s", "slices", "short mean, ms",
+                                                      "short p95, ms"))
+    for name, quantum, policy in (("sequential", limit, SchedulePolicy.ROUND_ROBIN),
+                                  ("rr 1000", 1000, SchedulePolicy.ROUND_ROBIN),
+                                  ("rr 100", 100, SchedulePolicy.ROUND_ROBIN),
+                                  ("priority 1000", 1000, SchedulePolicy.PRIORITY)):
+        scheduler = Scheduler(quantum, policy)
+        started = {}
+        for index, (program, tokens, long) in enumerate(jobs):
+            machine = scheduler.add(Machine(images[program], TokenIO(tokens), limit=limit), 0 if long else 1)
+            started[machine] = index
+        latencies = []
+        outcomes = [None] * len(jobs)
+        start = time.perf_counter()
+        for machine in scheduler.run():
+            index = started[machine]
+            outcomes[index] = machine_outcome(machine)
+            if not jobs[index][2]:
+                latencies.append(time.perf_counter() - start)
+        wall = time.perf_counter() - start
+        assert outcomes == expected, "{}: results differ from run".format(name)
+        latencies.sort()
+        print("{:>20} {:>10.2f} {:>8} {:>14.1f} {:>14.1f}".format(
+            name, wall, scheduler.slices, sum(latencies) / len(latencies) * 1000,
+            latencies[int(len(latencies) * 0.95)] * 1000))
+
+
+def run_inputs(image, inputs: list[list[int]], limit: int) -> list:
+    """Result или текст ошибки для каждого входа по отдельности"""
+    program = LoadedProgram(image)
+    results = []
+    for tokens in inputs:
+        try:
+            results.append(program.run(limit, TokenIO(tokens)))
+        except AssertionError as error:
+            results.append(str(error))
+    return results
+
+
+def comparable(results) -> list:
+    return [result if isinstance(result, str) else
+            (result.instr_counter, result.ticks, result.output, list(result.memory)) for result in results]
+
+
+def lane_results(lanes) -> list:
+    return [lanes.errors[lane] or lanes.result(lane) for lane in range(len(lanes.errors))]
+
+
+def check_lanes_agree(programs: int = 100, lanes: int = 30, seed: int = 0):
+    """Дорожки дают те же счётчики, вывод, память и ошибки, что и отдельные запуски; переменные v0-v2 читаются
+    из входа, поэтому дорожки расходятся по условиям"""
+    rng = random.Random(seed)
+    for i in range(programs):
+        source = generate_program(rng.randrange(5, 50), depth=rng.randrange(0, 4), seed=i)
+        for name in ("v0 = 0;", "v1 = 1;", "v2 = 2;"):
+            source = source.replace(name, "{} scan {}".format(name, name.split()[0]) + ";", 1)
+        inputs = [[rng.randrange(-3, 4) for _ in range(3)] for _ in range(lanes)]
+        for optimizations in ([], ["peephole", "regalloc"], ["dse", "licm"]):
+            image = compile_source(source, optimizations)
+            results = run_lanes(image, inputs, limit=3000)
+            assert comparable(lane_results(results)) == comparable(run_inputs(image, inputs, 3000)), \
+                "lanes differ from separate runs of program {}".format(i)
+    return programs
+
+
+def bench_lanes(sizes=(10, 100, 1000, 5000), seed: int = 0):
+    """Исполнение программы на N входах дорожками NumPy против N запусков декодированной программы"""
+    print("lanes: {} random programs agree".format(check_lanes_agree()))
+    rng = random.Random(seed)
+    print("{:>10} {:>10} {:>12} {:>12} {:>10}".format("program", "lanes", "separate, s", "lanes, s", "speedup"))
+    for name, source in JOB_PROGRAMS.items():
+        image = compile_source(source, ["dse", "licm"])
+        for size in sizes:
+            if name == "sums":
+                inputs = [[n, *(rng.randrange(-99, 100) for _ in range(n))] for n in
+                          (rng.randrange(1, 40) for _ in range(size))]
+            else:
+                inputs = [[rng.randrange(1, 200)] for _ in range(size)]
+            expected, separate_time = timed(run_inputs, image, inputs, INSTR_LIMIT)
+            lanes, lanes_time = timed(run_lanes, image, inputs, limit=INSTR_LIMIT)
+            assert comparable(lane_results(lanes)) == comparable(expected), "lanes differ from separate runs"
+            print("{:>10} {:>10} {:>12.3f} {:>12.3f} {:>10.1f}".format(name, size, separate_time, lanes_time,
+                                                                     separate_time / lanes_time))
+
+
+def bench_ports(tokens: int = 20000, seed: int = 0):
+    """Источники входного порта (список, генератор, файл через mmap) и приёмники вывода без буфера и с буфером"""
+    rng = random.Random(seed)
+    values = [rng.randrange(-1000, 1000) for _ in range(tokens)]
+    expected = list(itertools.accumulate(values))
+    program = LoadedProgram(compile_source(IO_PROGRAM, ["fold", "peephole", "regalloc"]))
+    limit = 20 * tokens + 100
+
+    with tempfile.TemporaryDirectory() as directory:
+        text, binary, output = (os.path.join(directory, name) for name in ("in.txt", "in.bin", "out.txt"))
+        with open(text, "w", encoding="utf-8") as file:
+            file.write(" ".join(map(str, [tokens, *values])))
+        with open(binary, "wb") as file:
+            file.write(struct.pack("<{}i".format(tokens + 1), tokens, *values))
+        sources = {
+            "list": lambda: [tokens, *values],
+            "generator": lambda: (value for value in itertools.chain((tokens,), values)),
+            "text mmap": lambda: TokenFileSource(text),
+            "binary mmap": lambda: TokenFileSource(binary, binary=True),
+        }
+        print("{:>14} {:>14} {:>12} {:>12}".format("source", "sink", "ms", "tokens/s"))
+        for sink_name, buffer_size in (("list", None), ("file, 1", 1), ("file, 4096", 4096)):
+            for source_name, source in sources.items():
+                with open(output, "w", encoding="utf-8") as file:
+                    sink = ListSink() if buffer_size is None else TextTokenSink(file, buffer_size)
+                    io = PortIO({INPUT_PORT: source()}, {OUTPUT_PORT: sink})
+                    _, seconds = timed(program.run, limit, io)
+                with open(output, encoding="utf-8") as file:
+                    printed = sink.tokens if buffer_size is None else list(map(int, file.read().split()))
+                assert printed == expected, "{} -> {}: wrong output".format(source_name, sink_name)
+                assert io.counters() == {INPUT_PORT: (tokens + 1, 2 * tokens + 2), OUTPUT_PORT: (tokens, 2 * tokens)}, \
+                    "wrong port counters {}".format(io.counters())
+                moved = 2 * tokens + 1
+                print("{:>14} {:>14} {:>12.1f} {:>12.0f}".format(source_name, sink_name, seconds * 1000, moved / seconds))
+    for port, (count, ticks) in io.counters().items():
+        print("port {}: tokens: {}, ticks: {}".format(port, count, ticks))
+
+
+BENCHMARKS = {
+    "api": bench_api,
+    "batch": bench_batch,
+    "cache": bench_cache,
+    "fold": bench_fold,
+    "induction": bench_induction,
+    "jobs": bench_jobs,
+    "lanes": bench_lanes,
+    "ports": bench_ports,
+    "ir": bench_ir,
+    "linker": bench_linker,
+    "packrat": bench_packrat,
+    "parsers": bench_parsers,
+    "peephole": bench_peephole,
+    "scheduler": bench_scheduler,
+}
+
+
+def main(args):
+    assert len(args) == 1 and args[0] in BENCHMARKS, "Wrong arguments: benchmark.py <{}>".format("|".join(BENCHMARKS))
+    BENCHMARKS[args[0]]()
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
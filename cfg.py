@@ -0,0 +1,140 @@
+"""Граф потока управления и анализ живости для кода до компоновки.
+
+До компоновки переходы ссылаются на номер метки (строку), а TranslateState.labels
+хранит адрес каждой метки; метка может указывать на адрес len(text) -- конец
+программы, где компоновщик поставит HLT.
+"""
+from isa import Cell, Opcode
+
+# номера аргументов, которые инструкция читает и пишет как регистры
+REG_USES = {
+    Opcode.ADD: (0, 1), Opcode.SUB: (0, 1), Opcode.MOD: (0, 1),
+    Opcode.INC: (0,), Opcode.DEC: (0,), Opcode.MV: (0,),
+    Opcode.LD: (), Opcode.ST: (0,),
+    Opcode.BE: (), Opcode.BNE: (), Opcode.JMP: (), Opcode.HLT: (),
+    Opcode.LDI: (), Opcode.ADDI: (0,), Opcode.SUBI: (0,), Opcode.MODI: (0,),
+    Opcode.IN: (), Opcode.OUT: (0,),
+}
+REG_DEFS = {
+    Opcode.ADD: (2,), Opcode.SUB: (2,), Opcode.MOD: (2,),
+    Opcode.INC: (1,), Opcode.DEC: (1,), Opcode.MV: (1,),
+    Opcode.LD: (1,), Opcode.ST: (),
+    Opcode.BE: (), Opcode.BNE: (), Opcode.JMP: (), Opcode.HLT: (),
+    Opcode.LDI: (1,), Opcode.ADDI: (2,), Opcode.SUBI: (2,), Opcode.MODI: (2,),
+    Opcode.IN: (1,), Opcode.OUT: (),
+}
+BRANCHES = (Opcode.BE, Opcode.BNE, Opcode.JMP)
+CONDITIONAL_BRANCHES = (Opcode.BE, Opcode.BNE)
+
+
+def reg_uses(instr) -> list[int]:
+    return [instr["args"][i] for i in REG_USES[instr["opcode"]]]
+
+
+def reg_defs(instr) -> list[int]:
+    return [instr["args"][i] for i in REG_DEFS[instr["opcode"]]]
+
+
+def flag_checked(text: list[Cell], i: int) -> bool:
+    """Следующая инструкция -- переход по флагу, который выставляет text[i]"""
+    return i + 1 < len(text) and text[i + 1]["opcode"] in CONDITIONAL_BRANCHES
+
+
+def branch_target(instr, labels: list[int]) -> int:
+    return labels[int(instr["args"][0])]
+
+
+class BasicBlock:
+    def __init__(self, start: int, end: int):
+        self.start = start
+        self.end = end
+        self.successors: list[int] = []
+        self.live_in: set[int] = set()
+        self.live_out: set[int] = set()
+
+    def __repr__(self):
+        return 'BasicBlock(%d, %d, %s)' % (self.start, self.end, self.successors)
+
+
+def build_cfg(text: list[Cell], labels: list[int]) -> list[BasicBlock]:
+    """Базовые блоки в порядке адресов; successors -- номера блоков, выход из программы не указывается"""
+    leaders = {0}
+    leaders.update(labels)
+    for i, instr in enumerate(text):
+        if instr["opcode"] in BRANCHES:
+            leaders.add(i + 1)
+    starts = sorted(leader for leader in leaders if 0 <= leader < len(text))
+    blocks = [BasicBlock(start, end) for start, end in zip(starts, starts[1:] + [len(text)])]
+    block_at = {block.start: number for number, block in enumerate(blocks)}
+
+    for number, block in enumerate(blocks):
+        last = text[block.end - 1]
+        targets = []
+        if last["opcode"] in BRANCHES:
+            targets.append(branch_target(last, labels))
+        if last["opcode"] is not Opcode.JMP:
+            targets.append(block.end)
+        block.successors = [block_at[target] for target in dict.fromkeys(targets) if target in block_at]
+    return blocks
+
+
+def liveness(blocks: list[BasicBlock], text: list[Cell], tracked=lambda reg: True):
+    """Заполняет live_in и live_out блоков; tracked отбирает регистры, которые нужно учитывать"""
+    gen: list[set[int]] = []
+    kill: list[set[int]] = []
+    for block in blocks:
+        used, defined = set(), set()
+        for instr in text[block.start:block.end]:
+            used.update(reg for reg in reg_uses(instr) if tracked(reg) and reg not in defined)
+            defined.update(reg for reg in reg_defs(instr) if tracked(reg))
+        gen.append(used)
+        kill.append(defined)
+        block.live_in, block.live_out = set(), set()
+
+    changed = True
+    while changed:
+        changed = False
+        for number in reversed(range(len(blocks))):
+            block = blocks[number]
+            live_out = set()
+            for successor in block.successors:
+                live_out |= blocks[successor].live_in
+            live_in = gen[number] | (live_out - kill[number])
+            if live_in != block.live_in or live_out != block.live_out:
+                block.live_in, block.live_out = live_in, live_out
+                changed = True
+
+
+def loop_depths(text: list[Cell], labels: list[int]) -> list[int]:
+    """Глубина вложенности циклов каждой инструкции: обратный переход охватывает [цель, переход]"""
+    delta = [0] * (len(text) + 1)
+    for i, instr in enumerate(text):
+        if instr["opcode"] in BRANCHES:
+            target = branch_target(instr, labels)
+            if target <= i:
+                delta[target] += 1
+                delta[i + 1] -= 1
+    depths = []
+    depth = 0
+    for i in range(len(text)):
+        depth += delta[i]
+        depths.append(depth)
+    return depths
+
+
+def splice(text: list[Cell], labels: list[int], chunks: list[list[Cell]],
+           head: list[Cell] = (), tail: list[Cell] = ()) -> tuple[list[Cell], list[int]]:
+    """Заменяет каждую инструкцию своим списком (возможно, пустым) и пересчитывает метки.
+
+    Метка инструкции переходит на начало её замены, метка конца программы -- на
+    начало tail; head исполняется один раз и переходами не достигается.
+    """
+    assert len(chunks) == len(text), "Every instruction needs a replacement"
+    result = list(head)
+    positions = []
+    for chunk in chunks:
+        positions.append(len(result))
+        result.extend(chunk)
+    positions.append(len(result))
+    result.extend(tail)
+    return result, [positions[label] for label in labels]
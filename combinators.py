@@ -1,3 +1,6 @@
+from contextvars import ContextVar
+
+
 class Result:
     def __init__(self, value, pos):
         self.value = value
@@ -7,7 +10,26 @@ class Result:
         return 'Result(%s, %d)' % (self.value, self.pos)
 
 
+# Таблица мемоизации текущего разбора в режиме packrat (None -- режим выключен); своя у каждого
+# потока и контекста, поэтому параллельные разборы её не видят
+_memo: ContextVar[dict | None] = ContextVar("packrat_memo", default=None)
+
+
 class Parser:
+    def __call__(self, tokens, pos):
+        memo = _memo.get()
+        if memo is None:
+            return self.parse(tokens, pos)
+        # парсер -> {позиция: результат}: ключом служит сам парсер, а не кортеж на каждую запись,
+        # поэтому сборщику циклов почти нечего обходить в растущей таблице
+        table = memo.get(self)
+        if table is None:
+            table = memo[self] = {}
+        elif pos in table:
+            return table[pos]
+        result = table[pos] = self.parse(tokens, pos)
+        return result
+
     def __add__(self, other):
         return Concat(self, other)
     
@@ -27,7 +49,7 @@ class Reserved(Parser):
         self.value = value
         self.tag = tag
         
-    def __call__(self, tokens, pos):
+    def parse(self, tokens, pos):
         if pos < len(tokens) and tokens[pos][0] == self.value and tokens[pos][1] is self.tag:
             return Result(tokens[pos][0], pos + 1)
         else:
@@ -38,7 +60,7 @@ class Tag(Parser):
     def __init__(self, tag):
         self.tag = tag
         
-    def __call__(self, tokens, pos):
+    def parse(self, tokens, pos):
         if pos < len(tokens) and tokens[pos][1] is self.tag:
             return Result(tokens[pos][0], pos + 1)
         else:
@@ -50,7 +72,7 @@ class Concat(Parser):
         self.left = left
         self.right = right
         
-    def __call__(self, tokens, pos):
+    def parse(self, tokens, pos):
         left_result = self.left(tokens, pos)
         if left_result:
             right_result = self.right(tokens, left_result.pos)
@@ -65,20 +87,16 @@ class Exp(Parser):
         self.parser = parser
         self.separator = separator
         
-    def __call__(self, tokens, pos):
+    def parse(self, tokens, pos):
         result = self.parser(tokens, pos)
-        
-        def process_next(parsed):
-            (sepfunc, right) = parsed
-            return sepfunc(result.value, right)
-        
-        next_parser = self.separator + self.parser ^ process_next
-        
-        next_result = result
-        while next_result:
-            next_result = next_parser(tokens, result.pos)
-            if next_result:
-                result = next_result
+        while result:
+            separator_result = self.separator(tokens, result.pos)
+            if not separator_result:
+                break
+            right_result = self.parser(tokens, separator_result.pos)
+            if not right_result:
+                break
+            result = Result(separator_result.value(result.value, right_result.value), right_result.pos)
         return result
     
 
@@ -87,7 +105,7 @@ class Alternate(Parser):
         self.left = left
         self.right = right
         
-    def __call__(self, tokens, pos):
+    def parse(self, tokens, pos):
         left_result = self.left(tokens, pos)
         if left_result:
             return left_result
@@ -100,7 +118,7 @@ class Opt(Parser):
     def __init__(self, parser):
         self.parser = parser
         
-    def __call__(self, tokens, pos):
+    def parse(self, tokens, pos):
         result = self.parser(tokens, pos)
         if result:
             return result
@@ -113,11 +131,10 @@ class Process(Parser):
         self.parser = parser
         self.function = function
         
-    def __call__(self, tokens, pos):
+    def parse(self, tokens, pos):
         result = self.parser(tokens, pos)
         if result:
-            result.value = self.function(result.value)
-            return result
+            return Result(self.function(result.value), result.pos)
         
         return None
     
@@ -127,7 +144,7 @@ class Lazy(Parser):
         self.parser = None
         self.parser_func = parser_func
         
-    def __call__(self, tokens, pos):
+    def parse(self, tokens, pos):
         if not self.parser:
             self.parser = self.parser_func()
         return self.parser(tokens, pos)
@@ -137,9 +154,22 @@ class Phrase(Parser):
     def __init__(self, parser):
         self.parser = parser
         
-    def __call__(self, tokens, pos):
+    def parse(self, tokens, pos):
         result = self.parser(tokens, pos)
         if result and result.pos == len(tokens):
             return result
         else:
-            return None
\ No newline at end of file
+            return None
+
+
+class Packrat(Parser):
+    """Разбор с мемоизацией результатов по (парсер, позиция); таблица живёт один разбор"""
+    def __init__(self, parser):
+        self.parser = parser
+
+    def parse(self, tokens, pos):
+        token = _memo.set({})
+        try:
+            return self.parser(tokens, pos)
+        finally:
+            _memo.reset(token)
@@ -0,0 +1,122 @@
+"""Кэш трансляции на диске с адресацией по содержимому.
+
+Ключ -- sha256 исходного текста, версии транслятора и набора оптимизаций; запись --
+скомпонованный образ в бинарном формате isa, который при попадании отображается в
+память через mmap. Запись пишется во временный файл и переименовывается (os.replace),
+поэтому параллельные процессы видят либо целую запись, либо никакой. Время последнего
+использования -- mtime файла: попадание его обновляет, при превышении размера удаляются
+самые давние записи. Кэш не обязателен: повреждённая запись считается промахом и удаляется,
+ошибка записи только попадает в лог.
+"""
+import functools
+import hashlib
+import logging
+import os
+import struct
+import tempfile
+
+from isa import CodeImage, read_code_binary, write_code_binary
+
+CACHE_DIR_ENV = "CMM_CACHE_DIR"
+DEFAULT_MAX_BYTES = 64 << 20
+ENTRY_SUFFIX = ".bin"
+# ошибки чтения обрезанной, пустой или чужой записи
+CORRUPT_ENTRY = (OSError, ValueError, struct.error, AssertionError)
+# модули, от которых зависит результат трансляции
+TRANSLATOR_MODULES = ("lexer", "combinators", "parser_cmm", "parser_rd", "ast_cmm", "ir", "cfg", "peephole",
+                      "regalloc", "isa", "translator")
+
+
+@functools.cache
+def translator_version() -> str:
+    """Хэш исходных текстов модулей транслятора: после их изменения старые записи не находятся"""
+    digest = hashlib.sha256()
+    directory = os.path.dirname(os.path.abspath(__file__))
+    for name in TRANSLATOR_MODULES:
+        with open(os.path.join(directory, name + ".py"), "rb") as file:
+            digest.update(file.read())
+    return digest.hexdigest()
+
+
+class CompileCache:
+    def __init__(self, directory: str, max_bytes: int = DEFAULT_MAX_BYTES):
+        assert max_bytes > 0, "Cache size should be non-zero"
+        self.directory = directory
+        self.max_bytes = max_bytes
+
+    def key(self, source: str, optimizations=()) -> str:
+        # порядок применения оптимизаций фиксирован, поэтому важен только набор
+        digest = hashlib.sha256(translator_version().encode())
+        digest.update(b"\0" + ",".join(sorted(set(optimizations))).encode() + b"\0")
+        digest.update(source.encode("utf-8"))
+        return digest.hexdigest()
+
+    def path(self, key: str) -> str:
+        return os.path.join(self.directory, key + ENTRY_SUFFIX)
+
+    def get(self, key: str) -> CodeImage | None:
+        path = self.path(key)
+        try:
+            image = read_code_binary(path)
+        except FileNotFoundError:
+            return None
+        except CORRUPT_ENTRY as error:
+            logging.warning("Dropping unreadable cache entry %s: %s", path, error)
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            return None
+        try:
+            os.utime(path)
+        except OSError:
+            # запись вытеснена другим процессом после чтения: образ уже отображён
+            pass
+        return image
+
+    def put(self, key: str, image: CodeImage):
+        """Сохраняет образ; при ошибке файловой системы запись пропускается"""
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            descriptor, temp = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+            os.close(descriptor)
+            try:
+                write_code_binary(temp, image.words, image.text_size, image.symbols)
+                os.replace(temp, self.path(key))
+            except BaseException:
+                os.remove(temp)
+                raise
+            self.evict()
+        except OSError as error:
+            logging.warning("Skipping compile cache write to %s: %s", self.directory, error)
+
+    def entries(self) -> list[tuple[int, int, str]]:
+        """(mtime, размер, путь) записей; удалённые параллельно пропускаются"""
+        entries = []
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith(ENTRY_SUFFIX):
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime_ns, stat.st_size, entry.path))
+        return entries
+
+    def evict(self):
+        """Удаляет самые давние записи, пока кэш больше max_bytes"""
+        entries = sorted(self.entries())
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in entries:
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+
+
+def default_cache() -> CompileCache | None:
+    """Кэш в каталоге из CMM_CACHE_DIR или ~/.cache/cmm; пустое значение переменной отключает кэш"""
+    directory = os.environ.get(CACHE_DIR_ENV, os.path.join(os.path.expanduser("~"), ".cache", "cmm"))
+    return CompileCache(directory) if directory else None
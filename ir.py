@@ -0,0 +1,537 @@
+"""Промежуточное представление: базовые блоки трёхадресных операций.
+
+Дерево ast_cmm понижается (методы lower) в операции над виртуальными
+регистрами: у каждого промежуточного значения свой регистр, переменные остаются
+ячейками памяти (LOAD/STORE). Блок заканчивается явным переходом, так что граф
+потока управления известен без анализа кода. Менеджер проходов применяет
+выбранные оптимизации, затем программа выводится в код до компоновки с
+виртуальными регистрами, которые распределяет regalloc.
+"""
+from enum import Enum
+
+from isa import Opcode, fits_immediate, mod_word, wrap_word
+from regalloc import VIRTUAL_BASE, allocate_virtual
+
+
+class IrOp(str, Enum):
+    CONST = 'const'  # dest = imm
+    LOAD = 'load'  # dest = [name]
+    STORE = 'store'  # [name] = src
+    ADD = '+'  # dest = src1 + (src2 | imm)
+    SUB = '-'
+    MOD = '%'
+    IN = 'in'  # dest = токен порта imm
+    OUT = 'out'  # порт imm <- src
+
+
+# ввод-вывод: операции не удаляются, не выносятся из циклов и не переставляются
+IO_OPS = (IrOp.IN, IrOp.OUT)
+
+# ALU-операции и их машинные коды: с регистром и с непосредственным операндом
+ALU_OPCODES = {IrOp.ADD: (Opcode.ADD, Opcode.ADDI), IrOp.SUB: (Opcode.SUB, Opcode.SUBI),
+               IrOp.MOD: (Opcode.MOD, Opcode.MODI)}
+ALU_VALUES = {
+    IrOp.ADD: lambda left, right: wrap_word(left + right),
+    IrOp.SUB: lambda left, right: wrap_word(left - right),
+    IrOp.MOD: mod_word,
+}
+
+
+class Op:
+    """Трёхадресная операция; второй операнд ALU -- регистр из srcs или imm"""
+    __slots__ = ('opcode', 'dest', 'srcs', 'imm', 'name')
+
+    def __init__(self, opcode: IrOp, dest: int | None = None, srcs: tuple[int, ...] = (),
+                 imm: int | None = None, name: str | None = None):
+        self.opcode = opcode
+        self.dest = dest
+        self.srcs = srcs
+        self.imm = imm
+        self.name = name
+
+    def __repr__(self):
+        operands = ['v%d' % src for src in self.srcs]
+        if self.imm is not None:
+            operands.append(str(self.imm))
+        if self.name is not None:
+            operands.append('[%s]' % self.name)
+        target = 'v%d = ' % self.dest if self.dest is not None else ''
+        return '%s%s %s' % (target, self.opcode.value, ', '.join(operands))
+
+    def instr(self):
+        """Машинная инструкция с виртуальными регистрами"""
+        if self.opcode is IrOp.CONST:
+            return {"opcode": Opcode.LDI, "args": [self.imm, self.dest]}
+        if self.opcode is IrOp.LOAD:
+            return {"opcode": Opcode.LD, "args": [self.name, self.dest]}
+        if self.opcode is IrOp.STORE:
+            return {"opcode": Opcode.ST, "args": [self.srcs[0], self.name]}
+        if self.opcode is IrOp.IN:
+            return {"opcode": Opcode.IN, "args": [self.imm, self.dest]}
+        if self.opcode is IrOp.OUT:
+            return {"opcode": Opcode.OUT, "args": [self.srcs[0], self.imm]}
+        register_form, immediate_form = ALU_OPCODES[self.opcode]
+        if self.imm is not None:
+            return {"opcode": immediate_form, "args": [self.srcs[0], self.imm, self.dest]}
+        return {"opcode": register_form, "args": [self.srcs[0], self.srcs[1], self.dest]}
+
+
+class Jump:
+    def __init__(self, target):
+        self.target = target
+
+    def __repr__(self):
+        return 'jump b%d' % self.target.number
+
+    def targets(self):
+        return [self.target]
+
+    def uses(self):
+        return []
+
+
+class Branch:
+    """Переход на if_true, если left op (right | imm) выполняется, иначе на if_false"""
+
+    def __init__(self, op: str, left: int, right: int | None, imm: int | None, if_true, if_false):
+        self.op = op
+        self.left = left
+        self.right = right
+        self.imm = imm
+        self.if_true = if_true
+        self.if_false = if_false
+
+    def __repr__(self):
+        right = 'v%d' % self.right if self.right is not None else str(self.imm)
+        return 'branch v%d %s %s ? b%d : b%d' % (self.left, self.op, right, self.if_true.number, self.if_false.number)
+
+    def targets(self):
+        return [self.if_true, self.if_false]
+
+    def uses(self):
+        return [self.left] if self.right is None else [self.left, self.right]
+
+
+class Halt:
+    def __repr__(self):
+        return 'halt'
+
+    def targets(self):
+        return []
+
+    def uses(self):
+        return []
+
+
+class Block:
+    def __init__(self, number: int):
+        self.number = number
+        self.ops: list[Op] = []
+        self.terminator: Jump | Branch | Halt | None = None
+
+    def __repr__(self):
+        lines = ['b%d:' % self.number] + ['    %r' % op for op in self.ops] + ['    %r' % self.terminator]
+        return '\n'.join(lines)
+
+    def successors(self):
+        return self.terminator.targets()
+
+
+class Loop:
+    """Цикл while: preheader безусловно переходит в header, blocks -- header и тело"""
+
+    def __init__(self, preheader: Block, header: Block, blocks: list[Block]):
+        self.preheader = preheader
+        self.header = header
+        self.blocks = blocks
+
+
+class Program:
+    def __init__(self):
+        self.blocks: list[Block] = []  # в порядке размещения в коде
+        self.loops: list[Loop] = []  # вложенные циклы раньше объемлющих
+        self.block_count = 0
+        self.next_reg = VIRTUAL_BASE
+        self.variables: set[str] = set()
+        self.initial: dict[str, int] = {}  # содержимое ячеек при загрузке программы
+
+    def __repr__(self):
+        return '\n'.join(repr(block) for block in self.blocks)
+
+    def new_reg(self) -> int:
+        self.next_reg += 1
+        return self.next_reg - 1
+
+
+class Builder:
+    """Понижение дерева: текущий блок, в который добавляются операции"""
+
+    def __init__(self, state):
+        self.state = state
+        self.program = Program()
+        self.block = None
+        self.start_block(self.new_block())
+
+    def new_block(self) -> Block:
+        self.program.block_count += 1
+        return Block(self.program.block_count - 1)
+
+    def start_block(self, block: Block):
+        """Блок размещается следом за текущим; незавершённый текущий блок переходит в него"""
+        if self.block is not None and self.block.terminator is None:
+            self.block.terminator = Jump(block)
+        self.program.blocks.append(block)
+        self.block = block
+
+    def terminate(self, terminator):
+        self.block.terminator = terminator
+
+    def emit(self, opcode: IrOp, srcs=(), imm=None, name=None) -> int | None:
+        dest = self.program.new_reg() if opcode not in (IrOp.STORE, IrOp.OUT) else None
+        self.block.ops.append(Op(opcode, dest, tuple(srcs), imm, name))
+        return dest
+
+    def const(self, value: int) -> int:
+        if fits_immediate(value):
+            return self.emit(IrOp.CONST, imm=value)
+        # константа не помещается в поле инструкции -- ячейка пула констант
+        if str(value) not in self.state.vars:
+            self.state.add_var(str(value), value)
+        return self.emit(IrOp.LOAD, name=str(value))
+
+    def loop(self, preheader: Block, header: Block):
+        """Регистрирует цикл из блоков от header до текущего"""
+        blocks = self.program.blocks[self.program.blocks.index(header):]
+        self.program.loops.append(Loop(preheader, header, blocks))
+
+    def lower(self, root):
+        """Понижение операторов с явным стеком: lower оператора возвращает вложенные операторы
+        и завершающие функции, которые обрабатываются следом по порядку (как ast_cmm.walk)"""
+        work = [root]
+        while work:
+            item = work.pop()
+            if callable(item):
+                item()
+            else:
+                work.extend(reversed(item.lower(self)))
+
+    def finish(self) -> Program:
+        self.terminate(Halt())
+        self.program.variables = set(self.state.vars)
+        self.program.initial = dict(zip(self.state.vars.index, self.state.vars.cells))
+        return self.program
+
+
+def dataflow(program: Program, transfer, exit_live: set) -> dict[int, set]:
+    """Обратный анализ живости: transfer(block, live_out) -> live_in; возвращает live_out по номеру блока"""
+    live_in: dict[int, set] = {block.number: set() for block in program.blocks}
+    live_out: dict[int, set] = {}
+    changed = True
+    while changed:
+        changed = False
+        for block in reversed(program.blocks):
+            successors = block.successors()
+            out = set(exit_live) if not successors else set().union(*(live_in[s.number] for s in successors))
+            live_out[block.number] = out
+            new_in = transfer(block, out)
+            if new_in != live_in[block.number]:
+                live_in[block.number] = new_in
+                changed = True
+    return live_out
+
+
+def register_transfer(block: Block, live: set) -> set:
+    live = live | set(block.terminator.uses())
+    for op in reversed(block.ops):
+        live.discard(op.dest)
+        live.update(op.srcs)
+    return live
+
+
+def memory_transfer(block: Block, live: set) -> set:
+    live = set(live)
+    for op in reversed(block.ops):
+        if op.opcode is IrOp.STORE:
+            live.discard(op.name)
+        elif op.opcode is IrOp.LOAD:
+            live.add(op.name)
+    return live
+
+
+def register_liveness(program: Program) -> dict[int, set[int]]:
+    """Живые на выходе из блока виртуальные регистры"""
+    return dataflow(program, register_transfer, set())
+
+
+def memory_liveness(program: Program) -> dict[int, set[str]]:
+    """Ячейки, значение которых на выходе из блока ещё будет прочитано; после HLT наблюдаются все переменные"""
+    return dataflow(program, memory_transfer, program.variables)
+
+
+def eliminate_dead_stores(program: Program):
+    """Удаляет записи в ячейки, перезаписываемые до чтения, и вычисления, результат которых не используется"""
+    changed = True
+    while changed:
+        changed = False
+        registers = register_liveness(program)
+        memory = memory_liveness(program)
+        for block in program.blocks:
+            live = registers[block.number] | set(block.terminator.uses())
+            live_memory = set(memory[block.number])
+            kept = []
+            for op in reversed(block.ops):
+                if op.opcode is IrOp.STORE:
+                    if op.name not in live_memory:
+                        changed = True
+                        continue
+                    live_memory.discard(op.name)
+                elif op.dest not in live and op.opcode not in IO_OPS:
+                    changed = True
+                    continue
+                elif op.opcode is IrOp.LOAD:
+                    live_memory.add(op.name)
+                live.discard(op.dest)
+                live.update(op.srcs)
+                kept.append(op)
+            block.ops = kept[::-1]
+
+
+def hoist_invariants(program: Program):
+    """Выносит из циклов в preheader вычисления, не зависящие от итерации.
+
+    Выносятся константы, чтения ячеек, в которые цикл не пишет, и ALU-операции
+    над вынесенными значениями. Регистр результата должен определяться один раз
+    во всей программе -- тогда все его чтения видят то же значение.
+    """
+    definitions: dict[int, int] = {}
+    for block in program.blocks:
+        for op in block.ops:
+            if op.dest is not None:
+                definitions[op.dest] = definitions.get(op.dest, 0) + 1
+    for loop in program.loops:
+        defined = {op.dest for block in loop.blocks for op in block.ops if op.dest is not None}
+        stored = {op.name for block in loop.blocks for op in block.ops if op.opcode is IrOp.STORE}
+
+        def invariant(op):
+            return op.opcode is not IrOp.STORE and op.opcode not in IO_OPS and definitions[op.dest] == 1 \
+                and not defined.intersection(op.srcs) \
+                and (op.opcode is not IrOp.LOAD or op.name not in stored)
+
+        changed = True
+        while changed:
+            changed = False
+            for block in loop.blocks:
+                kept = []
+                for op in block.ops:
+                    if invariant(op):
+                        loop.preheader.ops.append(op)
+                        defined.discard(op.dest)
+                        changed = True
+                    else:
+                        kept.append(op)
+                block.ops = kept
+
+
+def evaluate(ops: list[Op], memory: dict[str, int]) -> dict[int, int]:
+    """Значения регистров, известные при трансляции; memory -- известные ячейки, обновляется записями"""
+    regs: dict[int, int] = {}
+    for op in ops:
+        if op.opcode is IrOp.CONST:
+            regs[op.dest] = op.imm
+        elif op.opcode is IrOp.LOAD:
+            if op.name in memory:
+                regs[op.dest] = memory[op.name]
+        elif op.opcode is IrOp.STORE:
+            if op.srcs[0] in regs:
+                memory[op.name] = regs[op.srcs[0]]
+            else:
+                memory.pop(op.name, None)
+        elif op.opcode not in IO_OPS:
+            operands = [regs.get(src) for src in op.srcs] + ([op.imm] if op.imm is not None else [])
+            if None not in operands:
+                regs[op.dest] = ALU_VALUES[op.opcode](*operands)
+    return regs
+
+
+def branch_outcome(branch: Branch, regs: dict[int, int]) -> bool | None:
+    left = regs.get(branch.left)
+    right = branch.imm if branch.right is None else regs.get(branch.right)
+    if left is None or right is None:
+        return None
+    return (left == right) == (branch.op == "==")
+
+
+def entry_memory(program: Program, loop: Loop) -> dict[str, int]:
+    """Ячейки, значения которых известны при входе в цикл: записи констант в preheader,
+    а если preheader -- первый блок программы, то и начальные значения"""
+    memory = dict(program.initial) if loop.preheader is program.blocks[0] else {}
+    evaluate(loop.preheader.ops, memory)
+    return memory
+
+
+def induction_variable(loop: Loop) -> tuple[str, int, int] | None:
+    """(имя, шаг, граница) для цикла while i != граница, в конце каждой итерации которого i = i +- шаг,
+    а других записей в i нет"""
+    branch = loop.header.terminator
+    test = next((op for op in loop.header.ops if op.dest == branch.left), None)
+    if branch.op != "!=" or branch.right is not None or test is None or test.opcode is not IrOp.LOAD:
+        return None
+    name = test.name
+    stores = [op for block in loop.blocks for op in block.ops if op.opcode is IrOp.STORE and op.name == name]
+    latch = loop.blocks[-1]
+    if len(stores) != 1 or stores[0] not in latch.ops:
+        return None
+    defined = {op.dest: op for op in latch.ops if op.dest is not None}
+    step = defined.get(stores[0].srcs[0])
+    if step is None or step.opcode not in (IrOp.ADD, IrOp.SUB) or step.imm is None:
+        return None
+    base = defined.get(step.srcs[0])
+    if base is None or base.opcode is not IrOp.LOAD or base.name != name \
+            or latch.ops.index(base) > latch.ops.index(stores[0]):
+        return None
+    return name, step.imm if step.opcode is IrOp.ADD else -step.imm, branch.imm
+
+
+def reduce_induction(program: Program, loop: Loop):
+    """Остаток от деления индуктивной переменной на делитель шага постоянен: i % m -> константа.
+
+    Требуется конечное число итераций без переполнения: начальное значение s
+    известно и граница достигается шагами, (N - s) / c -- целое неотрицательное.
+    Переходы по условиям, ставшим константными, заменяются безусловными.
+    """
+    induction = induction_variable(loop)
+    start = entry_memory(program, loop).get(induction[0]) if induction is not None else None
+    if start is None:
+        return
+    name, step, bound = induction
+    if step == 0 or (bound - start) % step or (bound - start) // step < 0:
+        return
+    values = {op.dest for block in loop.blocks for op in block.ops if op.opcode is IrOp.LOAD and op.name == name}
+    for block in loop.blocks:
+        for position, op in enumerate(block.ops):
+            if op.opcode is IrOp.MOD and op.imm and op.srcs[0] in values and step % op.imm == 0:
+                block.ops[position] = Op(IrOp.CONST, op.dest, imm=mod_word(start, op.imm))
+        if isinstance(block.terminator, Branch):
+            outcome = branch_outcome(block.terminator, evaluate(block.ops, {}))
+            if outcome is not None:
+                block.terminator = Jump(block.terminator.if_true if outcome else block.terminator.if_false)
+
+
+def rotate(program: Program, loop: Loop):
+    """while c { B } -> if c { do B while c }: проверка условия копируется в конец тела,
+    и итерация обходится без безусловного перехода к заголовку.
+
+    Заголовок остаётся проверкой при входе и удаляется, если при входе условие
+    заведомо истинно. Прочитанная в копии ячейка, в которую тело уже записало
+    значение, берётся из регистра записи.
+    """
+    header, latch = loop.header, loop.blocks[-1]
+    if len(loop.blocks) < 2 or not isinstance(latch.terminator, Jump) or latch.terminator.target is not header:
+        return
+    branch = header.terminator
+    stored = {op.name: op.srcs[0] for op in latch.ops if op.opcode is IrOp.STORE}
+    renamed: dict[int, int] = {}
+    for op in header.ops:
+        if op.opcode is IrOp.LOAD and op.name in stored:
+            renamed[op.dest] = stored[op.name]
+            continue
+        copy = Op(op.opcode, program.new_reg(), tuple(renamed.get(src, src) for src in op.srcs), op.imm, op.name)
+        renamed[op.dest] = copy.dest
+        latch.ops.append(copy)
+    latch.terminator = Branch(branch.op, renamed.get(branch.left, branch.left),
+                              renamed.get(branch.right, branch.right), branch.imm, branch.if_true, branch.if_false)
+    if branch_outcome(branch, evaluate(header.ops, entry_memory(program, loop))):
+        header.ops = []
+        header.terminator = Jump(branch.if_true)
+    loop.preheader, loop.header, loop.blocks = header, loop.blocks[1], loop.blocks[1:]
+
+
+def optimize_loops(program: Program):
+    """Индуктивные переменные и разворот циклов с проверкой условия в конце тела"""
+    for loop in program.loops:
+        reduce_induction(program, loop)
+        rotate(program, loop)
+
+
+# проходы в порядке применения
+PASSES = {
+    "induction": optimize_loops,
+    "dse": eliminate_dead_stores,
+    "licm": hoist_invariants,
+}
+
+
+class PassManager:
+    def __init__(self, names=()):
+        for name in names:
+            assert name in PASSES, "Unknown pass %s" % name
+        self.passes = [run for name, run in PASSES.items() if name in names]
+
+    def run(self, program: Program) -> Program:
+        for run in self.passes:
+            run(program)
+        return program
+
+
+def sets_flag(op: Op | None, reg: int) -> bool:
+    """Op записывает reg и выставляет флаг по его равенству нулю (LD выставляет флаг по адресу)"""
+    return op is not None and op.dest == reg and op.opcode is not IrOp.LOAD
+
+
+def emit(program: Program, state):
+    """Выводит блоки в state.text; номер метки блока -- его номер, последняя метка -- конец программы"""
+    text = state.text
+    state.labels = [0] * (program.block_count + 1)
+    end = program.block_count
+
+    def jump(opcode, target):
+        text.append({"opcode": opcode, "args": [str(target)]})
+
+    for position, block in enumerate(program.blocks):
+        state.labels[block.number] = len(text)
+        text.extend(op.instr() for op in block.ops)
+        following = program.blocks[position + 1] if position + 1 < len(program.blocks) else None
+        terminator = block.terminator
+        if isinstance(terminator, Jump):
+            if terminator.target is not following:
+                jump(Opcode.JMP, terminator.target.number)
+        elif isinstance(terminator, Halt):
+            if following is not None:
+                jump(Opcode.JMP, end)
+        else:
+            # сравнение с нулём значения, только что вычисленного в блоке, берёт его флаг
+            if terminator.right is not None:
+                text.append({"opcode": Opcode.SUB, "args": [terminator.left, terminator.right, program.new_reg()]})
+            elif terminator.imm != 0 or not sets_flag(block.ops[-1] if block.ops else None, terminator.left):
+                text.append({"opcode": Opcode.SUBI, "args": [terminator.left, terminator.imm, program.new_reg()]})
+            equal, unequal = terminator.if_true, terminator.if_false
+            if terminator.op == "!=":
+                equal, unequal = unequal, equal
+            if equal is following:
+                jump(Opcode.BNE, unequal.number)
+            elif unequal is following:
+                jump(Opcode.BE, equal.number)
+            else:
+                jump(Opcode.BE, equal.number)
+                jump(Opcode.JMP, unequal.number)
+    state.labels[end] = len(text)
+    state.pc = len(text)
+
+
+def lower(ast, state) -> Program:
+    """Понижает дерево; начальные значения переменных -- в state.vars, как у кодогенератора"""
+    declared: dict[str, int] = {}
+    body = ast.declare(declared)
+    for name, value in declared.items():
+        state.add_var(name, value)
+    builder = Builder(state)
+    if body is not None:
+        builder.lower(body)
+    return builder.finish()
+
+
+def translate(ast, state, passes=()):
+    """Генерация кода через IR: понижение, проходы, вывод и распределение регистров"""
+    program = PassManager(passes).run(lower(ast, state))
+    emit(program, state)
+    allocate_virtual(state, program.next_reg)
@@ -1,11 +1,26 @@
 import json
+import mmap
+import struct
+import sys
+from array import array
 from enum import Enum
 from typing import NamedTuple, Union, TypedDict
 
-import numpy as np
-
 """Модуль интерфейса инструкций"""
 
+WORD_MIN = -2 ** 31
+WORD_MAX = 2 ** 31 - 1
+
+
+def wrap_word(value: int) -> int:
+    """Приводит целое к 32-битному знаковому машинному слову (дополнительный код)"""
+    return ((value - WORD_MIN) & 0xFFFFFFFF) + WORD_MIN
+
+
+def mod_word(left: int, right: int) -> int:
+    """Остаток с семантикой np.int32: знак делителя, деление на ноль даёт 0"""
+    return left % right if right else 0
+
 
 class Opcode(str, Enum):
     ADD = 'add'  # reg1, reg2, reg_res
@@ -20,6 +35,12 @@ class Opcode(str, Enum):
     BNE = 'bne'  # reg
     JMP = 'jmp'  # reg
     HLT = 'hlt'
+    LDI = 'ldi'  # imm, #reg_res
+    ADDI = 'addi'  # reg1, imm, reg_res
+    SUBI = 'subi'  # reg1, imm, reg_res
+    MODI = 'modi'  # reg1, imm, reg_res
+    IN = 'in'  # port, #reg_res
+    OUT = 'out'  # reg, #port
 
 
 class Instr(TypedDict):
@@ -27,7 +48,220 @@ class Instr(TypedDict):
     args: list[int | str]
 
 
-Cell = Union[np.int32, Instr]
+Cell = Union[int, Instr]
+
+# Машинное слово: [31:27] код операции, далее поля аргументов
+WORD_TYPECODE = 'i'
+OPCODE_SHIFT = 27
+OPCODE_MASK = 0x1F
+ADDR_WIDTH = 24
+MAX_ADDR = (1 << ADDR_WIDTH) - 1
+
+_REG_A = (24, 3)
+_REG_B = (21, 3)
+_REG_C = (18, 3)
+_ADDR = (0, ADDR_WIDTH)
+# непосредственный операнд -- знаковое поле в дополнительном коде
+IMM_WIDTH = 21
+IMM_MIN = -(1 << (IMM_WIDTH - 1))
+IMM_MAX = (1 << (IMM_WIDTH - 1)) - 1
+_IMM = (0, IMM_WIDTH)
+PORT_WIDTH = 8
+_PORT = (0, PORT_WIDTH)
+# порты потокового ввода-вывода
+INPUT_PORT = 0
+OUTPUT_PORT = 1
+
+# Нулевой код не используется: нулевая ячейка данных не является инструкцией
+OPCODE_CODES: dict[Opcode, int] = {
+    Opcode.ADD: 1,
+    Opcode.SUB: 2,
+    Opcode.MOD: 3,
+    Opcode.INC: 4,
+    Opcode.DEC: 5,
+    Opcode.LD: 6,
+    Opcode.ST: 7,
+    Opcode.MV: 8,
+    Opcode.BE: 9,
+    Opcode.BNE: 10,
+    Opcode.JMP: 11,
+    Opcode.HLT: 12,
+    Opcode.LDI: 13,
+    Opcode.ADDI: 14,
+    Opcode.SUBI: 15,
+    Opcode.MODI: 16,
+    Opcode.IN: 17,
+    Opcode.OUT: 18,
+}
+_OPCODES_BY_CODE = {code: opcode for opcode, code in OPCODE_CODES.items()}
+
+ARG_FIELDS: dict[Opcode, tuple[tuple[int, int], ...]] = {
+    Opcode.ADD: (_REG_A, _REG_B, _REG_C),
+    Opcode.SUB: (_REG_A, _REG_B, _REG_C),
+    Opcode.MOD: (_REG_A, _REG_B, _REG_C),
+    Opcode.INC: (_REG_A, _REG_B),
+    Opcode.DEC: (_REG_A, _REG_B),
+    Opcode.LD: (_ADDR, _REG_A),
+    Opcode.ST: (_REG_A, _ADDR),
+    Opcode.MV: (_REG_A, _REG_B),
+    Opcode.BE: (_ADDR,),
+    Opcode.BNE: (_ADDR,),
+    Opcode.JMP: (_ADDR,),
+    Opcode.HLT: (),
+    Opcode.LDI: (_IMM, _REG_A),
+    Opcode.ADDI: (_REG_A, _IMM, _REG_B),
+    Opcode.SUBI: (_REG_A, _IMM, _REG_B),
+    Opcode.MODI: (_REG_A, _IMM, _REG_B),
+    Opcode.IN: (_PORT, _REG_A),
+    Opcode.OUT: (_REG_A, _PORT),
+}
+# номер непосредственного операнда у инструкций с ним
+IMMEDIATE_ARGS: dict[Opcode, int] = {
+    Opcode.LDI: 0,
+    Opcode.ADDI: 1,
+    Opcode.SUBI: 1,
+    Opcode.MODI: 1,
+}
+
+
+def fits_immediate(value: int) -> bool:
+    return IMM_MIN <= value <= IMM_MAX
+
+
+def encode_instr(instr: Instr) -> int:
+    """Упаковывает инструкцию в одно 32-битное знаковое слово"""
+    opcode = instr["opcode"]
+    args = instr.get("args", [])
+    fields = ARG_FIELDS[opcode]
+    assert len(args) == len(fields), "bad instruction {}".format(instr)
+    word = OPCODE_CODES[opcode] << OPCODE_SHIFT
+    immediate = IMMEDIATE_ARGS.get(opcode)
+    for i, (arg, (shift, width)) in enumerate(zip(args, fields)):
+        if i == immediate:
+            assert isinstance(arg, int) and fits_immediate(arg), "Immediate {} does not fit in instruction {}".format(arg, instr)
+            arg &= (1 << width) - 1
+        assert isinstance(arg, int) and 0 <= arg < (1 << width), "Argument {} does not fit in instruction {}".format(arg, instr)
+        word |= arg << shift
+    return word - (1 << 32) if word > WORD_MAX else word
+
+
+def decode_instr(word: int) -> Instr | None:
+    """Распаковывает слово в инструкцию, None -- если код операции не существует"""
+    opcode = _OPCODES_BY_CODE.get((word >> OPCODE_SHIFT) & OPCODE_MASK)
+    if opcode is None:
+        return None
+    if opcode is Opcode.HLT:
+        return {"opcode": opcode}
+    args = [(word >> shift) & ((1 << width) - 1) for shift, width in ARG_FIELDS[opcode]]
+    immediate = IMMEDIATE_ARGS.get(opcode)
+    if immediate is not None and args[immediate] > IMM_MAX:
+        args[immediate] -= 1 << IMM_WIDTH
+    return {"opcode": opcode, "args": args}
+
+
+def pack_code(code: list[Cell]) -> array:
+    """Переводит код в массив машинных слов"""
+    words = array(WORD_TYPECODE)
+    for cell in code:
+        if isinstance(cell, dict):
+            words.append(encode_instr(cell))
+        else:
+            words.append(cell)
+    return words
+
+
+class CodeImage(NamedTuple):
+    """Образ программы: машинные слова, длина сегмента кода и таблица символов"""
+    words: array | memoryview
+    text_size: int
+    symbols: dict[str, int]
+
+
+# Бинарный формат: заголовок, слова (little-endian int32), необязательная таблица символов
+BINARY_MAGIC = b'CMMB'
+BINARY_VERSION = 1
+_HEADER = struct.Struct('<4sHHIII')  # magic, version, flags, word_count, text_size, symbol_count
+_SYMBOL = struct.Struct('<IH')  # address, name_length
+FLAG_SYMBOLS = 0x1
+
+
+def text_size_of(code: list[Cell]) -> int:
+    """Длина сегмента кода: до последней инструкции включительно"""
+    for i in range(len(code) - 1, -1, -1):
+        if isinstance(code[i], dict):
+            return i + 1
+    return 0
+
+
+def unpack_code(words, text_size: int) -> list[Cell]:
+    """Обратное преобразование слов в ячейки (для отладочного JSON)"""
+    code: list[Cell] = []
+    for i, word in enumerate(words):
+        instr = decode_instr(word) if i < text_size else None
+        if instr is not None and encode_instr(instr) == word:
+            code.append(instr)
+        else:
+            code.append(word)
+    return code
+
+
+def write_code_binary(filename: str, code: list[Cell] | array, text_size: int | None = None,
+                      symbols: dict[str, int] | None = None):
+    if isinstance(code, list):
+        if text_size is None:
+            text_size = text_size_of(code)
+        code = pack_code(code)
+    assert text_size is not None, "text size is required for packed code"
+    words = array(WORD_TYPECODE, code)
+    if sys.byteorder != 'little':
+        words.byteswap()
+    symbols = symbols or {}
+    with open(filename, "wb") as file:
+        file.write(_HEADER.pack(BINARY_MAGIC, BINARY_VERSION, FLAG_SYMBOLS if symbols else 0,
+                                len(words), text_size, len(symbols)))
+        file.write(words.tobytes())
+        for name, address in symbols.items():
+            encoded = name.encode("utf-8")
+            file.write(_SYMBOL.pack(address, len(encoded)))
+            file.write(encoded)
+
+
+def read_code_binary(filename: str) -> CodeImage:
+    """Отображает файл в память; слова читаются из mmap без копирования"""
+    with open(filename, "rb") as file:
+        buffer = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+    magic, version, flags, word_count, text_size, symbol_count = _HEADER.unpack_from(buffer, 0)
+    assert magic == BINARY_MAGIC, "Not a binary code file"
+    assert version == BINARY_VERSION, "Unsupported binary code version {}".format(version)
+    offset = _HEADER.size
+    end = offset + word_count * 4
+    assert end <= len(buffer), "Truncated binary code file"
+    words: array | memoryview = memoryview(buffer)[offset:end].cast(WORD_TYPECODE)
+    if sys.byteorder != 'little':
+        words = array(WORD_TYPECODE, words)
+        words.byteswap()
+
+    symbols = {}
+    if flags & FLAG_SYMBOLS:
+        for _ in range(symbol_count):
+            address, length = _SYMBOL.unpack_from(buffer, end)
+            end += _SYMBOL.size
+            symbols[buffer[end:end + length].decode("utf-8")] = address
+            end += length
+    return CodeImage(words, text_size, symbols)
+
+
+def is_binary_code(filename: str) -> bool:
+    with open(filename, "rb") as file:
+        return file.read(len(BINARY_MAGIC)) == BINARY_MAGIC
+
+
+def load_code(filename: str) -> CodeImage:
+    """Загружает программу в любом из форматов"""
+    if is_binary_code(filename):
+        return read_code_binary(filename)
+    code = read_code(filename)
+    return CodeImage(pack_code(code), text_size_of(code), {})
 
 
 def write_code(filename: str, code: list[Cell]):
@@ -40,8 +274,23 @@ def read_code(filename: str) -> list[Cell]:
         code = json.loads(file.read())
     for i, cell in enumerate(code):
         if isinstance(cell, int):
-            code[i] = np.int32(cell)
+            assert WORD_MIN <= cell <= WORD_MAX, "Value {} does not fit in machine word".format(cell)
         else:
             cell["opcode"] = Opcode(cell["opcode"])
 
     return code
+
+
+
+def main(args):
+    assert len(args) == 2, "Wrong arguments: isa.py <input_file> <output_file>"
+    input_file, output_file = args
+    if is_binary_code(input_file):
+        image = read_code_binary(input_file)
+        write_code(output_file, unpack_code(image.words, image.text_size))
+    else:
+        write_code_binary(output_file, read_code(input_file))
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,275 @@
+"""Трансляция базовых блоков машинного кода в функции Python.
+
+Блок начинается с адреса входа и заканчивается переходом, HLT, записью в
+R4 (PC) или перед следующим лидером (целью перехода). Каждая функция блока
+изменяет регистры и память так же, как быстрый режим ControlUnit, и возвращает
+число исполненных инструкций, число тактов и признак останова. Всё, что блок
+не может исполнить сам (неверная инструкция или адрес, ввод-вывод, граница limit),
+исполняется резервным интерпретатором -- таблицей обработчиков ControlUnit.
+"""
+from isa import ARG_FIELDS, Opcode, decode_instr
+
+MAX_BLOCK_LENGTH = 256
+REG_COUNT = 5
+
+_BRANCHES = (Opcode.JMP, Opcode.BE, Opcode.BNE)
+_WRAP = "if not -0x80000000 <= {0} <= 0x7FFFFFFF:\n        {0} = ((({0}) + 0x80000000) & 0xFFFFFFFF) - 0x80000000"
+
+
+def find_leaders(memory, program_size: int) -> set[int]:
+    """Начала базовых блоков: вход, цели переходов и адреса после переходов"""
+    leaders = {0}
+    for address in range(program_size):
+        instr = decode_instr(memory[address])
+        if instr is not None and instr["opcode"] in _BRANCHES:
+            leaders.add(instr["args"][0])
+            leaders.add(address + 1)
+    return leaders
+
+
+class Block:
+    def __init__(self, function, entry: int, length: int):
+        self.function = function
+        self.entry = entry
+        self.length = length
+
+
+class _BlockBuilder:
+    """Генерирует исходный код функции одного блока"""
+
+    def __init__(self, memory_size: int):
+        self._memory_size = memory_size
+        self.lines: list[str] = []
+        self.read: set[int] = set()
+        self.written: set[int] = set()
+        self.flag: str | None = None
+        self.count = 0
+        self.ticks = 0
+
+    def reg(self, reg: int) -> str:
+        if reg not in self.written:
+            self.read.add(reg)
+        return "r{}".format(reg)
+
+    def emit(self, line: str):
+        self.lines.append("    " + line)
+
+    def set_result(self, reg: int, expr: str, wrap: bool):
+        temp = "t{}".format(self.count)
+        self.emit("{} = {}".format(temp, expr))
+        if wrap:
+            self.emit(_WRAP.format(temp))
+        self.flag = "{} == 0".format(temp)
+        self.emit("r{} = {}".format(reg, temp))
+        self.written.add(reg)
+
+    def exit_lines(self, next_pc: str, extra_ticks: int = 0, halted: bool = False,
+                   flag: str | None = None, indent: str = "") -> list[str]:
+        lines = ["r[{0}] = r{0}".format(reg) for reg in sorted(self.written)]
+        lines.append("r[4] = {}".format(next_pc))
+        flag = flag if flag is not None else self.flag
+        if flag is not None:
+            lines.append("dp.set_zero_flag({})".format(flag))
+        lines.append("return {}, {}, {}".format(self.count, self.ticks + extra_ticks, halted))
+        return ["    " + indent + line for line in lines]
+
+    def exit(self, next_pc: str, **kwargs):
+        self.lines.extend(self.exit_lines(next_pc, **kwargs))
+
+    def valid_regs(self, instr, fields) -> bool:
+        return all(not (width == 3 and arg >= REG_COUNT) for arg, (_, width) in zip(instr.get("args", []), fields))
+
+    def add(self, address: int, instr) -> bool:
+        """Добавляет инструкцию; False -- блок завершён"""
+        opcode = instr["opcode"]
+        args = instr.get("args", [])
+        next_pc = address + 1
+        if not self.valid_regs(instr, ARG_FIELDS[opcode]):
+            return self.stop(next_pc - 1)
+
+        def src(reg: int) -> str:
+            return str(next_pc) if reg == 4 else self.reg(reg)
+
+        if opcode in (Opcode.IN, Opcode.OUT):
+            # ввод-вывод исполняет резервный интерпретатор
+            return self.stop(address)
+
+        if opcode is Opcode.HLT:
+            self.ticks += 1
+            self.exit(str(next_pc), halted=True)
+            return False
+
+        if opcode is Opcode.JMP:
+            self.count += 1
+            self.ticks += 2
+            self.exit(str(args[0]), flag=str(args[0] == 0))
+            return False
+
+        if opcode in (Opcode.BE, Opcode.BNE):
+            self.count += 1
+            self.ticks += 2
+            flag = self.flag if self.flag is not None else "dp.zero_flag()"
+            self.emit("if {}({}):".format("" if opcode is Opcode.BE else "not ", flag))
+            self.lines.extend(self.exit_lines(str(args[0]), extra_ticks=1, flag=str(args[0] == 0), indent="    "))
+            self.exit(str(next_pc), flag=flag)
+            return False
+
+        if opcode in (Opcode.LD, Opcode.ST):
+            addr = args[0] if opcode is Opcode.LD else args[1]
+            if not 0 <= addr < self._memory_size:
+                return self.stop(address)
+            self.count += 1
+            self.ticks += 2
+            self.flag = str(addr == 0)
+            if opcode is Opcode.LD:
+                self.emit("r{} = m[{}]".format(args[1], addr))
+                self.written.add(args[1])
+                return args[1] != 4 or self.stop_after(next_pc, "r4")
+            self.emit("m[{}] = {}".format(addr, src(args[0])))
+            self.emit("invalidate_handler({})".format(addr))
+            self.emit("if {} in owners:".format(addr))
+            self.emit("    invalidate({})".format(addr))
+            self.lines.extend(self.exit_lines(str(next_pc), indent="    "))
+            return True
+
+        self.count += 1
+        self.ticks += 2
+        if opcode is Opcode.ADD:
+            self.set_result(args[2], "{} + {}".format(src(args[0]), src(args[1])), True)
+        elif opcode is Opcode.SUB:
+            self.set_result(args[2], "{} - {}".format(src(args[0]), src(args[1])), True)
+        elif opcode is Opcode.MOD:
+            self.set_result(args[2], "{0} % {1} if {1} else 0".format(src(args[0]), src(args[1])), False)
+        elif opcode is Opcode.INC:
+            self.set_result(args[1], "{} + 1".format(src(args[0])), True)
+        elif opcode is Opcode.DEC:
+            self.set_result(args[1], "{} - 1".format(src(args[0])), True)
+        elif opcode is Opcode.MV:
+            self.set_result(args[1], src(args[0]), False)
+        elif opcode is Opcode.LDI:
+            self.set_result(args[1], str(args[0]), False)
+        elif opcode is Opcode.ADDI:
+            self.set_result(args[2], "{} + ({})".format(src(args[0]), args[1]), True)
+        elif opcode is Opcode.SUBI:
+            self.set_result(args[2], "{} - ({})".format(src(args[0]), args[1]), True)
+        elif opcode is Opcode.MODI:
+            self.set_result(args[2], "{} % ({})".format(src(args[0]), args[1]) if args[1] else "0", False)
+        dest = args[-1]
+        return dest != 4 or self.stop_after(next_pc, "r4")
+
+    def stop_after(self, next_pc: int, target: str) -> bool:
+        self.written.discard(4)
+        self.exit(target)
+        return False
+
+    def stop(self, next_pc: int) -> bool:
+        self.exit(str(next_pc))
+        return False
+
+    def source(self) -> str:
+        head = ["def block(r, m, dp):"]
+        head += ["    r{0} = r[{0}]".format(reg) for reg in sorted(self.read) if reg != 4]
+        return "\n".join(head + self.lines) + "\n"
+
+
+class BlockCache:
+    """Скомпилированные блоки по адресу входа и обратный индекс адрес -> блоки. None -- вход, с которого
+    блок не начинается (ввод-вывод, неверная инструкция): его сразу исполняет резервный интерпретатор"""
+
+    def __init__(self, control_unit, memory, program_size: int):
+        self._control_unit = control_unit
+        self._memory = memory
+        self._leaders = find_leaders(memory, program_size)
+        self.blocks: dict[int, Block | None] = {}
+        self.owners: dict[int, set[int]] = {}
+        self.handlers = control_unit.decode_program(program_size)
+        self._namespace = {
+            "invalidate_handler": control_unit.invalidate,
+            "owners": self.owners,
+            "invalidate": self.invalidate,
+        }
+
+    def invalidate(self, address: int):
+        """Запись в ячейку кода: все блоки, содержащие её, будут перекомпилированы"""
+        self._control_unit.invalidate(address)
+        for entry in self.owners.pop(address, ()):
+            block = self.blocks.pop(entry, None)
+            if block is None:
+                continue
+            for covered in range(entry, entry + block.length):
+                entries = self.owners.get(covered)
+                if entries is not None:
+                    entries.discard(entry)
+                    if not entries:
+                        del self.owners[covered]
+
+    def get(self, entry: int) -> Block | None:
+        block = self.blocks.get(entry, False)
+        if block is False:
+            block = self.compile(entry)
+        return block
+
+    def compile(self, entry: int) -> Block | None:
+        memory = self._memory
+        if not 0 <= entry < len(memory):
+            return None
+        builder = _BlockBuilder(len(memory))
+        address = entry
+        while True:
+            instr = decode_instr(memory[address])
+            if instr is None or len(instr.get("args", [])) != len(ARG_FIELDS[instr["opcode"]]):
+                builder.stop(address)
+                break
+            if not builder.add(address, instr):
+                address += 1
+                break
+            address += 1
+            if address >= len(memory) or address in self._leaders or address - entry >= MAX_BLOCK_LENGTH:
+                builder.stop(address)
+                break
+        length = address - entry
+        if builder.count == 0 and builder.ticks == 0:
+            # отрицательная запись: запись в ячейку входа снимает её, как и блоки
+            self.blocks[entry] = None
+            self.owners.setdefault(entry, set()).add(entry)
+            return None
+        namespace = dict(self._namespace)
+        exec(compile(builder.source(), "<jit block {}>".format(entry), "exec"), namespace)
+        block = Block(namespace["block"], entry, max(length, 1))
+        self.blocks[entry] = block
+        for covered in range(entry, entry + block.length):
+            self.owners.setdefault(covered, set()).add(entry)
+        return block
+
+
+def execute(control_unit, data_path, program_size: int, limit: int) -> int:
+    """Исполняет программу блоками до HLT, возвращает число инструкций"""
+    registers = data_path.registers
+    memory = data_path.memory
+    cache = BlockCache(control_unit, memory, program_size)
+    handlers = cache.handlers
+    instr_counter = 0
+    while True:
+        pc = registers[4]
+        block = cache.blocks.get(pc, False)
+        if block is False:
+            block = cache.compile(pc)
+        if block is not None and instr_counter + block.length <= limit:
+            count, ticks, halted = block.function(registers, memory, data_path)
+            instr_counter += count
+            control_unit.tick(ticks)
+            if halted:
+                return instr_counter
+            continue
+
+        # резервный интерпретатор: одна инструкция быстрого режима
+        assert limit > instr_counter, "too long execution, increase limit!"
+        # вход без блока -- ввод-вывод или ошибка, но не ST; ST исполняется здесь только на границе limit
+        instr = decode_instr(memory[pc]) if block is not None else None
+        try:
+            handlers[pc]()
+        except StopIteration:
+            return instr_counter
+        instr_counter += 1
+        if instr is not None and instr["opcode"] is Opcode.ST and instr["args"][1] in cache.owners:
+            cache.invalidate(instr["args"][1])
@@ -0,0 +1,272 @@
+"""Исполнение одной программы на многих входах в lockstep: состояния N машин -- массивы NumPy.
+
+Регистры -- массив (N, 5), память -- (N, memory_size), флаг нуля -- (N,). На каждом
+шаге выбирается наименьший PC среди работающих дорожек, и инструкция по этому
+адресу исполняется сразу для всех дорожек с этим PC; разошедшиеся на BE/BNE ждут
+своей очереди, остановившиеся на HLT или с ошибкой исключаются. Выбор наименьшего
+PC сводит дорожки обратно после if и на выходе из циклов. Пока все работающие
+дорожки идут вместе, группа не пересчитывается.
+
+Семантика и счётчики -- как у быстрого режима ControlUnit: число инструкций и
+тактов каждой дорожки совпадает с machine.simulation с её входом. Адреса LD/ST --
+непосредственные, поэтому запись в память помечает ячейку для всех дорожек; из
+помеченных ячеек инструкция выбирается по памяти каждой дорожки.
+"""
+from array import array
+from typing import NamedTuple
+
+import numpy as np
+
+from isa import ARG_FIELDS, INPUT_PORT, OUTPUT_PORT, WORD_MAX, WORD_MIN, WORD_TYPECODE, CodeImage, Opcode, decode_instr
+from machine import INSTR_LIMIT, MEMORY_SIZE, Result, load_memory
+
+REG_COUNT = 5
+PC = 4
+
+_UNARY = (Opcode.INC, Opcode.DEC, Opcode.MV)
+_IMMEDIATE = (Opcode.ADDI, Opcode.SUBI, Opcode.MODI)
+
+
+def wrap(values: np.ndarray) -> np.ndarray:
+    """32-битное переполнение для значений int64"""
+    return ((values - WORD_MIN) & 0xFFFFFFFF) + WORD_MIN
+
+
+def mod(left: np.ndarray, right) -> np.ndarray:
+    """Остаток со знаком делителя, деление на ноль даёт 0 (как isa.mod_word)"""
+    nonzero = right != 0
+    return np.where(nonzero, np.mod(left, np.where(nonzero, right, 1)), 0)
+
+
+class LaneResults(NamedTuple):
+    """Итог по дорожкам: счётчики (N,), выведенные токены, память (N, memory_size) и ошибки (None -- HLT)"""
+    instr_counter: np.ndarray
+    ticks: np.ndarray
+    outputs: list[list[int]]
+    memory: np.ndarray
+    errors: list[str | None]
+    symbols: dict[str, int]
+
+    def result(self, lane: int) -> Result:
+        return Result(int(self.instr_counter[lane]), int(self.ticks[lane]), self.outputs[lane],
+                      array(WORD_TYPECODE, self.memory[lane].tolist()), self.symbols)
+
+
+def decode(word: int):
+    """(opcode, args) или None для неверной инструкции и номеров регистров вне R0-R4"""
+    instr = decode_instr(word)
+    if instr is None:
+        return None
+    args = instr.get("args", [])
+    opcode = instr["opcode"]
+    if any(width == 3 and arg >= REG_COUNT for arg, (_, width) in zip(args, ARG_FIELDS[opcode])):
+        return None
+    return opcode, args
+
+
+class Lanes:
+    def __init__(self, image: CodeImage, inputs: list[list[int]], memory_size: int = MEMORY_SIZE,
+                 limit: int = INSTR_LIMIT):
+        count = len(inputs)
+        assert count > 0, "At least one lane is required"
+        self.symbols = image.symbols
+        self.limit = limit
+        self.memory_size = memory_size
+        self.initial = np.array(load_memory(image.words, memory_size), dtype=np.int32)
+        self.memory = np.tile(self.initial, (count, 1))
+        self.registers = np.zeros((count, REG_COUNT), dtype=np.int64)
+        self.flags = np.zeros(count, dtype=bool)
+        self.instr_counter = np.zeros(count, dtype=np.int64)
+        self.ticks = np.zeros(count, dtype=np.int64)
+        self.active = np.ones(count, dtype=bool)
+        self.errors: list[str | None] = [None] * count
+        self.outputs: list[list[int]] = [[] for _ in range(count)]
+        width = max(1, max(len(tokens) for tokens in inputs))
+        self.tokens = np.zeros((count, width), dtype=np.int64)
+        for lane, tokens in enumerate(inputs):
+            self.tokens[lane, :len(tokens)] = tokens
+        self.lengths = np.array([len(tokens) for tokens in inputs], dtype=np.int64)
+        self.cursors = np.zeros(count, dtype=np.int64)
+        # ячейки, в которые писала хоть одна дорожка: инструкцию из них нельзя брать из начального образа
+        self.written = np.zeros(memory_size, dtype=bool)
+        self._decoded: dict[int, tuple | None] = {}
+
+    def fail(self, lanes: np.ndarray, message: str):
+        for lane in lanes.tolist():
+            self.errors[lane] = message
+        self.active[lanes] = False
+
+    def instruction(self, pc: int, group: np.ndarray) -> tuple[tuple | None, np.ndarray]:
+        """Инструкция по адресу pc и дорожки группы, которые её исполняют"""
+        if not self.written[pc]:
+            word = int(self.initial[pc])
+        else:
+            words = self.memory[group, pc]
+            word = int(words[0])
+            group = group[words == word]
+        instr = self._decoded.get(word, False)
+        if instr is False:
+            instr = self._decoded[word] = decode(word)
+        return instr, group
+
+    def run(self) -> LaneResults:
+        registers, flags, memory = self.registers, self.flags, self.memory
+        group = None
+        pc = 0
+        together = False
+        while True:
+            if group is None:
+                live = np.flatnonzero(self.active)
+                if not live.size:
+                    break
+                pcs = registers[live, PC]
+                pc = int(pcs.min())
+                group = live[pcs == pc]
+                together = group.size == live.size
+            if not 0 <= pc < self.memory_size:
+                self.fail(group, "Invalid address")
+                group = None
+                continue
+
+            over = self.instr_counter[group] >= self.limit
+            if over.any():
+                self.fail(group[over], "too long execution, increase limit!")
+                group = group[~over]
+                if not group.size:
+                    group = None
+                    continue
+            instr, lanes = self.instruction(pc, group)
+            if lanes.size != group.size:
+                together = False
+            group = lanes
+            if instr is None:
+                self.fail(group, "bad instruction")
+                group = None
+                continue
+
+            opcode, args = instr
+            next_pc = pc + 1
+            if opcode is Opcode.HLT:
+                registers[group, PC] = next_pc
+                self.ticks[group] += 1
+                self.active[group] = False
+                group = None
+                continue
+
+            self.instr_counter[group] += 1
+            if opcode in (Opcode.BE, Opcode.BNE):
+                taken = flags[group] if opcode is Opcode.BE else ~flags[group]
+                target = args[0]
+                if taken.all() or not taken.any():
+                    pc = target if taken[0] else next_pc
+                    registers[group, PC] = pc
+                    if taken[0]:
+                        flags[group] = target == 0
+                    self.ticks[group] += 3 if taken[0] else 2
+                else:
+                    jumped = group[taken]
+                    registers[group, PC] = np.where(taken, target, next_pc)
+                    flags[jumped] = target == 0
+                    self.ticks[group] += np.where(taken, 3, 2)
+                    together = False
+                if not together:
+                    group = None
+                continue
+
+            self.ticks[group] += 2
+            registers[group, PC] = next_pc
+            if opcode is Opcode.JMP:
+                pc = args[0]
+                registers[group, PC] = pc
+                flags[group] = pc == 0
+                if not together:
+                    group = None
+                continue
+
+            dest = None
+            if opcode in (Opcode.ADD, Opcode.SUB, Opcode.MOD):
+                left, right = registers[group, args[0]], registers[group, args[1]]
+                if opcode is Opcode.ADD:
+                    result = wrap(left + right)
+                elif opcode is Opcode.SUB:
+                    result = wrap(left - right)
+                else:
+                    result = mod(left, right)
+                dest = args[2]
+            elif opcode in _IMMEDIATE:
+                left, imm = registers[group, args[0]], args[1]
+                if opcode is Opcode.ADDI:
+                    result = wrap(left + imm)
+                elif opcode is Opcode.SUBI:
+                    result = wrap(left - imm)
+                else:
+                    result = np.mod(left, imm) if imm else np.zeros_like(left)
+                dest = args[2]
+            elif opcode in _UNARY:
+                value = registers[group, args[0]]
+                if opcode is Opcode.INC:
+                    result = wrap(value + 1)
+                elif opcode is Opcode.DEC:
+                    result = wrap(value - 1)
+                else:
+                    result = value
+                dest = args[1]
+            elif opcode is Opcode.LDI:
+                result = np.full(group.size, args[0], dtype=np.int64)
+                dest = args[1]
+            elif opcode in (Opcode.LD, Opcode.ST):
+                addr = args[0] if opcode is Opcode.LD else args[1]
+                flags[group] = addr == 0
+                if not 0 <= addr < self.memory_size:
+                    self.fail(group, "Invalid address")
+                    group = None
+                    continue
+                if opcode is Opcode.ST:
+                    memory[group, addr] = registers[group, args[0]]
+                    self.written[addr] = True
+                else:
+                    registers[group, args[1]] = memory[group, addr]
+                    if args[1] == PC:
+                        group = None
+            elif opcode is Opcode.IN:
+                port, dest = args
+                if port != INPUT_PORT:
+                    self.fail(group, "Port {} is not readable".format(port))
+                    group = None
+                    continue
+                cursors = self.cursors[group]
+                exhausted = cursors >= self.lengths[group]
+                result = self.tokens[group, np.minimum(cursors, self.tokens.shape[1] - 1)]
+                invalid = exhausted | (result < WORD_MIN) | (result > WORD_MAX)
+                if invalid.any():
+                    for lane, empty in zip(group[invalid].tolist(), exhausted[invalid].tolist()):
+                        self.fail(np.array([lane]), "Input stream is exhausted" if empty else
+                                  "Token {} does not fit in machine word".format(self.tokens[lane, self.cursors[lane]]))
+                    group, result, cursors = group[~invalid], result[~invalid], cursors[~invalid]
+                    together = False
+                self.cursors[group] = cursors + 1
+            elif opcode is Opcode.OUT:
+                reg, port = args
+                if port != OUTPUT_PORT:
+                    self.fail(group, "Port {} is not writable".format(port))
+                    group = None
+                    continue
+                for lane, value in zip(group.tolist(), registers[group, reg].tolist()):
+                    self.outputs[lane].append(value)
+
+            if dest is not None:
+                registers[group, dest] = result
+                flags[group] = result == 0
+                if dest == PC:
+                    group = None
+            if group is None or not together or not group.size:
+                group = None
+            else:
+                pc = next_pc
+        return LaneResults(self.instr_counter, self.ticks, self.outputs, self.memory, self.errors, self.symbols)
+
+
+def run_lanes(image: CodeImage, inputs: list[list[int]], memory_size: int = MEMORY_SIZE,
+              limit: int = INSTR_LIMIT) -> LaneResults:
+    """Исполняет программу для каждого входа; результат дорожки i -- как у machine.run с inputs[i]"""
+    return Lanes(image, inputs, memory_size, limit).run()
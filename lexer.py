@@ -36,23 +36,43 @@ token_exprs = [
     (re.compile(r'\".*\"'), STRING)
 ]
 
+# Все правила в одной альтернации: порядок ветвей сохраняет приоритет правил
+_master = re.compile('|'.join('(?P<T{}>{})'.format(i, pattern.pattern) for i, (pattern, _) in enumerate(token_exprs))
+                     + r'|(?P<ILLEGAL>[\s\S])')
+_group_tags = {'T{}'.format(i): tag for i, (_, tag) in enumerate(token_exprs)}
+
+
+def _scan(characters):
+    for match in _master.finditer(characters):
+        group = match.lastgroup
+        assert group != 'ILLEGAL', "Illegal character: {}\n".format(match.group())
+        tag = _group_tags[group]
+        if tag:
+            yield (match.group(), tag)
+
+
 def lex(characters):
-    characters += '\n'
-    pos = 0
-    tokens = []
-    while pos < len(characters):
-        match = None
-        for token_expr in token_exprs:
-            pattern, tag = token_expr
-            char_pos = characters[pos:]
-            match = pattern.match(characters, pos)
-            if match:
-                text = match.group(0)
-                if tag:
-                    token = (text, tag)
-                    tokens.append(token)
-                break
-        assert match, "Illegal character: {}\n".format(characters[pos])
-        pos = match.end(0)
-    return tokens
-            
\ No newline at end of file
+    return list(_scan(characters + '\n'))
+
+
+def lex_stream(file, chunk_size=1 << 16):
+    """Лексемы из файлового объекта, читаемого порциями.
+
+    Лексемы не переходят через перевод строки, поэтому разбираются только
+    завершённые строки, а хвост порции переносится в следующую.
+    """
+    # части незавершённой строки: перевод строки ищется только в новой порции
+    pending = []
+    while True:
+        chunk = file.read(chunk_size)
+        if not chunk:
+            break
+        end = chunk.rfind('\n') + 1
+        if end:
+            pending.append(chunk[:end])
+            yield from _scan(''.join(pending))
+            pending = [chunk[end:]]
+        else:
+            pending.append(chunk)
+    pending.append('\n')
+    yield from _scan(''.join(pending))
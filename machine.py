@@ -1,38 +1,56 @@
 """Модель процессора"""
-import logging
+import hashlib
+import heapq
+import json
+import os
 import sys
-from random import randint
+from array import array
+from concurrent.futures import ProcessPoolExecutor
+from enum import Enum
 
-from typing import Tuple
+from typing import Callable, NamedTuple, Tuple
 
-from isa import Cell, Instr, Opcode, read_code
-import numpy as np
+from isa import WORD_TYPECODE, CodeImage, Instr, Opcode, decode_instr, load_code, mod_word, pack_code, wrap_word
+from ports import PortIO, TokenIO, stdio_ports
+from tracing import CsvTraceSink, Tracer, make_tracer
+import jit
 
 
-ZERO = np.int32(0)
+ZERO = 0
+MEMORY_SIZE = 512
+INSTR_LIMIT = 30000
+
+
+class ExecMode(str, Enum):
+    """Режим исполнения: по сигналам тракта данных, по предекодированной таблице или скомпилированными блоками"""
+    MICRO = 'micro'
+    FAST = 'fast'
+    JIT = 'jit'
 
 
 class DataPath:
     """Тракт данных"""
     _memory_size: int
-    memory: list[Cell]
-    registers: list[Cell]
-    _bus1: Cell
-    _bus2: Cell
-    _bus1_mux: Cell
-    _alu: np.int32
+    memory: array
+    registers: list[int]
+    _bus1: int
+    _bus2: int
+    _bus1_mux: int
+    _alu: int
     _zero_flag: bool
     _inverse_alu_in1: bool
     _inverse_alu_in2: bool
     _inc_alu_in1: bool
     _inc_alu_in2: bool
     _add_or_mod: bool
-    instr_val: np.int32
+    instr_val: int
+    io: PortIO
 
-    def __init__(self, memory: list[Cell], memory_size: int):
+    def __init__(self, memory: array, memory_size: int, io: PortIO | None = None):
         assert memory_size > 0, "Memory size should be non-zero"
         self._memory_size = memory_size
         self.memory = memory
+        self.io = io if io is not None else TokenIO()
         self.registers = [ZERO] * 5
         self._bus1 = ZERO
         self._bus2 = ZERO
@@ -45,6 +63,13 @@ class DataPath:
         self._inc_alu_in2 = False
         self._add_or_mod = False
 
+    def reset(self, memory: array, io: PortIO):
+        """Начальное состояние перед новым запуском: память копируется на место, регистры и флаг обнуляются"""
+        self.memory[:] = memory
+        self.registers[:] = [ZERO] * len(self.registers)
+        self._zero_flag = False
+        self.io = io
+
     def select_registers(self, reg1: int, reg2: int):
         assert reg1 < len(self.registers), "Register R{} does not exists".format(reg1)
         assert reg2 < len(self.registers), "Register R{} does not exists".format(reg2)
@@ -59,22 +84,24 @@ class DataPath:
         assert reg < len(self.registers), "Register R{} does not exists".format(reg)
         self.registers[reg] = self._alu
 
-    def get_instruction(self) -> Cell:
-        if not(isinstance(self.registers[-1], np.int32)):
-            address = randint(0, 512)
-        else:
-            address = int(self.registers[-1])
-        return self.memory[address]
+    def get_instruction(self) -> int:
+        return self.memory[self.registers[-1]]
 
     def zero_flag(self):
         return self._zero_flag
 
+    def set_zero_flag(self, value: bool):
+        self._zero_flag = value
+
     def bus1_mux_signal_bus(self):
         self._bus1_mux = self._bus1
 
-    def bus1_mux_signal_instr(self, instr_val: np.int32):
+    def bus1_mux_signal_instr(self, instr_val: int):
         self._bus1_mux = instr_val
 
+    def bus2_signal_instr(self, instr_val: int):
+        self._bus2 = instr_val
+
     def execute_alu(self, save_flag: bool = False):
         in1 = self._bus1_mux
         in2 = self._bus2
@@ -86,17 +113,17 @@ class DataPath:
             in2 = ~in2
 
         if self._inc_alu_in1:
-            in1 += np.int32(1)
+            in1 += 1
 
         if self._inc_alu_in2:
-            in2 += np.int32(1)
+            in2 += 1
 
         if self._add_or_mod:
-            self._alu = in1 % in2
+            self._alu = mod_word(wrap_word(in1), wrap_word(in2))
         else:
-            self._alu = in1 + in2
+            self._alu = wrap_word(in1 + in2)
         if not save_flag:
-            self._zero_flag = self._alu == np.int32(0)
+            self._zero_flag = self._alu == 0
 
     def inc_alu_in1(self):
         self._inc_alu_in1 = True
@@ -136,11 +163,11 @@ class DataPath:
         assert 0 <= self._alu < self._memory_size, "Invalid address"
         self.memory[self._alu] = self._bus2
         
-    def input(self):
-        self._alu = sys.stdin.read(1)
-        
-    def output(self):
-        print(str(self._alu), end = "")
+    def input(self, port: int):
+        self._bus1_mux = self.io.read(port)
+
+    def output(self, port: int):
+        self.io.write(port, self._bus1)
 
 
 class ControlUnit:
@@ -152,14 +179,18 @@ class ControlUnit:
         self._tick = 0
         self.inverse_alu_in2 = False
         self.inc_alu_in1 = False
+        self._handlers = []
+
+    def reset(self):
+        self._tick = 0
 
-    def tick(self):
-        self._tick += 1
+    def tick(self, count: int = 1):
+        self._tick += count
 
     def current_tick(self):
         return self._tick
 
-    def fetch_instruction(self) -> Cell:
+    def fetch_instruction(self) -> int:
         instr = self._data_path.get_instruction()
         self._data_path.select_registers(4, -1)
         self._data_path.inc_alu_in1()
@@ -170,8 +201,9 @@ class ControlUnit:
         self.tick()
         return instr
 
-    def decode_and_execute_instruction(self, instr: Cell):
-        assert isinstance(instr, dict), "bad instruction"
+    def decode_and_execute_instruction(self, word: int):
+        instr = decode_instr(word)
+        assert instr is not None, "bad instruction"
         opcode: Opcode = instr["opcode"]
 
         if opcode is Opcode.HLT:
@@ -180,7 +212,7 @@ class ControlUnit:
         if opcode is Opcode.JMP:
             assert len(instr["args"]) == 1, "bad instruction"
             self._data_path.select_registers(-1, -1)
-            self._data_path.bus1_mux_signal_instr(np.int32(instr["args"][0]))
+            self._data_path.bus1_mux_signal_instr(instr["args"][0])
             self._data_path.pass_alu_in()
             self._data_path.select_add()
             self._data_path.execute_alu()
@@ -192,7 +224,7 @@ class ControlUnit:
             self.tick()
             if self._data_path.zero_flag():
                 self._data_path.select_registers(-1, -1)
-                self._data_path.bus1_mux_signal_instr(np.int32(instr["args"][0]))
+                self._data_path.bus1_mux_signal_instr(instr["args"][0])
                 self._data_path.pass_alu_in()
                 self._data_path.select_add()
                 self._data_path.execute_alu()
@@ -204,7 +236,7 @@ class ControlUnit:
             self.tick()
             if not(self._data_path.zero_flag()):
                 self._data_path.select_registers(-1, -1)
-                self._data_path.bus1_mux_signal_instr(np.int32(instr["args"][0]))
+                self._data_path.bus1_mux_signal_instr(instr["args"][0])
                 self._data_path.pass_alu_in()
                 self._data_path.select_add()
                 self._data_path.execute_alu()
@@ -274,7 +306,7 @@ class ControlUnit:
         elif opcode is Opcode.LD:
             assert len(instr["args"]) == 2, "bad instruction"
             self._data_path.select_registers(-1, -1)
-            self._data_path.bus1_mux_signal_instr(np.int32(instr["args"][0]))
+            self._data_path.bus1_mux_signal_instr(instr["args"][0])
             self._data_path.pass_alu_in()
             self._data_path.select_add()
             self._data_path.execute_alu()
@@ -285,7 +317,7 @@ class ControlUnit:
         elif opcode is Opcode.ST:
             assert len(instr["args"]) == 2, "bad instruction"
             self._data_path.select_registers(-1, -1)
-            self._data_path.bus1_mux_signal_instr(np.int32(instr["args"][1]))
+            self._data_path.bus1_mux_signal_instr(instr["args"][1])
             self._data_path.pass_alu_in()
             self._data_path.select_add()
             self._data_path.execute_alu()
@@ -293,9 +325,303 @@ class ControlUnit:
             self._data_path.wr()
             self.tick()
 
+        elif opcode is Opcode.LDI:
+            assert len(instr["args"]) == 2, "bad instruction"
+            self._data_path.select_registers(-1, -1)
+            self._data_path.bus1_mux_signal_instr(instr["args"][0])
+            self._data_path.pass_alu_in()
+            self._data_path.select_add()
+            self._data_path.execute_alu()
+            self._data_path.latch_register(instr["args"][1])
+            self.tick()
+
+        elif opcode is Opcode.ADDI:
+            assert len(instr["args"]) == 3, "bad instruction"
+            self._data_path.select_registers(instr["args"][0], -1)
+            self._data_path.bus2_signal_instr(instr["args"][1])
+            self._data_path.bus1_mux_signal_bus()
+            self._data_path.pass_alu_in()
+            self._data_path.select_add()
+            self._data_path.execute_alu()
+            self._data_path.latch_register(instr["args"][2])
+            self.tick()
+
+        elif opcode is Opcode.SUBI:
+            assert len(instr["args"]) == 3, "bad instruction"
+            self._data_path.select_registers(instr["args"][0], -1)
+            self._data_path.bus2_signal_instr(instr["args"][1])
+            self._data_path.bus1_mux_signal_bus()
+            self._data_path.negate_alu_in2()
+            self._data_path.select_add()
+            self._data_path.execute_alu()
+            self._data_path.latch_register(instr["args"][2])
+            self.tick()
+
+        elif opcode is Opcode.MODI:
+            assert len(instr["args"]) == 3, "bad instruction"
+            self._data_path.select_registers(instr["args"][0], -1)
+            self._data_path.bus2_signal_instr(instr["args"][1])
+            self._data_path.bus1_mux_signal_bus()
+            self._data_path.pass_alu_in()
+            self._data_path.select_mod()
+            self._data_path.execute_alu()
+            self._data_path.latch_register(instr["args"][2])
+            self.tick()
+
+        elif opcode is Opcode.IN:
+            assert len(instr["args"]) == 2, "bad instruction"
+            self._data_path.select_registers(-1, -1)
+            self._data_path.input(instr["args"][0])
+            self._data_path.pass_alu_in()
+            self._data_path.select_add()
+            self._data_path.execute_alu()
+            self._data_path.latch_register(instr["args"][1])
+            self.tick()
+
+        elif opcode is Opcode.OUT:
+            assert len(instr["args"]) == 2, "bad instruction"
+            self._data_path.select_registers(instr["args"][0], -1)
+            self._data_path.output(instr["args"][1])
+            self.tick()
+
         else:
             assert False, "bad instruction"
 
+    def decode_program(self, program_size: int) -> list[Callable[[], None]]:
+        """Декодирует образ программы один раз в таблицу обработчиков с привязанными операндами.
+
+        Обработчик выполняет выборку и исполнение инструкции целиком и даёт те же
+        регистры, память, флаг нуля и такты, что и сигнальный путь. Ячейки за
+        пределами образа декодируются при первой выборке.
+        """
+        memory = self._data_path.memory
+        self._handlers = [self._redecode] * len(memory)
+        for address in range(program_size):
+            self._handlers[address] = self._decode(address, memory[address])
+        return self._handlers
+
+    def invalidate(self, address: int):
+        """Ячейка изменена: обработчик будет декодирован заново при следующей выборке"""
+        self._handlers[address] = self._redecode
+
+    def _redecode(self):
+        address = int(self._data_path.registers[-1])
+        handler = self._decode(address, self._data_path.memory[address])
+        self._handlers[address] = handler
+        handler()
+
+    def _decode(self, address: int, word: int) -> Callable[[], None]:
+        data_path = self._data_path
+        registers = data_path.registers
+        memory = data_path.memory
+        memory_size = data_path._memory_size
+        handlers = self._handlers
+        next_pc = address + 1
+        control_unit = self
+
+        def bad_instruction():
+            registers[4] = next_pc
+            control_unit._tick += 1
+            assert False, "bad instruction"
+
+        instr = decode_instr(word)
+        if instr is None:
+            return bad_instruction
+        opcode = instr["opcode"]
+        args = instr.get("args", [])
+
+        if opcode is Opcode.HLT:
+            def hlt():
+                registers[4] = next_pc
+                control_unit._tick += 1
+                raise StopIteration()
+            return hlt
+
+        if opcode is Opcode.JMP and len(args) == 1:
+            target = args[0]
+            target_zero = target == 0
+
+            def jmp():
+                registers[4] = target
+                data_path._zero_flag = target_zero
+                control_unit._tick += 2
+            return jmp
+
+        if opcode is Opcode.BE and len(args) == 1:
+            target = args[0]
+            target_zero = target == 0
+
+            def be():
+                if data_path._zero_flag:
+                    registers[4] = target
+                    data_path._zero_flag = target_zero
+                    control_unit._tick += 3
+                else:
+                    registers[4] = next_pc
+                    control_unit._tick += 2
+            return be
+
+        if opcode is Opcode.BNE and len(args) == 1:
+            target = args[0]
+            target_zero = target == 0
+
+            def bne():
+                if not data_path._zero_flag:
+                    registers[4] = target
+                    data_path._zero_flag = target_zero
+                    control_unit._tick += 3
+                else:
+                    registers[4] = next_pc
+                    control_unit._tick += 2
+            return bne
+
+        if opcode in (Opcode.ADD, Opcode.SUB, Opcode.MOD) and len(args) == 3:
+            reg1, reg2, reg_res = args
+            if opcode is Opcode.ADD:
+                def alu():
+                    registers[4] = next_pc
+                    result = registers[reg1] + registers[reg2]
+                    if not -0x80000000 <= result <= 0x7FFFFFFF:
+                        result = wrap_word(result)
+                    registers[reg_res] = result
+                    data_path._zero_flag = result == 0
+                    control_unit._tick += 2
+            elif opcode is Opcode.SUB:
+                def alu():
+                    registers[4] = next_pc
+                    result = registers[reg1] - registers[reg2]
+                    if not -0x80000000 <= result <= 0x7FFFFFFF:
+                        result = wrap_word(result)
+                    registers[reg_res] = result
+                    data_path._zero_flag = result == 0
+                    control_unit._tick += 2
+            else:
+                def alu():
+                    registers[4] = next_pc
+                    divisor = registers[reg2]
+                    result = registers[reg1] % divisor if divisor else 0
+                    registers[reg_res] = result
+                    data_path._zero_flag = result == 0
+                    control_unit._tick += 2
+            return alu
+
+        if opcode in (Opcode.INC, Opcode.DEC, Opcode.MV) and len(args) == 2:
+            reg1, reg_res = args
+            if opcode is Opcode.INC:
+                def unary():
+                    registers[4] = next_pc
+                    result = registers[reg1] + 1
+                    if result > 0x7FFFFFFF:
+                        result = -0x80000000
+                    registers[reg_res] = result
+                    data_path._zero_flag = result == 0
+                    control_unit._tick += 2
+            elif opcode is Opcode.DEC:
+                def unary():
+                    registers[4] = next_pc
+                    result = registers[reg1] - 1
+                    if result < -0x80000000:
+                        result = 0x7FFFFFFF
+                    registers[reg_res] = result
+                    data_path._zero_flag = result == 0
+                    control_unit._tick += 2
+            else:
+                def unary():
+                    registers[4] = next_pc
+                    result = registers[reg1]
+                    registers[reg_res] = result
+                    data_path._zero_flag = result == 0
+                    control_unit._tick += 2
+            return unary
+
+        if opcode in (Opcode.ADDI, Opcode.SUBI, Opcode.MODI) and len(args) == 3:
+            reg1, imm, reg_res = args
+            if opcode is Opcode.ADDI:
+                def alu_imm():
+                    registers[4] = next_pc
+                    result = registers[reg1] + imm
+                    if not -0x80000000 <= result <= 0x7FFFFFFF:
+                        result = wrap_word(result)
+                    registers[reg_res] = result
+                    data_path._zero_flag = result == 0
+                    control_unit._tick += 2
+            elif opcode is Opcode.SUBI:
+                def alu_imm():
+                    registers[4] = next_pc
+                    result = registers[reg1] - imm
+                    if not -0x80000000 <= result <= 0x7FFFFFFF:
+                        result = wrap_word(result)
+                    registers[reg_res] = result
+                    data_path._zero_flag = result == 0
+                    control_unit._tick += 2
+            else:
+                def alu_imm():
+                    registers[4] = next_pc
+                    result = registers[reg1] % imm if imm else 0
+                    registers[reg_res] = result
+                    data_path._zero_flag = result == 0
+                    control_unit._tick += 2
+            return alu_imm
+
+        if opcode is Opcode.LDI and len(args) == 2:
+            imm, reg_res = args
+            imm_zero = imm == 0
+
+            def ldi():
+                registers[4] = next_pc
+                registers[reg_res] = imm
+                data_path._zero_flag = imm_zero
+                control_unit._tick += 2
+            return ldi
+
+        if opcode is Opcode.LD and len(args) == 2:
+            addr, reg_res = args
+            addr_zero = addr == 0
+
+            def ld():
+                registers[4] = next_pc
+                data_path._zero_flag = addr_zero
+                assert 0 <= addr < memory_size, "Invalid address"
+                registers[reg_res] = memory[addr]
+                control_unit._tick += 2
+            return ld
+
+        if opcode is Opcode.ST and len(args) == 2:
+            reg, addr = args
+            addr_zero = addr == 0
+
+            def st():
+                registers[4] = next_pc
+                data_path._zero_flag = addr_zero
+                assert 0 <= addr < memory_size, "Invalid address"
+                memory[addr] = registers[reg]
+                # самомодифицирующийся код: ячейка будет декодирована заново при выборке
+                handlers[addr] = control_unit._redecode
+                control_unit._tick += 2
+            return st
+
+        if opcode is Opcode.IN and len(args) == 2:
+            port, reg_res = args
+
+            def port_in():
+                registers[4] = next_pc
+                result = data_path.io.read(port)
+                registers[reg_res] = result
+                data_path._zero_flag = result == 0
+                control_unit._tick += 2
+            return port_in
+
+        if opcode is Opcode.OUT and len(args) == 2:
+            reg, port = args
+
+            def port_out():
+                registers[4] = next_pc
+                data_path.io.write(port, registers[reg])
+                control_unit._tick += 2
+            return port_out
+
+        return bad_instruction
+
     def __repr__(self):
         state = "{{TICK: {}, R4(PC): {}, R0: {}, R1: {}, R2: {}, R3: {}}}".format(
             self._tick,
@@ -306,42 +632,342 @@ class ControlUnit:
             self._data_path.registers[3]
         )
 
-        instr = self._data_path.memory[self._data_path.registers[-1]]
+        word = self._data_path.memory[self._data_path.registers[-1]]
+        instr = decode_instr(word)
 
-        return "{} {}".format(state, instr)
+        return "{} {}".format(state, word if instr is None else instr)
 
 
-def simulation(code, memory_size, limit) -> Tuple[int, int]:
-    data_path = DataPath(code, memory_size)
-    control_unit = ControlUnit(data_path)
+def load_memory(code, memory_size: int) -> array:
+    """Размещает образ программы (список ячеек или буфер слов) в начале памяти, остаток -- нули"""
+    if isinstance(code, list):
+        memory = pack_code(code)
+    else:
+        memory = array(WORD_TYPECODE)
+        memory.frombytes(memoryview(code).cast('B'))
+    assert len(memory) <= memory_size, "Not enough memory!"
+    memory.frombytes(bytes((memory_size - len(memory)) * memory.itemsize))
+    return memory
+
+
+def execute(control_unit: ControlUnit, data_path: DataPath, program_size: int, limit: int,
+            mode: ExecMode = ExecMode.MICRO, tracer: Tracer | None = None, handlers: list | None = None) -> int:
+    """Исполняет загруженную программу до HLT и возвращает число инструкций; без трассировщика
+    цикл не делает лишней работы на инструкцию. handlers -- уже декодированная таблица быстрого режима"""
     instr_counter = 0
+    registers = data_path.registers
 
-    logging.debug('%s', control_unit)
-    try:
-        while True:
-            assert limit > instr_counter, "too long execution, increase limit!"
+    if mode is ExecMode.FAST:
+        if handlers is None:
+            handlers = control_unit.decode_program(program_size)
+
+        def step():
+            handlers[registers[-1]]()
+    else:
+        def step():
             control_unit.decode_and_execute_instruction(control_unit.fetch_instruction())
-            instr_counter += 1
-            logging.debug('%s', control_unit)
+
+    try:
+        if mode is ExecMode.JIT:
+            assert tracer is None, "Tracing is not supported by compiled blocks"
+            instr_counter = jit.execute(control_unit, data_path, program_size, limit)
+        elif tracer is None and mode is ExecMode.FAST:
+            while True:
+                assert limit > instr_counter, "too long execution, increase limit!"
+                handlers[registers[-1]]()
+                instr_counter += 1
+        elif tracer is None:
+            while True:
+                assert limit > instr_counter, "too long execution, increase limit!"
+                step()
+                instr_counter += 1
+        else:
+            interval = tracer.interval
+            tracer.record(instr_counter, control_unit.current_tick(), registers, data_path.memory)
+            while True:
+                for _ in range(interval):
+                    assert limit > instr_counter, "too long execution, increase limit!"
+                    step()
+                    instr_counter += 1
+                tracer.record(instr_counter, control_unit.current_tick(), registers, data_path.memory)
     except StopIteration:
         pass
+    except BaseException as error:
+        if tracer is not None:
+            tracer.close(error)
+        raise
+    finally:
+        # приёмники портов копят токены: выведенное до HLT или ошибки не теряется
+        data_path.io.flush()
+    if tracer is not None:
+        tracer.close()
+    return instr_counter
+
+
+def simulation(code, memory_size, limit, mode: ExecMode = ExecMode.MICRO,
+               tracer: Tracer | None = None, io: PortIO | None = None) -> Tuple[int, int]:
+    """Исполняет программу до HLT, возвращает число инструкций и тактов"""
+    data_path = DataPath(load_memory(code, memory_size), memory_size, io)
+    control_unit = ControlUnit(data_path)
+    instr_counter = execute(control_unit, data_path, len(code), limit, mode, tracer)
     return instr_counter, control_unit.current_tick()
 
 
+class Result(NamedTuple):
+    """Итог исполнения: счётчики, выведенные токены, память после HLT и таблица символов образа"""
+    instr_counter: int
+    ticks: int
+    output: list[int]
+    memory: array
+    symbols: dict[str, int]
+
+    def variables(self) -> dict[str, int]:
+        return {name: self.memory[address] for name, address in self.symbols.items()}
+
+
+def run(image: CodeImage, memory_size: int = MEMORY_SIZE, limit: int = INSTR_LIMIT, io: PortIO | None = None,
+        mode: ExecMode = ExecMode.FAST) -> Result:
+    """Исполнение в процессе: без файлов и вывода в stdout; ввод и вывод -- токены io"""
+    io = io if io is not None else TokenIO()
+    data_path = DataPath(load_memory(image.words, memory_size), memory_size, io)
+    control_unit = ControlUnit(data_path)
+    instr_counter = execute(control_unit, data_path, len(image.words), limit, mode)
+    return Result(instr_counter, control_unit.current_tick(), io.output, data_path.memory, image.symbols)
+
+
+class LoadedProgram:
+    """Программа, декодированная один раз: каждый run восстанавливает начальные память и регистры
+    и исполняет её в быстром режиме с новым вводом без повторного декодирования"""
+
+    def __init__(self, image: CodeImage, memory_size: int = MEMORY_SIZE):
+        self.image = image
+        self.initial = load_memory(image.words, memory_size)
+        self.data_path = DataPath(array(WORD_TYPECODE, self.initial), memory_size)
+        self.control_unit = ControlUnit(self.data_path)
+        self.handlers = self.control_unit.decode_program(len(image.words))
+        # самомодифицирующийся код заменяет обработчики: исходная таблица восстанавливается перед запуском
+        self.decoded = list(self.handlers)
+
+    def run(self, limit: int = INSTR_LIMIT, io: PortIO | None = None) -> Result:
+        io = io if io is not None else TokenIO()
+        self.data_path.reset(self.initial, io)
+        self.control_unit.reset()
+        self.handlers[:] = self.decoded
+        instr_counter = execute(self.control_unit, self.data_path, len(self.image.words), limit, ExecMode.FAST,
+                                handlers=self.handlers)
+        return Result(instr_counter, self.control_unit.current_tick(), io.output,
+                      array(WORD_TYPECODE, self.data_path.memory), self.image.symbols)
+
+
+class MachineStatus(str, Enum):
+    READY = 'ready'
+    HALTED = 'halted'
+    FAILED = 'failed'
+
+
+class Machine:
+    """Машина, исполняемая квантами: run(max_instructions) исполняет не больше max_instructions инструкций
+    быстрого режима и возвращает управление, сохраняя память, регистры, такты и ввод-вывод до следующего вызова"""
+
+    def __init__(self, image: CodeImage, io: PortIO | None = None, memory_size: int = MEMORY_SIZE,
+                 limit: int = INSTR_LIMIT):
+        self.image = image
+        self.limit = limit
+        self.io = io if io is not None else TokenIO()
+        self.data_path = DataPath(load_memory(image.words, memory_size), memory_size, self.io)
+        self.control_unit = ControlUnit(self.data_path)
+        self.handlers = self.control_unit.decode_program(len(image.words))
+        self.instr_counter = 0
+        self.status = MachineStatus.READY
+        self.error: str | None = None
+        self.priority = 0
+
+    def run(self, max_instructions: int) -> MachineStatus:
+        if self.status is not MachineStatus.READY:
+            return self.status
+        handlers, registers = self.handlers, self.data_path.registers
+        budget = min(max_instructions, self.limit - self.instr_counter)
+        done = 0
+        try:
+            while done < budget:
+                handlers[registers[-1]]()
+                done += 1
+        except StopIteration:
+            self.status = MachineStatus.HALTED
+        except Exception as exception:
+            self.fail(exception)
+        self.instr_counter += done
+        if self.status is MachineStatus.READY and self.instr_counter >= self.limit:
+            # как в execute: следующая инструкция, даже HLT, превысила бы предел
+            self.fail(AssertionError("too long execution, increase limit!"))
+        if self.status is not MachineStatus.READY:
+            self.io.flush()
+        return self.status
+
+    def fail(self, exception: Exception):
+        self.status = MachineStatus.FAILED
+        self.error = "{}: {}".format(type(exception).__name__, exception)
+
+    def result(self) -> Result:
+        return Result(self.instr_counter, self.control_unit.current_tick(), self.io.output, self.data_path.memory,
+                      self.image.symbols)
+
+
+class SchedulePolicy(str, Enum):
+    """Очерёдность квантов: по кругу или сначала машины с большим приоритетом (среди равных -- по кругу)"""
+    ROUND_ROBIN = 'rr'
+    PRIORITY = 'priority'
+
+
+class Scheduler:
+    """Кооперативное исполнение многих машин в одном процессе квантами по quantum инструкций"""
+
+    def __init__(self, quantum: int = 1000, policy: SchedulePolicy = SchedulePolicy.ROUND_ROBIN):
+        assert quantum > 0, "Quantum should be non-zero"
+        self.quantum = quantum
+        self.policy = policy
+        self.slices = 0
+        # (-приоритет, порядковый номер постановки, машина): номер даёт круговой порядок среди равных
+        self._ready: list[tuple[int, int, Machine]] = []
+        self._sequence = 0
+
+    def add(self, machine: Machine, priority: int = 0) -> Machine:
+        machine.priority = priority
+        self._push(machine)
+        return machine
+
+    def _push(self, machine: Machine):
+        key = -machine.priority if self.policy is SchedulePolicy.PRIORITY else 0
+        heapq.heappush(self._ready, (key, self._sequence, machine))
+        self._sequence += 1
+
+    def __len__(self):
+        return len(self._ready)
+
+    def run(self):
+        """Исполняет машины, пока есть готовые; отдаёт каждую машину сразу после её HLT или ошибки.
+        Машины можно добавлять и во время обхода"""
+        while self._ready:
+            _, _, machine = heapq.heappop(self._ready)
+            self.slices += 1
+            if machine.run(self.quantum) is MachineStatus.READY:
+                self._push(machine)
+            else:
+                yield machine
+
+
+class Job(NamedTuple):
+    """Задание пакета: файл кода, входные токены и предел числа инструкций"""
+    program: str
+    tokens: list[int]
+    limit: int = INSTR_LIMIT
+
+
+class JobResult(NamedTuple):
+    """Итог задания: счётчики, выведенные токены и sha256 памяти после HLT; error -- None или текст исключения"""
+    program: str
+    instr_counter: int
+    ticks: int
+    output: list[int]
+    memory_digest: str
+    error: str | None
+
+
+def memory_digest(memory: array) -> str:
+    words = array(WORD_TYPECODE, memory)
+    if sys.byteorder != 'little':
+        words.byteswap()
+    return hashlib.sha256(words.tobytes()).hexdigest()
+
+
+_worker_programs: dict[str, LoadedProgram] = {}
+_worker_memory_size = MEMORY_SIZE
+
+
+def _init_batch_worker(memory_size: int):
+    global _worker_memory_size
+    _worker_programs.clear()
+    _worker_memory_size = memory_size
+
+
+def run_job(job: Job, programs: dict[str, LoadedProgram], memory_size: int = MEMORY_SIZE) -> JobResult:
+    """Исполняет задание; программа декодируется при первом задании с ней и хранится в programs"""
+    try:
+        program = programs.get(job.program)
+        if program is None:
+            program = programs[job.program] = LoadedProgram(load_code(job.program), memory_size)
+        result = program.run(job.limit, TokenIO(job.tokens))
+    except Exception as exception:
+        return JobResult(job.program, 0, 0, [], "", "{}: {}".format(type(exception).__name__, exception))
+    return JobResult(job.program, result.instr_counter, result.ticks, result.output, memory_digest(result.memory),
+                     None)
+
+
+def _run_worker_job(job: Job) -> JobResult:
+    return run_job(job, _worker_programs, _worker_memory_size)
+
+
+def run_batch(jobs: list[Job], workers: int | None = None, memory_size: int = MEMORY_SIZE) -> list[JobResult]:
+    """Исполняет задания в пуле процессов; результаты -- в порядке заданий.
+
+    Задания с одной программой идут подряд одними порциями, поэтому процесс
+    декодирует программу один раз и исполняет её для всех своих входов.
+    """
+    if not jobs:
+        return []
+    workers = workers or os.cpu_count() or 1
+    order = sorted(range(len(jobs)), key=lambda i: jobs[i].program)
+    chunksize = max(1, len(jobs) // (workers * 4))
+    results: list[JobResult | None] = [None] * len(jobs)
+    with ProcessPoolExecutor(min(workers, len(jobs)), initializer=_init_batch_worker, initargs=(memory_size,)) as pool:
+        for i, result in zip(order, pool.map(_run_worker_job, [jobs[i] for i in order], chunksize=chunksize)):
+            results[i] = result
+    return results
+
+
+def read_manifest(filename: str) -> list[Job]:
+    """Задания из JSON Lines: {"program": путь, "input": [токены], "limit": n}; путь -- относительно манифеста"""
+    directory = os.path.dirname(filename)
+    jobs = []
+    with open(filename, encoding="utf-8") as file:
+        for line in file:
+            if line.strip():
+                entry = json.loads(line)
+                jobs.append(Job(os.path.join(directory, entry["program"]), list(entry.get("input", [])),
+                                entry.get("limit", INSTR_LIMIT)))
+    return jobs
+
+
+def main_batch(args):
+    assert 1 <= len(args) <= 2, "Wrong arguments: machine.py <manifest.jsonl> [workers]"
+    workers = int(args[1]) if len(args) == 2 else None
+    results = run_batch(read_manifest(args[0]), workers)
+    for result in results:
+        print(json.dumps(result._asdict()))
+    failed = sum(result.error is not None for result in results)
+    assert not failed, "{} of {} jobs failed".format(failed, len(results))
+
+
 def main(args):
-    assert len(args) == 1, "Wrong arguments: machine.py <code_file>"
+    if args and args[0].endswith(".jsonl"):
+        main_batch(args)
+        return
+    assert 1 <= len(args) <= 4, "Wrong arguments: machine.py <code_file> [micro|fast|jit] [off|full|sample:N|ring:K] [input_file] or machine.py <manifest.jsonl> [workers]"
     code_file = args[0]
-    code = read_code(code_file)
+    mode = ExecMode(args[1]) if len(args) >= 2 else ExecMode.MICRO
+    tracer = make_tracer(args[2], CsvTraceSink(sys.stderr)) if len(args) >= 3 else None
+    code = load_code(code_file).words
 
-    mem_size = 512
-    assert len(code) < mem_size, "Not enough memory!"
-    code = code + [ZERO] * (mem_size - len(code))
+    assert len(code) < MEMORY_SIZE, "Not enough memory!"
 
-    instr_counter, ticks = simulation(code, mem_size, 30000)
+    # вывод -- токены по одному на строку, входной файл -- целые через пробельные символы
+    io = stdio_ports(args[3] if len(args) == 4 else None)
+    instr_counter, ticks = simulation(code, MEMORY_SIZE, INSTR_LIMIT, mode, tracer, io)
 
+    for port, (tokens, port_ticks) in io.counters().items():
+        print("port {}: tokens: {}, ticks: {}".format(port, tokens, port_ticks))
     print("instr_counter: {}, ticks: {}".format(instr_counter, ticks))
 
 
 if __name__ == '__main__':
-    logging.getLogger().setLevel(logging.DEBUG)
     main(sys.argv[1:])
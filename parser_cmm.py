@@ -1,15 +1,22 @@
-from functools import reduce
-from ast_cmm import AssignStatement, BinopAexp, CompoundStatement, IfStatement, IntAexp, RelopBexp, VarAexp, WhileStatement
-from combinators import Exp, Lazy, Opt, Phrase, Reserved, Tag
+from functools import cache, reduce
+from ast_cmm import AssignStatement, BinopAexp, IfStatement, IntAexp, PrintStatement, RelopBexp, ScanStatement, VarAexp, \
+    WhileStatement, append_statement
+from combinators import Exp, Lazy, Opt, Packrat, Phrase, Reserved, Tag
 from lexer import ID, INT, RESERVED
+from parser_rd import RecursiveDescentParser, binding_powers
 
+# Каждая функция грамматики строит свой парсер один раз и дальше возвращает тот же объект,
+# поэтому грамматика собирается при первом разборе и переиспользуется для всех файлов
 
+
+@cache
 def keyword(kw):
     return Reserved(kw, RESERVED)
 
 id = Tag(ID)
 num = Tag(INT) ^ (lambda i: int(i))
 
+@cache
 def aexp_value():
     return (num ^ (lambda i: IntAexp(i))) | (id ^ (lambda v: VarAexp(v)))
 
@@ -17,9 +24,11 @@ def process_group(parsed):
     ((_, p), _) = parsed
     return p
 
+@cache
 def aexp_group():
     return keyword('(') + Lazy(aexp) + keyword(')') ^ process_group
 
+@cache
 def aexp_term():
     return aexp_value() | aexp_group()
 
@@ -44,6 +53,7 @@ def precedence(value_parser, precedence_levels, combine):
         parser = parser * op_parser(precedence_level)
     return parser
 
+@cache
 def aexp():
     return precedence(aexp_term(), aexp_precedence_levels, process_binop)
 
@@ -52,39 +62,69 @@ def process_relop(parsed):
     ((left, op), right) = parsed
     return RelopBexp(op, left, right)
 
+@cache
 def bexp():
     relops = ['==', '!=']
     return aexp() + any_operator_in_list(relops) + aexp() ^ process_relop
 
+@cache
 def assign_stmt():
     def process(parsed):
         ((name, _), exp) = parsed
         return AssignStatement(name, exp)
     return id + keyword('=') + aexp() ^ process
 
+@cache
+def scan_stmt():
+    return keyword('scan') + id ^ (lambda parsed: ScanStatement(parsed[1]))
+
+@cache
+def print_stmt():
+    return keyword('print') + aexp() ^ (lambda parsed: PrintStatement(parsed[1]))
+
+@cache
 def stmt_list():
-    separator = keyword(';') ^ (lambda x: lambda l, r: CompoundStatement(l, r))
+    separator = keyword(';') ^ (lambda x: append_statement)
     return Exp(stmt(), separator)
 
+@cache
 def if_stmt():
     def process(parsed):
-        print(parsed)
         ((((_, condition), _), body), _) = parsed
         return IfStatement(condition, body)
     return keyword('if') + bexp() + keyword('{') + Lazy(stmt_list) + keyword('}') ^ process
 
+@cache
 def while_stmt():
     def process(parsed):
         ((((_, condition), _), body), _) = parsed
         return WhileStatement(condition, body)
     return keyword('while') + bexp() + keyword('{') + Lazy(stmt_list) + keyword('}') ^ process
 
+@cache
 def stmt():
-    return assign_stmt() | if_stmt() | while_stmt()
+    return assign_stmt() | if_stmt() | while_stmt() | scan_stmt() | print_stmt()
 
+@cache
 def parser():
     return Phrase(stmt_list())
 
-def parse_cmm(tokens):
-    ast = parser()(tokens, 0)
+@cache
+def packrat_parser():
+    return Packrat(parser())
+
+@cache
+def rd_binding_power():
+    return binding_powers(aexp_precedence_levels)
+
+ENGINES = ('combinators', 'rd')
+
+def parse_cmm(tokens, packrat=False, engine='combinators'):
+    """Разбор программы. Комбинаторы возвращают None при ошибке, рекурсивный спуск ('rd')
+    бросает ParseError с позицией лексемы"""
+    assert engine in ENGINES, "Unknown parser engine {}".format(engine)
+    if engine == 'rd':
+        return RecursiveDescentParser(tokens, rd_binding_power()).parse()
+    top = packrat_parser() if packrat else parser()
+    ast = top(tokens, 0)
     return ast
\ No newline at end of file
@@ -0,0 +1,130 @@
+"""Рекурсивный спуск с разбором выражений по приоритетам (precedence climbing).
+
+Строит те же узлы ast_cmm, что и комбинаторный парсер parser_cmm, но без
+промежуточных кортежей и Result на каждом шаге; при ошибке сообщает позицию.
+"""
+from ast_cmm import AssignStatement, BinopAexp, IfStatement, IntAexp, PrintStatement, RelopBexp, ScanStatement, VarAexp, \
+    WhileStatement, block
+from combinators import Result
+from lexer import ID, INT, RESERVED
+
+RELOPS = ('==', '!=')
+
+
+class ParseError(Exception):
+    def __init__(self, pos, message):
+        super().__init__("{} at token {}".format(message, pos))
+        self.pos = pos
+
+
+def binding_powers(precedence_levels) -> dict[str, int]:
+    """Операция -> сила связывания; уровни перечислены от самого сильного, сила -- обратный номер уровня"""
+    return {
+        op: len(precedence_levels) - level
+        for level, ops in enumerate(precedence_levels)
+        for op in ops
+    }
+
+
+class RecursiveDescentParser:
+    """Состояние одного разбора: позиция в tokens. Таблица binding_power общая и не изменяется"""
+
+    def __init__(self, tokens, binding_power: dict[str, int]):
+        self.tokens = tokens
+        self.pos = 0
+        self.binding_power = binding_power
+
+    def parse(self):
+        ast = self.stmt_list()
+        if self.pos != len(self.tokens):
+            self.fail("unexpected token {!r}".format(self.tokens[self.pos][0]))
+        return Result(ast, self.pos)
+
+    def fail(self, message):
+        raise ParseError(self.pos, message)
+
+    def peek_keyword(self, value):
+        pos = self.pos
+        return pos < len(self.tokens) and self.tokens[pos][1] == RESERVED and self.tokens[pos][0] == value
+
+    def expect_keyword(self, value):
+        if not self.peek_keyword(value):
+            self.fail("expected {!r}".format(value))
+        self.pos += 1
+
+    def expect_tag(self, tag):
+        pos = self.pos
+        if pos >= len(self.tokens) or self.tokens[pos][1] != tag:
+            self.fail("expected {}".format(tag))
+        self.pos += 1
+        return self.tokens[pos][0]
+
+    def stmt_list(self):
+        statements = [self.stmt()]
+        while self.peek_keyword(';'):
+            self.pos += 1
+            statements.append(self.stmt())
+        return block(statements)
+
+    def stmt(self):
+        if self.peek_keyword('if'):
+            self.pos += 1
+            condition, body = self.block()
+            return IfStatement(condition, body)
+        if self.peek_keyword('while'):
+            self.pos += 1
+            condition, body = self.block()
+            return WhileStatement(condition, body)
+        if self.peek_keyword('scan'):
+            self.pos += 1
+            return ScanStatement(self.expect_tag(ID))
+        if self.peek_keyword('print'):
+            self.pos += 1
+            return PrintStatement(self.aexp())
+        name = self.expect_tag(ID)
+        self.expect_keyword('=')
+        return AssignStatement(name, self.aexp())
+
+    def block(self):
+        condition = self.bexp()
+        self.expect_keyword('{')
+        body = self.stmt_list()
+        self.expect_keyword('}')
+        return condition, body
+
+    def bexp(self):
+        left = self.aexp()
+        pos = self.pos
+        if pos < len(self.tokens) and self.tokens[pos][1] == RESERVED and self.tokens[pos][0] in RELOPS:
+            self.pos += 1
+            return RelopBexp(self.tokens[pos][0], left, self.aexp())
+        self.fail("expected one of {}".format(", ".join(RELOPS)))
+
+    def aexp(self, min_power=1):
+        left = self.aexp_term()
+        tokens = self.tokens
+        while self.pos < len(tokens):
+            op, tag = tokens[self.pos]
+            power = self.binding_power.get(op) if tag == RESERVED else None
+            if power is None or power < min_power:
+                break
+            self.pos += 1
+            left = BinopAexp(op, left, self.aexp(power + 1))
+        return left
+
+    def aexp_term(self):
+        pos = self.pos
+        if pos < len(self.tokens):
+            value, tag = self.tokens[pos]
+            if tag == INT:
+                self.pos += 1
+                return IntAexp(int(value))
+            if tag == ID:
+                self.pos += 1
+                return VarAexp(value)
+            if tag == RESERVED and value == '(':
+                self.pos += 1
+                result = self.aexp()
+                self.expect_keyword(')')
+                return result
+        self.fail("expected number, variable or '('")
@@ -0,0 +1,140 @@
+"""Локальные оптимизации кода до компоновки.
+
+Внутри базового блока отслеживается, какой регистр совпадает с ячейкой памяти и
+какой является копией другого регистра. По этим сведениям:
+- повторная загрузка уже загруженной ячейки (в том числе сразу после ST) удаляется
+  или заменяется копией регистра, использования копии -- исходным регистром;
+- ALU-операции с известным вторым операндом получают непосредственный операнд,
+  сложение и вычитание единицы становятся INC/DEC, нуля -- MV;
+- инструкции без побочных эффектов, результат которых не используется, удаляются.
+Инструкция перед BE/BNE выставляет проверяемый флаг, поэтому она удаляется или
+заменяется только на инструкцию с тем же результатом.
+"""
+from cfg import REG_USES, build_cfg, flag_checked, liveness, reg_defs, reg_uses
+from isa import Cell, Opcode, fits_immediate
+from regalloc import is_general
+
+# инструкции, единственный эффект которых -- регистр результата и флаг
+PURE = (Opcode.ADD, Opcode.SUB, Opcode.MOD, Opcode.INC, Opcode.DEC, Opcode.MV, Opcode.LD,
+        Opcode.LDI, Opcode.ADDI, Opcode.SUBI, Opcode.MODI)
+IMMEDIATE_FORMS = {Opcode.ADD: Opcode.ADDI, Opcode.SUB: Opcode.SUBI, Opcode.MOD: Opcode.MODI}
+
+
+def constant_cells(state) -> dict[str, int]:
+    """Ячейки, в которые программа не пишет: их значение известно при трансляции"""
+    stored = {instr["args"][1] for instr in state.text if instr["opcode"] is Opcode.ST}
+    return {name: state.vars.cells[slot] for name, slot in state.vars.index.items() if name not in stored}
+
+
+def simplify_alu(instr, value) -> Cell:
+    """ALU-операция с известным вторым операндом -> форма с непосредственным операндом, +-1 -> INC/DEC, +-0 -> MV;
+    результат и флаг те же"""
+    opcode = instr["opcode"]
+    if opcode in IMMEDIATE_FORMS:
+        a, b, dest = instr["args"]
+        left, right = value(a), value(b)
+        if opcode is Opcode.ADD and left is not None and right is None:
+            a, right = b, left
+        if right is None or not fits_immediate(right):
+            return instr
+        instr = {"opcode": IMMEDIATE_FORMS[opcode], "args": [a, right, dest]}
+        opcode = instr["opcode"]
+    if opcode not in (Opcode.ADDI, Opcode.SUBI):
+        return instr
+    a, imm, dest = instr["args"]
+    delta = imm if opcode is Opcode.ADDI else -imm
+    if delta == 0:
+        return {"opcode": Opcode.MV, "args": [a, dest]}
+    if delta == 1:
+        return {"opcode": Opcode.INC, "args": [a, dest]}
+    if delta == -1:
+        return {"opcode": Opcode.DEC, "args": [a, dest]}
+    return instr
+
+
+def forward(text: list[Cell], labels: list[int], constants: dict[str, int]) -> list[list[Cell]]:
+    """Удаление повторных загрузок, распространение копий и упрощение ALU внутри блоков"""
+    chunks = [[instr] for instr in text]
+    for block in build_cfg(text, labels):
+        # регистр -> ячейка памяти или непосредственное значение, которое он содержит
+        holds: dict[int, str | int] = {}
+        copy_of: dict[int, int] = {}
+
+        def value(reg):
+            held = holds.get(reg)
+            return held if isinstance(held, int) else constants.get(held)
+
+        for i in range(block.start, block.end):
+            instr = text[i]
+            opcode = instr["opcode"]
+            args = list(instr.get("args", []))
+            for pos in REG_USES[opcode]:
+                args[pos] = copy_of.get(args[pos], args[pos])
+            instr = {"opcode": opcode, "args": args} if "args" in instr else instr
+
+            if opcode is Opcode.LDI and is_general(args[1]) and not flag_checked(text, i) \
+                    and value(args[1]) == args[0]:
+                chunks[i] = []
+                continue
+            if opcode is Opcode.LD and is_general(args[1]) and not flag_checked(text, i):
+                name, reg = args
+                if holds.get(reg) == name:
+                    chunks[i] = []
+                    continue
+                source = next((other for other, held in holds.items() if held == name), None)
+                if source is not None:
+                    instr = {"opcode": Opcode.MV, "args": [source, reg]}
+            instr = simplify_alu(instr, value)
+            chunks[i] = [instr]
+
+            opcode = instr["opcode"]
+            defs = reg_defs(instr)
+            for reg in defs:
+                holds.pop(reg, None)
+                copy_of.pop(reg, None)
+                for copy in [copy for copy, source in copy_of.items() if source == reg]:
+                    del copy_of[copy]
+            if opcode is Opcode.ST:
+                for reg in [reg for reg, held in holds.items() if held == instr["args"][1]]:
+                    del holds[reg]
+                if is_general(instr["args"][0]):
+                    holds[instr["args"][0]] = instr["args"][1]
+            elif opcode in (Opcode.LD, Opcode.LDI) and is_general(instr["args"][1]):
+                holds[instr["args"][1]] = instr["args"][0]
+            elif opcode is Opcode.MV and is_general(instr["args"][1]) and is_general(instr["args"][0]):
+                source, reg = instr["args"]
+                if source != reg:
+                    copy_of[reg] = copy_of.get(source, source)
+                    if source in holds:
+                        holds[reg] = holds[source]
+    return chunks
+
+
+def remove_dead(text: list[Cell], labels: list[int]) -> list[list[Cell]]:
+    """Удаление инструкций без побочных эффектов, результат которых не читается"""
+    chunks = [[instr] for instr in text]
+    blocks = build_cfg(text, labels)
+    liveness(blocks, text, is_general)
+    for block in blocks:
+        live = set(block.live_out)
+        for i in reversed(range(block.start, block.end)):
+            instr = text[i]
+            defs = reg_defs(instr)
+            if instr["opcode"] in PURE and all(is_general(reg) and reg not in live for reg in defs) \
+                    and not flag_checked(text, i):
+                chunks[i] = []
+                continue
+            live.difference_update(defs)
+            live.update(reg for reg in reg_uses(instr) if is_general(reg))
+    return chunks
+
+
+def optimize(state):
+    """Применяет правила, пока код сокращается"""
+    constants = constant_cells(state)
+    while True:
+        before = list(state.text)
+        state.rewrite(forward(state.text, state.labels, constants))
+        state.rewrite(remove_dead(state.text, state.labels))
+        if state.text == before:
+            return
@@ -0,0 +1,160 @@
+"""Port-mapped ввод-вывод: шина номеров портов, источники токенов и буферизованные приёмники.
+
+Источник входного порта -- любой итерируемый объект целых (список, генератор,
+TokenFileSource); приёмник выходного -- объект с write(token) и flush(). Шина
+PortIO считает токены каждого порта; такты -- по стоимости IN/OUT.
+"""
+import mmap
+import re
+import struct
+import sys
+from typing import BinaryIO, Iterable, TextIO
+
+from isa import INPUT_PORT, OUTPUT_PORT, PORT_WIDTH, WORD_MAX, WORD_MIN
+
+PORT_COUNT = 1 << PORT_WIDTH
+# выборка и исполнение IN/OUT
+IO_TICKS = 2
+
+_TOKEN = re.compile(rb'-?\d+')
+_WORD = struct.Struct('<i')
+
+
+class TokenFileSource:
+    """Токены файла, отображённого в память: текст -- целые через пробельные символы,
+    binary -- слова little-endian int32. Файл разбирается по мере чтения"""
+
+    def __init__(self, filename: str, binary: bool = False):
+        self._filename = filename
+        self._binary = binary
+
+    def __iter__(self):
+        with open(self._filename, "rb") as file:
+            if not file.seek(0, 2):
+                return
+            buffer = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        if self._binary:
+            assert len(buffer) % _WORD.size == 0, "Truncated token file"
+            for (token,) in _WORD.iter_unpack(buffer):
+                yield token
+        else:
+            for match in _TOKEN.finditer(buffer):
+                yield int(match.group())
+
+
+class ListSink:
+    """Выведенные токены в списке tokens"""
+
+    def __init__(self):
+        self.tokens: list[int] = []
+
+    def write(self, token: int):
+        self.tokens.append(token)
+
+    def flush(self):
+        pass
+
+
+class TextTokenSink:
+    """Пишет токены в текстовый поток по одному на строку порциями по buffer_size"""
+
+    def __init__(self, file: TextIO, buffer_size: int = 4096):
+        self._file = file
+        self._buffer: list[str] = []
+        self._buffer_size = buffer_size
+
+    def write(self, token: int):
+        self._buffer.append(str(token))
+        if len(self._buffer) >= self._buffer_size:
+            self.flush()
+
+    def flush(self):
+        if self._buffer:
+            self._file.write("\n".join(self._buffer) + "\n")
+            self._buffer.clear()
+        self._file.flush()
+
+
+class BinaryTokenSink:
+    """Пишет токены словами little-endian int32 порциями по buffer_size"""
+
+    def __init__(self, file: BinaryIO, buffer_size: int = 4096):
+        self._file = file
+        self._buffer = bytearray(_WORD.size * buffer_size)
+        self._offset = 0
+
+    def write(self, token: int):
+        _WORD.pack_into(self._buffer, self._offset, token)
+        self._offset += _WORD.size
+        if self._offset == len(self._buffer):
+            self.flush()
+
+    def flush(self):
+        self._file.write(memoryview(self._buffer)[:self._offset])
+        self._offset = 0
+        self._file.flush()
+
+
+class PortIO:
+    """Шина портов: номер порта -> источник или приёмник; tokens -- число токенов каждого порта"""
+
+    def __init__(self, sources: dict[int, Iterable[int]] | None = None, sinks: dict | None = None):
+        self._readers = {}
+        self.sinks = {}
+        self.tokens = [0] * PORT_COUNT
+        for port, source in (sources or {}).items():
+            self.attach_source(port, source)
+        for port, sink in (sinks or {}).items():
+            self.attach_sink(port, sink)
+
+    def attach_source(self, port: int, source: Iterable[int]):
+        assert 0 <= port < PORT_COUNT, "Port {} does not exist".format(port)
+        self._readers[port] = iter(source).__next__
+
+    def attach_sink(self, port: int, sink):
+        assert 0 <= port < PORT_COUNT, "Port {} does not exist".format(port)
+        self.sinks[port] = sink
+
+    def read(self, port: int) -> int:
+        reader = self._readers.get(port)
+        assert reader is not None, "Port {} is not readable".format(port)
+        try:
+            token = reader()
+        except StopIteration:
+            raise AssertionError("Input stream is exhausted") from None
+        assert WORD_MIN <= token <= WORD_MAX, "Token {} does not fit in machine word".format(token)
+        self.tokens[port] += 1
+        return token
+
+    def write(self, port: int, value: int):
+        sink = self.sinks.get(port)
+        assert sink is not None, "Port {} is not writable".format(port)
+        sink.write(value)
+        self.tokens[port] += 1
+
+    def flush(self):
+        for sink in self.sinks.values():
+            sink.flush()
+
+    @property
+    def output(self) -> list[int]:
+        """Токены выходного порта, если его приёмник -- список"""
+        sink = self.sinks.get(OUTPUT_PORT)
+        return sink.tokens if isinstance(sink, ListSink) else []
+
+    def counters(self) -> dict[int, tuple[int, int]]:
+        """Порт -> (токенов, тактов на IN/OUT) для портов, через которые шёл обмен"""
+        return {port: (count, count * IO_TICKS) for port, count in enumerate(self.tokens) if count}
+
+
+class TokenIO(PortIO):
+    """Потоковый ввод-вывод варианта stream: порт 0 читает tokens, порт 1 пишет в список output"""
+
+    def __init__(self, tokens: Iterable[int] = ()):
+        super().__init__({INPUT_PORT: tokens}, {OUTPUT_PORT: ListSink()})
+
+
+def stdio_ports(input_file: str | None = None) -> PortIO:
+    """Порт 0 -- токены файла (без файла -- пустой поток), порт 1 -- stdout построчно с буферизацией"""
+    source = TokenFileSource(input_file) if input_file is not None else ()
+    return PortIO({INPUT_PORT: source}, {OUTPUT_PORT: TextTokenSink(sys.stdout)})
@@ -0,0 +1,470 @@
+"""Распределение регистров R0-R3 раскраской графа конфликтов.
+
+Кодогенератор держит переменные в памяти и перечитывает их при каждом
+использовании. Проход переименовывает регистры в виртуальные (у каждого значения
+внутри блока своё имя), переносит самые нагруженные переменные в регистры
+(LD в начале программы, ST перед HLT для изменяемых) и раскрашивает граф
+конфликтов, сливая регистры, связанные MV. Если граф не раскрашивается,
+переменная остаётся в памяти. Код с виртуальными регистрами (например, из ir)
+раскрашивается тем же способом; значения, которым не хватило регистра,
+выгружаются в память или заново вычисляются перед каждым использованием.
+"""
+from cfg import (BRANCHES, CONDITIONAL_BRANCHES, REG_DEFS, REG_USES, BasicBlock, branch_target, build_cfg,
+                 flag_checked, liveness, loop_depths, reg_defs, reg_uses)
+from isa import Cell, Opcode
+
+REG_COUNT = 4
+VIRTUAL_BASE = 8
+MAX_CANDIDATES = 8
+LOOP_WEIGHT = 10
+
+
+def is_virtual(reg) -> bool:
+    return isinstance(reg, int) and reg >= VIRTUAL_BASE
+
+
+def is_general(reg) -> bool:
+    return isinstance(reg, int) and 0 <= reg < REG_COUNT
+
+
+def with_regs(instr, mapping) -> Cell:
+    """Копия инструкции с регистрами, заменёнными по mapping"""
+    args = list(instr.get("args", []))
+    for i in REG_USES[instr["opcode"]] + REG_DEFS[instr["opcode"]]:
+        args[i] = mapping(args[i])
+    return {"opcode": instr["opcode"], "args": args} if "args" in instr else {"opcode": instr["opcode"]}
+
+
+def rename_virtual(text: list[Cell], labels: list[int]) -> tuple[list[Cell], int]:
+    """R0-R3 -> виртуальные регистры; значения, живые на границе блоков, остаются в VIRTUAL_BASE + r"""
+    blocks = build_cfg(text, labels)
+    liveness(blocks, text, is_general)
+    next_reg = VIRTUAL_BASE + REG_COUNT
+    result: list[Cell] = []
+    for block in blocks:
+        current = {reg: VIRTUAL_BASE + reg for reg in block.live_in}
+        last_def = {}
+        for i in range(block.start, block.end):
+            for reg in reg_defs(text[i]):
+                last_def[reg] = i
+        for i in range(block.start, block.end):
+            instr = text[i]
+            args = list(instr.get("args", []))
+            for pos in REG_USES[instr["opcode"]]:
+                if is_general(args[pos]):
+                    args[pos] = current[args[pos]]
+            for pos in REG_DEFS[instr["opcode"]]:
+                reg = args[pos]
+                if not is_general(reg):
+                    continue
+                if reg in block.live_out and last_def[reg] == i:
+                    current[reg] = VIRTUAL_BASE + reg
+                else:
+                    current[reg] = next_reg
+                    next_reg += 1
+                args[pos] = current[reg]
+            result.append(dict(instr, args=args) if "args" in instr else dict(instr))
+    return result, next_reg
+
+
+def variable_weights(text: list[Cell], labels: list[int]) -> dict[str, int]:
+    """Число обращений к ячейке памяти с весом LOOP_WEIGHT ** глубина цикла"""
+    weights: dict[str, int] = {}
+    for instr, depth in zip(text, loop_depths(text, labels)):
+        if instr["opcode"] in (Opcode.LD, Opcode.ST):
+            name = instr["args"][0] if instr["opcode"] is Opcode.LD else instr["args"][1]
+            if isinstance(name, str):
+                weights[name] = weights.get(name, 0) + LOOP_WEIGHT ** min(depth, 6)
+    return weights
+
+
+def promote(text: list[Cell], registers: dict[str, int], modified: set[str]):
+    """LD/ST переменных из registers превращаются в MV; возвращает замены, пролог и эпилог"""
+    chunks = []
+    for instr in text:
+        opcode = instr["opcode"]
+        if opcode is Opcode.LD and instr["args"][0] in registers:
+            instr = {"opcode": Opcode.MV, "args": [registers[instr["args"][0]], instr["args"][1]]}
+        elif opcode is Opcode.ST and instr["args"][1] in registers:
+            instr = {"opcode": Opcode.MV, "args": [instr["args"][0], registers[instr["args"][1]]]}
+        chunks.append([instr])
+    head = [{"opcode": Opcode.LD, "args": [name, reg]} for name, reg in registers.items()]
+    tail = [{"opcode": Opcode.ST, "args": [reg, name]} for name, reg in registers.items() if name in modified]
+    return chunks, head, tail
+
+
+def interference(text: list[Cell], labels: list[int]):
+    """Граф конфликтов виртуальных регистров и список пар, связанных MV"""
+    blocks = build_cfg(text, labels)
+    liveness(blocks, text, is_virtual)
+    graph: dict[int, set[int]] = {}
+    moves: list[tuple[int, int]] = []
+    for block in blocks:
+        live = set(block.live_out)
+        for instr in reversed(text[block.start:block.end]):
+            uses = [reg for reg in reg_uses(instr) if is_virtual(reg)]
+            defs = [reg for reg in reg_defs(instr) if is_virtual(reg)]
+            for reg in uses + defs:
+                graph.setdefault(reg, set())
+            if instr["opcode"] is Opcode.MV and uses and defs:
+                moves.append((uses[0], defs[0]))
+                live.discard(uses[0])
+            for reg in defs:
+                for other in live:
+                    if other != reg:
+                        graph[reg].add(other)
+                        graph.setdefault(other, set()).add(reg)
+            live.difference_update(defs)
+            live.update(uses)
+    return graph, moves
+
+
+def briggs(graph: dict[int, set[int]], a: int, b: int) -> bool:
+    """У слитого узла меньше REG_COUNT соседей значимой степени"""
+    significant = 0
+    for n in graph[a] | graph[b]:
+        if len(graph[n]) >= REG_COUNT:
+            significant += 1
+            if significant == REG_COUNT:
+                return False
+    return True
+
+
+def george(graph: dict[int, set[int]], a: int, b: int) -> bool:
+    """Каждый значимый сосед b уже соседствует с a -- b можно влить в a"""
+    return all(len(graph[n]) < REG_COUNT or n in graph[a] for n in graph[b])
+
+
+def coalesce(graph: dict[int, set[int]], moves: list[tuple[int, int]]) -> dict[int, int]:
+    """Консервативное слияние (критерии Бриггса и Джорджа); возвращает представителя каждого слитого регистра"""
+    alias: dict[int, int] = {}
+
+    def find(reg):
+        while reg in alias:
+            reg = alias[reg]
+        return reg
+
+    changed = True
+    while changed:
+        changed = False
+        for src, dst in moves:
+            a, b = find(src), find(dst)
+            if a == b or b in graph[a]:
+                continue
+            if len(graph[a]) < len(graph[b]):
+                a, b = b, a
+            if not george(graph, a, b) and not briggs(graph, a, b):
+                continue
+            for n in graph.pop(b):
+                graph[n].discard(b)
+                graph[n].add(a)
+                graph[a].add(n)
+            alias[b] = a
+            changed = True
+    return {reg: find(reg) for reg in alias}
+
+
+def colour(graph: dict[int, set[int]], spillable=lambda reg: True) -> tuple[dict[int, int], list[int]]:
+    """Упрощение и выбор с оптимистичной раскраской; возвращает цвета и узлы, которым цвета не хватило.
+
+    Когда упрощать нечего, в стек уходит узел наибольшей степени среди тех, что можно выгрузить.
+    """
+    degree = {reg: len(neighbours) for reg, neighbours in graph.items()}
+    low = [reg for reg in graph if degree[reg] < REG_COUNT]
+    high = {reg for reg in graph if degree[reg] >= REG_COUNT}
+    removed: set[int] = set()
+    stack = []
+    while low or high:
+        if low:
+            reg = low.pop()
+        else:
+            reg = max(high, key=lambda n: (spillable(n), degree[n]))
+            high.discard(reg)
+        removed.add(reg)
+        stack.append(reg)
+        for n in graph[reg]:
+            if n not in removed:
+                degree[n] -= 1
+                if degree[n] == REG_COUNT - 1 and n in high:
+                    high.discard(n)
+                    low.append(n)
+
+    colours: dict[int, int] = {}
+    uncoloured = []
+    for reg in reversed(stack):
+        taken = {colours[n] for n in graph[reg] if n in colours}
+        free = [c for c in range(REG_COUNT) if c not in taken]
+        if free:
+            colours[reg] = free[0]
+        else:
+            uncoloured.append(reg)
+    return colours, uncoloured
+
+
+def variable_liveness(blocks: list[BasicBlock], text: list[Cell], labels: list[int], names: set[str],
+                      modified: set[str]) -> tuple[list[set[str]], list[set[str]]]:
+    """Живость ячеек names на входе и выходе блоков: ячейка жива, пока её прочитает LD раньше, чем перезапишет ST.
+    Изменённые ячейки живы и на выходе из программы, где эпилог сохраняет их регистры"""
+    gen: list[set[str]] = []
+    kill: list[set[str]] = []
+    exits: list[set[str]] = []
+    for block in blocks:
+        used, defined = set(), set()
+        for instr in text[block.start:block.end]:
+            if instr["opcode"] is Opcode.LD and instr["args"][0] in names and instr["args"][0] not in defined:
+                used.add(instr["args"][0])
+            elif instr["opcode"] is Opcode.ST and instr["args"][1] in names:
+                defined.add(instr["args"][1])
+        gen.append(used)
+        kill.append(defined)
+        last = text[block.end - 1]
+        leaves = (last["opcode"] in BRANCHES and branch_target(last, labels) == len(text)) or \
+            (last["opcode"] is not Opcode.JMP and block.end == len(text))
+        exits.append(names & modified if leaves else set())
+
+    live_in: list[set[str]] = [set() for _ in blocks]
+    live_out: list[set[str]] = [set() for _ in blocks]
+    changed = True
+    while changed:
+        changed = False
+        for number in reversed(range(len(blocks))):
+            out = set(exits[number])
+            for successor in blocks[number].successors:
+                out |= live_in[successor]
+            new_in = gen[number] | (out - kill[number])
+            if new_in != live_in[number] or out != live_out[number]:
+                live_in[number], live_out[number] = new_in, out
+                changed = True
+    return live_in, live_out
+
+
+class PromotionGraph:
+    """Граф конфликтов кода и рёбра регистров, в которые можно перенести переменные names.
+
+    Перенос превращает LD/ST переменной в MV с теми же виртуальными регистрами, поэтому
+    их живость и конфликты между ними не меняются и граф строится один раз. Регистр
+    переменной жив там же, где её ячейка; в edges и moves он обозначен именем
+    переменной, а пересылки, которые появляются только при её переносе, помечены им же.
+    """
+
+    def __init__(self, text: list[Cell], labels: list[int], names: set[str], modified: set[str]):
+        blocks = build_cfg(text, labels)
+        liveness(blocks, text, is_virtual)
+        names_in, names_out = variable_liveness(blocks, text, labels, names, modified)
+        self.graph: dict[int, set[int]] = {}
+        self.edges: dict[str, set] = {name: set() for name in names}
+        self.moves: list[tuple[int | str, int | str, str | None]] = []
+        # пролог загружает переменные до первой инструкции: живое на входе в программу
+        self.entry_regs = set(blocks[0].live_in) if blocks else set()
+        self.entry_names = names_in[0] if blocks else set()
+        graph, edges = self.graph, self.edges
+        for number, block in enumerate(blocks):
+            live = set(block.live_out)
+            live_names = set(names_out[number])
+            for instr in reversed(text[block.start:block.end]):
+                uses = [reg for reg in reg_uses(instr) if is_virtual(reg)]
+                defs = [reg for reg in reg_defs(instr) if is_virtual(reg)]
+                for reg in uses + defs:
+                    graph.setdefault(reg, set())
+                opcode = instr["opcode"]
+                loaded = instr["args"][0] if opcode is Opcode.LD and instr["args"][0] in names else None
+                stored = instr["args"][1] if opcode is Opcode.ST and instr["args"][1] in names else None
+                if opcode is Opcode.MV and uses and defs:
+                    self.moves.append((uses[0], defs[0], None))
+                    live.discard(uses[0])
+                for reg in defs:
+                    for other in live:
+                        if other != reg:
+                            graph[reg].add(other)
+                            graph.setdefault(other, set()).add(reg)
+                    # LD переменной становится MV из её регистра: с ним конфликта нет
+                    for name in live_names:
+                        if name != loaded:
+                            edges[name].add(reg)
+                if loaded is not None:
+                    if defs:
+                        self.moves.append((loaded, defs[0], loaded))
+                    live_names.add(loaded)
+                if stored is not None:
+                    # ST переменной становится MV в её регистр: он определяется здесь
+                    source = uses[0] if uses else None
+                    if source is not None:
+                        self.moves.append((source, stored, stored))
+                    edges[stored].update(other for other in live if other != source)
+                    for name in live_names:
+                        if name != stored:
+                            edges[stored].add(name)
+                            edges[name].add(stored)
+                    live_names.discard(stored)
+                live.difference_update(defs)
+                live.update(uses)
+
+    def promote(self, registers: dict[str, int]) -> tuple[dict[int, set[int]], list[tuple[int, int]]]:
+        """Граф и пересылки кода, в котором переменные registers перенесены в регистры (порядок -- порядок пролога)"""
+        graph = {reg: set(neighbours) for reg, neighbours in self.graph.items()}
+        for reg in registers.values():
+            graph[reg] = set()
+        loaded = []
+        for name, reg in registers.items():
+            # LD пролога определяет регистр, пока живы код на входе и загруженные раньше живые переменные
+            neighbours = set(self.entry_regs)
+            neighbours.update(registers[other] for other in loaded if other in self.entry_names)
+            for other in self.edges[name]:
+                if not isinstance(other, str):
+                    neighbours.add(other)
+                elif other in registers:
+                    neighbours.add(registers[other])
+            neighbours.discard(reg)
+            graph[reg] |= neighbours
+            for other in neighbours:
+                graph.setdefault(other, set()).add(reg)
+            loaded.append(name)
+
+        def physical(reg):
+            return registers[reg] if isinstance(reg, str) else reg
+
+        moves = [(physical(src), physical(dst)) for src, dst, name in self.moves if name is None or name in registers]
+        return graph, moves
+
+
+def try_allocate(promotion: PromotionGraph, registers: dict[str, int]):
+    """Представители слитых регистров и цвета при переменных registers в регистрах; None -- не раскрашивается"""
+    graph, moves = promotion.promote(registers)
+    alias = coalesce(graph, moves)
+    colours, uncoloured = colour(graph)
+    if uncoloured:
+        return None
+    return alias, colours
+
+
+def assign(virtual: list[Cell], registers: dict[str, int], modified: set[str], alias: dict[int, int],
+           colours: dict[int, int]):
+    """Замены для исходного кода, пролог и эпилог с физическими регистрами"""
+    chunks, head, tail = promote(virtual, registers, modified)
+
+    def physical(reg):
+        return colours[alias.get(reg, reg)] if is_virtual(reg) else reg
+
+    result = []
+    for i, [instr] in enumerate(chunks):
+        instr = with_regs(instr, physical)
+        following = virtual[i + 1]["opcode"] if i + 1 < len(virtual) else None
+        # MV в себя не нужен, если за ним не стоит переход по флагу, который он выставляет
+        if instr["opcode"] is Opcode.MV and instr["args"][0] == instr["args"][1] \
+                and following not in CONDITIONAL_BRANCHES:
+            result.append([])
+        else:
+            result.append([instr])
+    return result, [with_regs(instr, physical) for instr in head], [with_regs(instr, physical) for instr in tail]
+
+
+def spill(state, regs: set[int], next_reg: int) -> tuple[int, set[int]]:
+    """Каждое использование регистра из regs читает значение в новый короткоживущий регистр.
+
+    Значение, которое всегда задаёт один и тот же LDI, вычисляется заново, остальные
+    хранятся в ячейке "$spillN": ST после каждого определения, LD перед каждым чтением.
+    Возвращает следующий свободный номер и созданные регистры.
+    """
+    text = state.text
+    definitions: dict[int, list[Cell]] = {reg: [] for reg in regs}
+    for instr in text:
+        for reg in reg_defs(instr):
+            if reg in definitions:
+                definitions[reg].append(instr)
+    remat = {reg: instrs[0]["args"][0] for reg, instrs in definitions.items()
+             if instrs and all(instr["opcode"] is Opcode.LDI and instr["args"][0] == instrs[0]["args"][0]
+                               for instr in instrs)}
+    slots = {reg: "$spill%d" % reg for reg in regs if reg not in remat}
+    for name in slots.values():
+        state.add_var(name, 0)
+
+    created: set[int] = set()
+    chunks = []
+    for i, instr in enumerate(text):
+        opcode = instr["opcode"]
+        args = list(instr.get("args", []))
+        before, after = [], []
+        drop = False
+        for pos in REG_USES[opcode]:
+            if args[pos] in regs:
+                reg, args[pos] = args[pos], next_reg
+                if reg in remat:
+                    before.append({"opcode": Opcode.LDI, "args": [remat[reg], next_reg]})
+                else:
+                    before.append({"opcode": Opcode.LD, "args": [slots[reg], next_reg]})
+                created.add(next_reg)
+                next_reg += 1
+        for pos in REG_DEFS[opcode]:
+            if args[pos] in regs:
+                reg, args[pos] = args[pos], next_reg
+                created.add(next_reg)
+                if reg in remat:
+                    drop = not flag_checked(text, i)
+                else:
+                    after.append({"opcode": Opcode.ST, "args": [next_reg, slots[reg]]})
+                    # ST портит флаг; у ALU-операций он восстанавливается копированием результата,
+                    # у LD флаг (адрес == 0) совпадает с флагом ST: ячейки данных не бывают по нулевому адресу
+                    if flag_checked(text, i) and opcode is not Opcode.LD:
+                        after.append({"opcode": Opcode.MV, "args": [next_reg, next_reg]})
+                next_reg += 1
+        instr = {"opcode": opcode, "args": args} if "args" in instr else instr
+        chunks.append(before + ([] if drop else [instr]) + after)
+    state.rewrite(chunks)
+    return next_reg, created
+
+
+def promote_variables(state, next_reg: int):
+    """Переносит нагруженные переменные раскрашиваемого кода с виртуальными регистрами в регистры.
+
+    Граф конфликтов строится один раз; каждый кандидат добавляет к нему рёбра своего регистра.
+    """
+    modified = {instr["args"][1] for instr in state.text if instr["opcode"] is Opcode.ST}
+    weights = variable_weights(state.text, state.labels)
+    # переменная окупается, если обращений больше, чем инструкций в прологе и эпилоге
+    candidates = [name for name in sorted(weights, key=weights.get, reverse=True)
+                  if weights[name] > 1 + (name in modified)][:MAX_CANDIDATES]
+    promotion = PromotionGraph(state.text, state.labels, set(candidates), modified)
+    best = try_allocate(promotion, {})
+    assert best is not None, "Code must be colourable before promotion"
+    promoted: list[str] = []
+    for name in candidates:
+        attempt = try_allocate(promotion, {other: next_reg + i for i, other in enumerate(promoted + [name])})
+        if attempt is not None:
+            promoted.append(name)
+            best = attempt
+    registers = {name: next_reg + i for i, name in enumerate(promoted)}
+    state.rewrite(*assign(state.text, registers, modified, *best))
+
+
+def allocate_virtual(state, next_reg: int):
+    """Назначает R0-R3 коду с виртуальными регистрами (все номера меньше next_reg).
+
+    Пока граф не раскрашивается, не раскрашенные значения выгружаются; регистры,
+    созданные выгрузкой, живут одну инструкцию и повторно не выгружаются.
+    """
+    unspillable: set[int] = set()
+    while True:
+        graph, moves = interference(state.text, state.labels)
+        alias = coalesce(graph, moves)
+        members = {node: {node} for node in graph}
+        for reg, node in alias.items():
+            members[node].add(reg)
+        colours, uncoloured = colour(graph, lambda node: not members[node] & unspillable)
+        if not uncoloured:
+            break
+        spilled = {reg for node in uncoloured if not members[node] & unspillable for reg in members[node]}
+        if not spilled:
+            # не хватило регистра короткоживущему значению -- выгружается самый загруженный сосед
+            neighbours = [n for node in uncoloured for n in graph[node] if not members[n] & unspillable]
+            assert neighbours, "Not enough registers"
+            spilled = members[max(neighbours, key=lambda n: len(graph[n]))]
+        next_reg, created = spill(state, spilled, next_reg)
+        unspillable |= created
+    promote_variables(state, next_reg)
+
+
+def allocate_registers(state):
+    """Переносит нагруженные переменные в регистры"""
+    virtual, next_reg = rename_virtual(state.text, state.labels)
+    state.rewrite([[instr] for instr in virtual])
+    allocate_virtual(state, next_reg)
@@ -0,0 +1,127 @@
+"""Трассировка состояния процессора в буферизованные приёмники"""
+import csv
+import struct
+from collections import deque
+from enum import Enum
+from typing import BinaryIO, TextIO
+
+TRACE_FIELDS = ('instr', 'tick', 'pc', 'r0', 'r1', 'r2', 'r3', 'word')
+TraceRecord = tuple[int, int, int, int, int, int, int, int]
+
+
+class TraceLevel(str, Enum):
+    OFF = 'off'
+    SAMPLED = 'sample'
+    RING = 'ring'
+    FULL = 'full'
+
+
+class CsvTraceSink:
+    """Пишет записи в текстовый поток порциями по buffer_size строк; заголовок -- при первом flush,
+    поэтому неиспользованный приёмник ничего не пишет"""
+
+    def __init__(self, file: TextIO, buffer_size: int = 4096):
+        self._writer = csv.writer(file, lineterminator='\n')
+        self._file = file
+        self._buffer: list[TraceRecord] = []
+        self._buffer_size = buffer_size
+        self._header = True
+
+    def write(self, record: TraceRecord):
+        self._buffer.append(record)
+        if len(self._buffer) >= self._buffer_size:
+            self.flush()
+
+    def flush(self):
+        if self._header:
+            self._writer.writerow(TRACE_FIELDS)
+            self._header = False
+        self._writer.writerows(self._buffer)
+        self._buffer.clear()
+        self._file.flush()
+
+
+class BinaryTraceSink:
+    """Пишет записи фиксированной длины (little-endian) порциями по buffer_size записей"""
+    RECORD = struct.Struct('<QQiiiiii')
+
+    def __init__(self, file: BinaryIO, buffer_size: int = 4096):
+        self._file = file
+        self._buffer = bytearray(self.RECORD.size * buffer_size)
+        self._offset = 0
+
+    def write(self, record: TraceRecord):
+        self.RECORD.pack_into(self._buffer, self._offset, *record)
+        self._offset += self.RECORD.size
+        if self._offset == len(self._buffer):
+            self.flush()
+
+    def flush(self):
+        self._file.write(memoryview(self._buffer)[:self._offset])
+        self._offset = 0
+        self._file.flush()
+
+
+def snapshot(instr_counter: int, tick: int, registers: list[int], memory) -> TraceRecord:
+    pc = registers[4]
+    word = memory[pc] if 0 <= pc < len(memory) else 0
+    return (instr_counter, tick, pc, registers[0], registers[1], registers[2], registers[3], word)
+
+
+class Tracer:
+    """Полная трассировка: состояние после каждой инструкции.
+
+    Симуляция вызывает record каждые interval инструкций и close в конце
+    (с исключением, если исполнение завершилось ошибкой).
+    """
+    interval = 1
+
+    def __init__(self, sink):
+        self._sink = sink
+
+    def record(self, instr_counter: int, tick: int, registers: list[int], memory):
+        self._sink.write(snapshot(instr_counter, tick, registers, memory))
+
+    def close(self, error: BaseException | None = None):
+        self._sink.flush()
+
+
+class SampledTracer(Tracer):
+    """Состояние каждые every инструкций"""
+
+    def __init__(self, sink, every: int):
+        assert every > 0, "Sampling interval should be positive"
+        super().__init__(sink)
+        self.interval = every
+
+
+class RingTracer(Tracer):
+    """Последние size состояний; сбрасываются в приёмник только при ошибке"""
+
+    def __init__(self, sink, size: int):
+        assert size > 0, "Ring size should be positive"
+        super().__init__(sink)
+        self._ring: deque[TraceRecord] = deque(maxlen=size)
+
+    def record(self, instr_counter: int, tick: int, registers: list[int], memory):
+        self._ring.append(snapshot(instr_counter, tick, registers, memory))
+
+    def close(self, error: BaseException | None = None):
+        if error is not None:
+            for record in self._ring:
+                self._sink.write(record)
+        self._sink.flush()
+
+
+def make_tracer(spec: str, sink) -> Tracer | None:
+    """Трассировщик по описанию: off | full | sample:N | ring:K"""
+    level, _, arg = spec.partition(':')
+    level = TraceLevel(level)
+    if level is TraceLevel.OFF:
+        return None
+    if level is TraceLevel.FULL:
+        return Tracer(sink)
+    assert arg.isdigit(), "Trace level {} needs a size: {}:N".format(level.value, level.value)
+    if level is TraceLevel.SAMPLED:
+        return SampledTracer(sink, int(arg))
+    return RingTracer(sink, int(arg))
@@ -1,38 +1,179 @@
 from lexer import lex
+from concurrent.futures import ProcessPoolExecutor
+import glob
 import logging
 import os
 import re
 import sys
-import json
+import time
+from typing import NamedTuple
 
-from parser_cmm import parse_cmm
+from compile_cache import CompileCache, default_cache
+from isa import CodeImage, pack_code, text_size_of, unpack_code, write_code, write_code_binary
+from parser_cmm import parse_cmm, parser
 import ast_cmm
 
 
+def compile_source(text: str, optimizations=(), cache: CompileCache | None = None,
+                   engine: str = 'combinators') -> CodeImage:
+    """Трансляция в процессе: исходный текст -> скомпонованный образ в машинных словах, без вывода.
+    С кэшем попадание возвращает образ, отображённый из файла, без разбора и компоновки.
+    engine -- парсер parse_cmm; у 'rd' синтаксическая ошибка -- ParseError с позицией лексемы"""
+    key = cache.key(text, optimizations) if cache is not None else None
+    if key is not None:
+        image = cache.get(key)
+        if image is not None:
+            return image
+    tokens = lex(text)
+    if logging.getLogger().isEnabledFor(logging.DEBUG):
+        for token in tokens:
+            logging.debug("%s", token)
+    result = parse_cmm(tokens, engine=engine)
+    assert result is not None, "Syntax error"
+    ast = result.value
+    logging.debug("%s", ast)
+    code, symbols = ast_cmm.translate_with_symbols(ast, optimizations)
+    image = CodeImage(pack_code(code), text_size_of(code), symbols)
+    if key is not None:
+        cache.put(key, image)
+    return image
+
+
+def write_image(filename: str, image: CodeImage):
+    """Записывает образ (.bin -- бинарный формат, иначе JSON) во временный файл рядом и переименовывает:
+    файл с именем filename всегда целый"""
+    directory = os.path.dirname(filename)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    temp = "{}.{}.tmp".format(filename, os.getpid())
+    try:
+        if filename.endswith(".bin"):
+            write_code_binary(temp, image.words, image.text_size, image.symbols)
+        else:
+            write_code(temp, unpack_code(image.words, image.text_size))
+        os.replace(temp, filename)
+    except BaseException:
+        if os.path.exists(temp):
+            os.remove(temp)
+        raise
+
+
+class BatchResult(NamedTuple):
+    """Итог трансляции файла пакета; error -- None или текст исключения"""
+    source: str
+    output: str
+    seconds: float
+    error: str | None
+
+
+def translate_file(source: str, output: str, optimizations=(), cache: CompileCache | None = None) -> BatchResult:
+    start = time.perf_counter()
+    error = None
+    try:
+        with open(source, "rt") as input_file:
+            write_image(output, compile_source(input_file.read(), optimizations, cache))
+    except Exception as exception:
+        error = "{}: {}".format(type(exception).__name__, exception)
+    return BatchResult(source, output, time.perf_counter() - start, error)
+
+
+_worker_cache: CompileCache | None = None
+
+
+def _init_worker():
+    """Прогрев процесса пула: грамматика и кэш создаются один раз и служат всем его файлам"""
+    global _worker_cache
+    # дампы лексем и дерева из параллельных процессов перемешались бы
+    logging.getLogger().setLevel(logging.INFO)
+    parser()
+    _worker_cache = default_cache()
+
+
+def _translate_job(job) -> BatchResult:
+    source, output, optimizations = job
+    return translate_file(source, output, optimizations, _worker_cache)
+
+
+def is_batch_input(name: str) -> bool:
+    return os.path.isdir(name) or glob.has_magic(name)
+
+
+def find_sources(pattern: str) -> list[tuple[str, str]]:
+    """(путь, имя для шаблона результата): для каталога -- все .cmm в нём рекурсивно с путём относительно
+    каталога, для шаблона glob -- совпавшие файлы и их имена"""
+    if os.path.isdir(pattern):
+        sources = glob.glob(os.path.join(pattern, "**", "*.cmm"), recursive=True)
+        return sorted((source, os.path.relpath(source, pattern)[:-len(".cmm")]) for source in sources)
+    sources = glob.glob(pattern, recursive=True)
+    return sorted((source, os.path.basename(source)[:-len(".cmm")]) for source in sources if source.endswith(".cmm"))
+
+
+def translate_batch(pattern: str, output_pattern: str | None = None, optimizations=(),
+                    workers: int | None = None) -> list[BatchResult]:
+    """Транслирует все исходники каталога или шаблона glob в пуле процессов.
+
+    Имя результата -- output_pattern, где '*' заменяется именем исходника без .cmm,
+    без шаблона -- .json рядом с исходником. Ошибка файла не прерывает пакет, а
+    попадает в его BatchResult.
+    """
+    for name in optimizations:
+        assert name in ast_cmm.OPTIMIZATION_NAMES, "Unknown optimization %s" % name
+    assert output_pattern is None or "*" in output_pattern, "Output pattern should contain '*'"
+    jobs = []
+    for source, stem in find_sources(pattern):
+        output = source[:-len("cmm")] + "json" if output_pattern is None else output_pattern.replace("*", stem)
+        jobs.append((source, output, tuple(optimizations)))
+    assert len({output for _, output, _ in jobs}) == len(jobs), "Output file names collide"
+    if not jobs:
+        return []
+    workers = workers or os.cpu_count() or 1
+    # несколько порций на процесс: крупные файлы не задерживают остальные
+    chunksize = max(1, len(jobs) // (workers * 4))
+    with ProcessPoolExecutor(min(workers, len(jobs)), initializer=_init_worker) as pool:
+        return list(pool.map(_translate_job, jobs, chunksize=chunksize))
+
+
+def print_summary(results: list[BatchResult], wall: float):
+    for result in results:
+        status = "ok" if result.error is None else result.error
+        print("{:>10.1f} ms  {} -> {}: {}".format(result.seconds * 1000, result.source, result.output, status))
+    failed = sum(result.error is not None for result in results)
+    print("files: {}, failed: {}, translation: {:.2f} s, wall: {:.2f} s".format(
+        len(results), failed, sum(result.seconds for result in results), wall))
+
+
+def main_batch(args) -> None:
+    assert 1 <= len(args) <= 4, "Wrong arguments: translator.py <directory|glob> <(Optional) output pattern, '*' -- source name> <(Optional) optimizations> <(Optional) workers>"
+    output_pattern = args[1] or None if len(args) >= 2 else None
+    optimizations = [name for name in args[2].split(",") if name] if len(args) >= 3 else []
+    workers = int(args[3]) if len(args) == 4 else None
+    start = time.perf_counter()
+    results = translate_batch(args[0], output_pattern, optimizations, workers)
+    print_summary(results, time.perf_counter() - start)
+    failed = [result for result in results if result.error is not None]
+    assert results, "No .cmm files match {}".format(args[0])
+    assert not failed, "{} of {} files failed".format(len(failed), len(results))
+
 
 def main(args) -> None:
-    assert len(args) == 1 or len(args) == 2, "Wrong arguments: translator.py <input_file_name> <(Optional) output_file_name>"
+    if args and is_batch_input(args[0]):
+        main_batch(args)
+        return
+    assert 1 <= len(args) <= 3, "Wrong arguments: translator.py <input_file_name|directory|glob> <(Optional) output_file_name> <(Optional) optimizations: {}>".format(",".join(ast_cmm.OPTIMIZATION_NAMES))
     cmm_re = re.compile(r"\.cmm$")
     input_file_name = args[0]
     assert cmm_re.search(input_file_name) != None, "Input file should be .cmm"
     assert os.path.exists(input_file_name), "Input file does not exists"
     output_file_name = input_file_name[:-3] + "json"
-    if (len(args) == 2):
+    if (len(args) >= 2):
         output_file_name = args[1]
+    optimizations = args[2].split(",") if len(args) == 3 else []
         
     with open(input_file_name, "rt") as input_file:
         input_text = input_file.read()
-    tokens = lex(input_text)
-    for token in tokens:
-        print(token)
-    result = parse_cmm(tokens)
-    print(result.value)
-    text = ast_cmm.translate(result.value)
-    
-    with open(output_file_name, "wt") as output_file:
-        output_file.write(json.dumps(text, indent=4))
+    write_image(output_file_name, compile_source(input_text, optimizations, default_cache()))
     
     
 if __name__ == '__main__':
-    logging.getLogger().setLevel(logging.DEBUG)
+    logging.basicConfig(stream=sys.stdout, level=logging.DEBUG, format="%(message)s")
     main(sys.argv[1:])
\ No newline at end of file